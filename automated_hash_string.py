@@ -1,13 +1,17 @@
 import hashlib
 
-String = str(input("Type out the word you would like to hash "))
-Hash_Type = str(input("Type your prefered hash type. SHA or MD5"))
+# The SHA-256 or MD5 hex digest of `String`, or "Invalid hash type"
+def hash_string(String, Hash_Type):
+	if Hash_Type == "SHA":
+		return hashlib.sha256(String.encode()).hexdigest()
+	elif Hash_Type == "MD5":
+		return hashlib.md5(String.encode()).hexdigest()
+	return "Invalid hash type"
 
-if Hash_Type == "SHA":
-	Final_Hash = hashlib.sha256(String.encode()).hexdigest()
-elif Hash_Type == "MD5":
-	Final_Hash = hashlib.md5(String.encode()).hexdigest()
-else:
-	Final_Hash = "Invalid hash type"
+def main():
+	String = str(input("Type out the word you would like to hash "))
+	Hash_Type = str(input("Type your prefered hash type. SHA or MD5"))
+	print(hash_string(String, Hash_Type))
 
-print(Final_Hash)
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+# Batch hashing for files and streams, the bulk counterpart of
+# automated_hash_string.py. Any hashlib algorithm works, BLAKE2 and SHAKE with
+# an optional output size in bits ("blake2b-256", "shake_128-256"); SHA and MD5
+# mean SHA-256 and MD5 as in the old script. Every file is read once into a
+# reused buffer and that buffer feeds all the requested digests, and files are
+# hashed on a thread pool since hashlib drops the GIL for large updates.
+#   batch_hash.py -a sha256 -r /srv/artifacts > artifacts.sha256
+#   batch_hash.py -a sha256 -a blake2b --tag release/*.tar.gz
+#   batch_hash.py -c artifacts.sha256
+import argparse
+import collections
+import hashlib
+import mmap
+import os
+import re
+import stat
+import sys
+import threading
+from concurrent import futures
+
+ALIASES = {'sha': 'sha256', 'sha-256': 'sha256', 'sha-1': 'sha1', 'sha-512': 'sha512'}
+# Algorithms whose output size can be chosen
+SIZED = ('blake2b', 'blake2s', 'shake_128', 'shake_256')
+BUFFER_SIZE = 1 << 20
+
+FileDigest = collections.namedtuple('FileDigest', 'path size digests error')
+
+# Name and output size in bytes (None for the algorithm's own) of an
+# algorithm spec
+def parse_algorithm(spec):
+    name = spec.lower()
+    name = ALIASES.get(name, name)
+    if name in hashlib.algorithms_available:
+        size = 32 if name.startswith('shake_') else None
+    else:
+        match = re.fullmatch(r'(\w+)[-:](\d+)', name)
+        if not match or match.group(1) not in SIZED or int(match.group(2)) % 8:
+            raise ValueError(f"Unknown hash algorithm: {spec}")
+        name, size = match.group(1), int(match.group(2)) // 8
+    try:
+        new_hasher(name, size)
+    except ValueError as e:
+        raise ValueError(f"Bad hash algorithm {spec}: {e}")
+    return name, size
+
+def new_hasher(name, size):
+    if size is not None and name.startswith('blake2'):
+        return hashlib.new(name, digest_size=size)
+    return hashlib.new(name)
+
+# How a digest is labelled in manifests: "sha256", "blake2b-256"
+def algorithm_label(name, size):
+    if size is None or (name.startswith('shake_') and size == 32):
+        return name
+    return f"{name}-{size * 8}"
+
+# The digests being computed over one stream
+class MultiHash:
+    def __init__(self, algorithms):
+        self.algorithms = algorithms
+        self.hashers = [new_hasher(name, size) for name, size in algorithms]
+
+    def update(self, data):
+        for hasher in self.hashers:
+            hasher.update(data)
+
+    def hexdigests(self):
+        digests = {}
+        for (name, size), hasher in zip(self.algorithms, self.hashers):
+            label = algorithm_label(name, size)
+            digests[label] = hasher.hexdigest(size) if name.startswith('shake_') else hasher.hexdigest()
+        return digests
+
+# Each pool thread keeps its own buffer for the whole batch
+_buffers = threading.local()
+
+def _buffer(size):
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != size:
+        buffer = _buffers.buffer = bytearray(size)
+    return buffer
+
+# Hash a binary stream in place in a reused buffer. Returns the byte count and
+# the digests.
+def hash_stream(stream, algorithms, buffer_size=BUFFER_SIZE):
+    digest = MultiHash(algorithms)
+    buffer = _buffer(buffer_size)
+    view = memoryview(buffer)
+    total = 0
+    while True:
+        count = stream.readinto(buffer)
+        if not count:
+            return total, digest.hexdigests()
+        digest.update(view[:count])
+        total += count
+
+# Hash a mapped file without copying it; each digest is fed a buffer-sized
+# window in turn so the data is still in cache for the next one
+def hash_mapped(file, algorithms, buffer_size=BUFFER_SIZE):
+    digest = MultiHash(algorithms)
+    size = os.fstat(file.fileno()).st_size
+    if size:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for start in range(0, size, buffer_size):
+                    digest.update(view[start:start + buffer_size])
+    return size, digest.hexdigests()
+
+def hash_file(path, algorithms, buffer_size=BUFFER_SIZE, use_mmap=False):
+    try:
+        if path == '-':
+            size, digests = hash_stream(sys.stdin.buffer, algorithms, buffer_size)
+        else:
+            # Unbuffered, so readinto() goes straight from the kernel to our buffer
+            with open(path, 'rb', buffering=0) as file:
+                if hasattr(os, 'posix_fadvise'):
+                    try:
+                        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    except OSError:  # Pipes and other special files
+                        pass
+                if use_mmap and stat.S_ISREG(os.fstat(file.fileno()).st_mode):
+                    size, digests = hash_mapped(file, algorithms, buffer_size)
+                else:
+                    size, digests = hash_stream(file, algorithms, buffer_size)
+        return FileDigest(path, size, digests, None)
+    except OSError as e:
+        return FileDigest(path, None, None, e.strerror or str(e))
+
+# Hash many files on a thread pool; results come back in the order given.
+# Only a few files per thread are queued at a time, so `paths` can be a lazy
+# walk over millions of files.
+def hash_files(paths, algorithms, workers=None, buffer_size=BUFFER_SIZE, use_mmap=False):
+    if workers == 1:
+        for path in paths:
+            yield hash_file(path, algorithms, buffer_size, use_mmap)
+        return
+    # ThreadPoolExecutor's own default
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for path in paths:
+            pending.append(executor.submit(hash_file, path, algorithms, buffer_size, use_mmap))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# Files under `paths`, directories walked in sorted order when `recursive`
+def expand_paths(paths, recursive=False):
+    for path in paths:
+        if recursive and os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+def hash_string(text, algorithm='sha256'):
+    digest = MultiHash([parse_algorithm(algorithm)])
+    digest.update(text.encode())
+    return next(iter(digest.hexdigests().values()))
+
+# Manifest lines. One algorithm gives the sha256sum format ("digest  path"),
+# several give the BSD tag format ("SHA256 (path) = digest"), one per line.
+def manifest_lines(result, tag=False):
+    if len(result.digests) == 1 and not tag:
+        (digest,) = result.digests.values()
+        yield f"{digest}  {result.path}"
+    else:
+        for label, digest in result.digests.items():
+            yield f"{label.upper()} ({result.path}) = {digest}"
+
+TAG_LINE = re.compile(r'([\w-]+) \((.*)\) = ([0-9a-fA-F]+)$')
+PLAIN_LINE = re.compile(r'([0-9a-fA-F]+) [ *](.*)$')
+
+# Expected digests per file from a manifest, {path: {label: digest}}.
+# `default` names the algorithm of lines in sha256sum format.
+def read_manifest(lines, default='sha256'):
+    expected = collections.OrderedDict()
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('#'):
+            continue
+        match = TAG_LINE.match(line)
+        if match:
+            label, path, digest = match.groups()
+        else:
+            match = PLAIN_LINE.match(line)
+            if not match:
+                raise ValueError(f"Line {number} is not a manifest entry")
+            label, (digest, path) = default, match.groups()
+        expected.setdefault(path, {})[algorithm_label(*parse_algorithm(label))] = digest.lower()
+    return expected
+
+# Hash the files in a manifest and report each one; returns the number of
+# files that are missing or do not match
+def check_manifest(expected, workers=None, buffer_size=BUFFER_SIZE, use_mmap=False, out=sys.stdout):
+    algorithms = {}
+    for digests in expected.values():
+        for label in digests:
+            algorithms.setdefault(label, parse_algorithm(label))
+    failures = 0
+    paths = list(expected)
+    for result in hash_files(paths, list(algorithms.values()), workers, buffer_size, use_mmap):
+        if result.error:
+            status = f"FAILED open or read ({result.error})"
+        elif all(result.digests[label] == digest for label, digest in expected[result.path].items()):
+            status = "OK"
+        else:
+            status = "FAILED"
+        if status != "OK":
+            failures += 1
+        print(f"{result.path}: {status}", file=out)
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hash files and streams, several digests in one pass')
+    parser.add_argument('paths', nargs='*', default=['-'], help='files to hash, - for stdin')
+    parser.add_argument('-a', '--algorithm', action='append',
+                        help='hashlib algorithm, repeatable (default: sha256); '
+                             'blake2b/blake2s/shake take a size in bits, e.g. blake2b-256')
+    parser.add_argument('-r', '--recursive', action='store_true', help='hash the files under directories')
+    parser.add_argument('-s', '--string', help='hash this string instead of files')
+    parser.add_argument('-c', '--check', metavar='MANIFEST', help='verify the files listed in a manifest')
+    parser.add_argument('--tag', action='store_true', help='BSD tag format even for one algorithm')
+    parser.add_argument('--workers', type=int, help='files hashed at once (default: chosen by Python)')
+    parser.add_argument('--buffer-size', type=int, default=BUFFER_SIZE, help='read size in bytes')
+    parser.add_argument('--mmap', action='store_true', help='map files instead of reading them')
+    args = parser.parse_args(argv)
+
+    try:
+        algorithms = [parse_algorithm(spec) for spec in args.algorithm or ['sha256']]
+        if args.string is not None:
+            digest = MultiHash(algorithms)
+            digest.update(args.string.encode())
+            for line in manifest_lines(FileDigest('-', None, digest.hexdigests(), None), args.tag):
+                print(line)
+            return 0
+        if args.check:
+            with open(args.check, 'r') as file:
+                expected = read_manifest(file, algorithm_label(*algorithms[0]))
+            failures = check_manifest(expected, args.workers, args.buffer_size, args.mmap)
+            if failures:
+                print(f"{failures} of {len(expected)} files FAILED", file=sys.stderr)
+            return 1 if failures else 0
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    errors = 0
+    paths = expand_paths(args.paths, args.recursive)
+    for result in hash_files(paths, algorithms, args.workers, args.buffer_size, args.mmap):
+        if result.error:
+            print(f"{result.path}: {result.error}", file=sys.stderr)
+            errors += 1
+            continue
+        for line in manifest_lines(result, args.tag):
+            print(line)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
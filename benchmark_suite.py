@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+# Throughput of the scripts in this repository on synthetic fixtures, so every
+# performance change can be measured and guarded. Each benchmark builds its
+# fixture, runs the work a few times and keeps the best run. Results go to a
+# JSON file and are compared against a baseline saved the same way; a rate that
+# falls more than the tolerance below its baseline is a regression.
+#   benchmark_suite.py -o baseline.json
+#   benchmark_suite.py --baseline baseline.json
+#   benchmark_suite.py -b caesar -b packet_decode --scale 0.1
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+
+import caesar_cypher
+import check_cron_jobs
+import classic_cipher
+import get_active_users
+import packet_sniffer
+import playfair_cypher
+import port_scanner
+import vigenere_cypher
+from port_scanner_benchmark import bind_listeners
+
+# Benchmarks by name. Each is a context manager that sets up its fixture at
+# `scale` times the default size and yields the work to time, how much it
+# does per run and the unit of the rate.
+BENCHMARKS = {}
+
+def benchmark(function):
+    BENCHMARKS[function.__name__[len('bench_'):]] = contextlib.contextmanager(function)
+    return function
+
+def _text(size, seed=1):
+    rng = random.Random(seed)
+    words = ['the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'Attack', 'at', 'DAWN', '1984,']
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        parts.append(word)
+        length += len(word) + 1
+    return ' '.join(parts)[:size]
+
+@benchmark
+def bench_caesar(scale):
+    text = _text(int(8000000 * scale))
+    yield lambda: caesar_cypher.encrypt(text, 13), len(text) / 1e6, 'MB/s'
+
+@benchmark
+def bench_vigenere(scale):
+    text = _text(int(8000000 * scale)).upper()
+    key = vigenere_cypher.generateKey(text, 'LEMON')
+    yield lambda: vigenere_cypher.cipherText(text, key), len(text) / 1e6, 'MB/s'
+
+@benchmark
+def bench_playfair(scale):
+    text = _text(int(1000000 * scale))
+    yield lambda: playfair_cypher.playfair('playfair example', text), len(text) / 1e6, 'MB/s'
+
+# Ethernet frames as a busy trunk port carries them: TCP and UDP over IPv4 and
+# IPv6, some VLAN tagged, with ICMP and ARP mixed in
+def synthetic_frames(count, seed=1):
+    rng = random.Random(seed)
+    macs = b'\x00\x11\x22\x33\x44\x55\x66\x77\x88\x99\xaa\xbb'
+    frames = []
+    for _ in range(count):
+        kind = rng.random()
+        sport, dport = rng.randrange(1024, 65536), rng.choice((22, 53, 80, 443))
+        if kind < 0.1:
+            ethertype, payload = 0x0806, bytes(28)
+        else:
+            if kind < 0.5:
+                transport = struct.pack('!HHLLBBHHH', sport, dport, 1, 2, 0x50, 0x18, 1024, 0, 0) + bytes(64)
+                protocol = 6
+            elif kind < 0.9:
+                transport = struct.pack('!HHHH', sport, dport, 72, 0) + bytes(64)
+                protocol = 17
+            else:
+                transport = struct.pack('!BBHHH', 8, 0, 0, 1, 1) + bytes(56)
+                protocol = 1
+            if rng.random() < 0.7:
+                ethertype = 0x0800
+                payload = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(transport), 1, 0, 64, protocol, 0,
+                                      rng.randbytes(4), rng.randbytes(4)) + transport
+            else:
+                ethertype = 0x86dd
+                protocol = 58 if protocol == 1 else protocol
+                payload = struct.pack('!IHBB16s16s', 6 << 28, len(transport), protocol, 64,
+                                      rng.randbytes(16), rng.randbytes(16)) + transport
+        tag = struct.pack('!HH', 0x8100, rng.randrange(1, 4095)) if rng.random() < 0.3 else b''
+        frames.append(macs + tag + struct.pack('!H', ethertype) + payload)
+    return frames
+
+@benchmark
+def bench_packet_decode(scale):
+    frames = synthetic_frames(int(100000 * scale))
+
+    def work():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for frame in frames:
+                packet_sniffer.parse_packet(frame)
+    yield work, len(frames), 'packets/s'
+
+# Syslog lines over the last two hours, one in four from cron
+def synthetic_syslog(count, now, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        stamp = (now - datetime.timedelta(seconds=7200 * (count - i) / count)).strftime('%b %d %H:%M:%S')
+        if rng.random() < 0.25:
+            lines.append(f"{stamp} host CRON[{rng.randrange(1000, 99999)}]: (root) CMD (run-parts /etc/cron.hourly)\n")
+        else:
+            lines.append(f"{stamp} host kernel: [{i}.000000] eth0: link is up at {rng.choice((100, 1000))} Mbps\n")
+    return lines
+
+@benchmark
+def bench_cron_parse(scale):
+    lines = synthetic_syslog(int(500000 * scale), datetime.datetime.now())
+    threshold = datetime.timedelta(minutes=60)
+    yield lambda: check_cron_jobs.parse_cron_entries(lines, threshold), len(lines), 'lines/s'
+
+@benchmark
+def bench_active_users(scale):
+    count = int(200000 * scale)
+    with tempfile.NamedTemporaryFile('w', suffix='.passwd') as file:
+        file.write('root:x:0:0:root:/root:/bin/bash\nnobody:x:65534:65534:nobody:/nonexistent:/usr/sbin/nologin\n')
+        for i in range(count):
+            uid = 100 + i * 7 % 5000
+            file.write(f"user{i}:x:{uid}:{uid}:User {i}:/home/user{i}:/bin/bash\n")
+        file.flush()
+
+        # Every run parses the file again rather than hitting the stat cache
+        def work():
+            get_active_users._file_cache.clear()
+            return get_active_users.get_active_users('files', file.name)
+        yield work, count + 2, 'entries/s'
+
+@benchmark
+def bench_find_port(scale):
+    span = max(100, int(5000 * scale))
+    base = 30000
+    listeners = bind_listeners(range(base, base + span, max(1, span // 50)), 50)
+    ports = range(base, base + span)
+    try:
+        def work():
+            with contextlib.redirect_stdout(io.StringIO()):
+                return port_scanner.find_port('127.0.0.1', 1.0, ports)
+        yield work, len(ports), 'probes/s'
+    finally:
+        for sock in listeners:
+            sock.close()
+
+def run_benchmark(name, scale=1.0, repeat=3):
+    with BENCHMARKS[name](scale) as (work, amount, unit):
+        work()  # warm caches and lazy tables first
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            work()
+            times.append(time.perf_counter() - start)
+    best = min(times)
+    return {'rate': amount / best, 'unit': unit, 'best': best, 'times': times, 'amount': amount}
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'cpus': os.cpu_count(),
+        'numpy': classic_cipher.np is not None,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+# (name, rate, baseline rate, change) for every benchmark in both runs, and
+# the names of those that regressed by more than `tolerance`
+def compare(results, baseline, tolerance=0.1):
+    rows, regressions = [], []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None or before.get('unit') != result['unit']:
+            rows.append((name, result, None, None))
+            continue
+        change = result['rate'] / before['rate'] - 1
+        rows.append((name, result, before['rate'], change))
+        if change < -tolerance:
+            regressions.append(name)
+    return rows, regressions
+
+def format_rate(rate):
+    for factor, suffix in ((1e9, 'G'), (1e6, 'M'), (1e3, 'k')):
+        if rate >= factor:
+            return f"{rate / factor:.2f}{suffix}"
+    return f"{rate:.2f}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the scripts and track regressions')
+    parser.add_argument('-b', '--benchmark', action='append', choices=sorted(BENCHMARKS),
+                        help='benchmark to run, repeatable (default: all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='fixture size relative to the default')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark; the best counts')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='slowdown against the baseline that counts as a regression (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        try:
+            with open(args.baseline, 'r') as file:
+                baseline = json.load(file)['results']
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"Cannot read the baseline: {e}")
+
+    results = {}
+    for name in args.benchmark or BENCHMARKS:
+        results[name] = run_benchmark(name, args.scale, args.repeat)
+        rows, _ = compare({name: results[name]}, baseline, args.tolerance)
+        _, result, before, change = rows[0]
+        line = f"{name:<16} {format_rate(result['rate']):>9} {result['unit']:<10}"
+        if before is not None:
+            line += f" baseline {format_rate(before):>9}  {change:+7.1%}"
+        print(line.rstrip())
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': environment(), 'scale': args.scale, 'results': results}, file, indent=2)
+            file.write('\n')
+    _, regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"REGRESSION: {', '.join(regressions)} slower than the baseline by more than "
+              f"{args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,478 @@
+# Small tcpdump-style filter expressions for packet_sniffer, e.g.
+#   "tcp and port 443"    "udp and host 10.0.0.5"    "not arp and (src net 10.0.0.0/8)"
+# An expression compiles to a classic BPF program that the kernel runs on every
+# frame (SO_ATTACH_FILTER), and to a Python predicate over the raw frame bytes
+# for when the program cannot be attached. Frames may carry up to two 802.1Q or
+# 802.1ad tags. tcp, udp, port, host and net match IPv4 and IPv6 alike; over
+# IPv6 only the fixed header's next header is looked at, so a transport behind
+# extension headers does not match.
+import ctypes
+import ipaddress
+import re
+import socket
+import struct
+
+SO_ATTACH_FILTER = getattr(socket, 'SO_ATTACH_FILTER', 26)
+
+# Classic BPF opcodes (linux/filter.h)
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_LD_H_IND = 0x48
+BPF_LDX_B_MSH = 0xb1
+BPF_ALU_AND_K = 0x54
+BPF_JA = 0x05
+BPF_JEQ_K = 0x15
+BPF_JSET_K = 0x45
+BPF_RET_K = 0x06
+
+SOCK_FILTER = struct.Struct('HBBI')
+ACCEPT_LENGTH = 0x40000
+# The most instructions the kernel takes in one program
+BPF_MAXINSNS = 4096
+
+ETHERTYPES = {'ip': 0x0800, 'arp': 0x0806, 'ip6': 0x86dd}
+VLAN_ETHERTYPES = (0x8100, 0x88a8)
+# Protocol numbers by name, over IPv4 and over IPv6 (None where it does not apply)
+IP_PROTOCOLS = {'icmp': (1, None), 'icmp6': (None, 58), 'tcp': (6, 6), 'udp': (17, 17)}
+TCP_UDP = (6, 17)
+# Offsets into the IPv4 and IPv6 headers
+IPV4_PROTOCOL, IPV4_FRAGMENT, IPV4_SRC, IPV4_DST = 9, 6, 12, 16
+IPV6_NEXT_HEADER, IPV6_SRC, IPV6_DST, IPV6_HEADER = 6, 8, 24, 40
+
+WORD = struct.Struct('!I')
+PORT = struct.Struct('!H')
+
+# Parsing
+
+def tokenize(expression):
+    return re.findall(r'\(|\)|&&|\|\||!|[^\s()!]+', expression)
+
+# Recursive descent over: expr := term (or term)*, term := factor (and factor)*,
+# factor := not factor | ( expr ) | primitive. Returns a tuple tree.
+class Parser:
+    def __init__(self, expression):
+        self.tokens = tokenize(expression)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Unexpected end of filter expression")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty filter expression")
+        node = self.expr()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected '{self.peek()}' in filter expression")
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek() in ('or', '||'):
+            self.take()
+            node = ('or', node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() in ('and', '&&'):
+            self.take()
+            node = ('and', node, self.factor())
+        return node
+
+    def factor(self):
+        token = self.take()
+        if token in ('not', '!'):
+            return ('not', self.factor())
+        if token == '(':
+            node = self.expr()
+            if self.take() != ')':
+                raise ValueError("Missing ')' in filter expression")
+            return node
+        return self.primitive(token)
+
+    def primitive(self, token):
+        if token in IP_PROTOCOLS:
+            return ('proto', *IP_PROTOCOLS[token])
+        if token in ETHERTYPES:
+            return ('ether', ETHERTYPES[token])
+        direction = None
+        if token in ('src', 'dst'):
+            direction, token = token, self.take()
+        if token in ('host', 'net'):
+            network = ipaddress.ip_network(self.take(), strict=False)
+            if token == 'host' and network.num_addresses != 1:
+                raise ValueError(f"'host' takes an address, not {network}")
+            return ('net', direction, network.version, int(network.network_address),
+                    int(network.netmask))
+        if token == 'port':
+            port = int(self.take())
+            if not 0 <= port <= 0xffff:
+                raise ValueError(f"Invalid port {port} in filter expression")
+            return ('port', direction, port)
+        raise ValueError(f"Unknown filter primitive '{token}'")
+
+def parse_filter(expression):
+    return Parser(expression).parse()
+
+# (offset, mask, value) of every 32-bit word of an address that `mask` does not
+# ignore entirely
+def address_words(words, address, mask):
+    shift = 32 * (words - 1)
+    compared = []
+    for word in range(words):
+        word_mask = mask >> (shift - 32 * word) & 0xffffffff
+        if word_mask:
+            compared.append((4 * word, word_mask, address >> (shift - 32 * word) & word_mask))
+    return compared
+
+# BPF code generation. Every node is compiled with a "true" and a "false" label
+# to jump to, which gives short-circuit and/or/not without a value stack.
+
+# An expression that has no classic BPF program: a conditional jump would have
+# to go further than 255 instructions, or the program is longer than the kernel
+# allows. The expression still has its predicate.
+class ProgramTooLarge(ValueError):
+    pass
+
+class Label:
+    __slots__ = ('pos',)
+
+    def __init__(self):
+        self.pos = None
+
+# Code for a node is generated for one link layer length at a time: `link` is
+# the offset of the network header, 14 for untagged frames plus 4 per VLAN tag.
+class CodeGen:
+    def __init__(self, link=14):
+        self.code = []
+        self.link = link
+
+    def emit(self, code, k=0, jt=None, jf=None):
+        self.code.append([code, jt, jf, k])
+
+    def place(self, label):
+        label.pos = len(self.code)
+
+    def jeq(self, k, jt, jf):
+        self.emit(BPF_JEQ_K, k, jt, jf)
+
+    def ether(self, ethertype, t, f):
+        self.emit(BPF_LD_H_ABS, self.link - 2)
+        self.jeq(ethertype, t, f)
+
+    # Branch on the network protocol: returns the labels to place before the
+    # IPv4 and the IPv6 code, None for a family that is not wanted
+    def families(self, ipv4, ipv6, f):
+        labels = (Label() if ipv4 else None, Label() if ipv6 else None)
+        self.emit(BPF_LD_H_ABS, self.link - 2)
+        if ipv4 and ipv6:
+            other = Label()
+            self.jeq(ETHERTYPES['ip'], labels[0], other)
+            self.place(other)
+            self.jeq(ETHERTYPES['ip6'], labels[1], f)
+        elif ipv4:
+            self.jeq(ETHERTYPES['ip'], labels[0], f)
+        else:
+            self.jeq(ETHERTYPES['ip6'], labels[1], f)
+        return labels
+
+    # Jump to t if any of the halfwords at `offsets` is `value`
+    def any_halfword(self, offsets, value, t, f, indirect=False):
+        for i, offset in enumerate(offsets):
+            miss = f if i == len(offsets) - 1 else Label()
+            self.emit(BPF_LD_H_IND if indirect else BPF_LD_H_ABS, offset)
+            self.jeq(value, t, miss)
+            if miss is not f:
+                self.place(miss)
+
+    # Jump to t if the address at any of `offsets`, `words` 32-bit words long,
+    # matches `address` under `mask`
+    def any_address(self, offsets, words, address, mask, t, f):
+        compared = address_words(words, address, mask)
+        if not compared:  # a /0 matches everything of its family
+            self.emit(BPF_JA, t)
+            return
+        for i, offset in enumerate(offsets):
+            miss = f if i == len(offsets) - 1 else Label()
+            for j, (at, word_mask, value) in enumerate(compared):
+                same = t if j == len(compared) - 1 else Label()
+                self.emit(BPF_LD_W_ABS, offset + at)
+                if word_mask != 0xffffffff:
+                    self.emit(BPF_ALU_AND_K, word_mask)
+                self.jeq(value, same, miss)
+                if same is not t:
+                    self.place(same)
+            if miss is not f:
+                self.place(miss)
+
+    def node(self, node, t, f):
+        kind = node[0]
+        link = self.link
+        if kind == 'and':
+            middle = Label()
+            self.node(node[1], middle, f)
+            self.place(middle)
+            self.node(node[2], t, f)
+        elif kind == 'or':
+            middle = Label()
+            self.node(node[1], t, middle)
+            self.place(middle)
+            self.node(node[2], t, f)
+        elif kind == 'not':
+            self.node(node[1], f, t)
+        elif kind == 'ether':
+            self.ether(node[1], t, f)
+        elif kind == 'proto':
+            _, ipv4_protocol, ipv6_protocol = node
+            ipv4, ipv6 = self.families(ipv4_protocol is not None, ipv6_protocol is not None, f)
+            if ipv4:
+                self.place(ipv4)
+                self.emit(BPF_LD_B_ABS, link + IPV4_PROTOCOL)
+                self.jeq(ipv4_protocol, t, f)
+            if ipv6:
+                self.place(ipv6)
+                self.emit(BPF_LD_B_ABS, link + IPV6_NEXT_HEADER)
+                self.jeq(ipv6_protocol, t, f)
+        elif kind == 'net':
+            _, direction, version, address, mask = node
+            ipv4, ipv6 = self.families(version == 4, version == 6, f)
+            if ipv4:
+                self.place(ipv4)
+                offsets = {'src': [IPV4_SRC], 'dst': [IPV4_DST]}.get(direction, [IPV4_SRC, IPV4_DST])
+                self.any_address([link + offset for offset in offsets], 1, address, mask, t, f)
+            else:
+                self.place(ipv6)
+                offsets = {'src': [IPV6_SRC], 'dst': [IPV6_DST]}.get(direction, [IPV6_SRC, IPV6_DST])
+                self.any_address([link + offset for offset in offsets], 4, address, mask, t, f)
+        elif kind == 'port':
+            _, direction, port = node
+            offsets = {'src': [0], 'dst': [2]}.get(direction, [0, 2])
+            ipv4, ipv6 = self.families(True, True, f)
+            self.place(ipv4)
+            tcp_or_udp, udp = Label(), Label()
+            self.emit(BPF_LD_B_ABS, link + IPV4_PROTOCOL)
+            self.jeq(TCP_UDP[0], tcp_or_udp, udp)
+            self.place(udp)
+            self.jeq(TCP_UDP[1], tcp_or_udp, f)
+            self.place(tcp_or_udp)
+            # Only the first fragment carries the ports
+            first_fragment = Label()
+            self.emit(BPF_LD_H_ABS, link + IPV4_FRAGMENT)
+            self.emit(BPF_JSET_K, 0x1fff, f, first_fragment)
+            self.place(first_fragment)
+            # X = IP header length; ports sit at X + link and X + link + 2
+            self.emit(BPF_LDX_B_MSH, link)
+            self.any_halfword([link + offset for offset in offsets], port, t, f, indirect=True)
+            self.place(ipv6)
+            tcp_or_udp, udp = Label(), Label()
+            self.emit(BPF_LD_B_ABS, link + IPV6_NEXT_HEADER)
+            self.jeq(TCP_UDP[0], tcp_or_udp, udp)
+            self.place(udp)
+            self.jeq(TCP_UDP[1], tcp_or_udp, f)
+            self.place(tcp_or_udp)
+            self.any_halfword([link + IPV6_HEADER + offset for offset in offsets], port, t, f)
+        else:
+            raise ValueError(f"Unknown filter node {kind}")
+
+    # Resolve labels into the relative jt/jf offsets BPF uses; an unconditional
+    # jump carries its offset in k and can go further
+    def assemble(self):
+        if len(self.code) > BPF_MAXINSNS:
+            raise ProgramTooLarge("Filter expression is too large for a BPF program")
+        program = []
+        for pos, (code, jt, jf, k) in enumerate(self.code):
+            offsets = []
+            for label in (jt, jf):
+                offset = 0 if label is None else label.pos - pos - 1
+                if not 0 <= offset <= 255:
+                    raise ProgramTooLarge("Filter expression is too large for a BPF program")
+                offsets.append(offset)
+            if isinstance(k, Label):
+                k = k.pos - pos - 1
+            program.append((code, offsets[0], offsets[1], k))
+        return program
+
+# The program first counts the frame's VLAN tags, then runs the expression
+# compiled for that link layer length. Each copy has its own accept and reject
+# so no conditional jump has to cross another copy.
+def compile_bpf(node):
+    gen = CodeGen()
+    checks = [Label(), Label()]
+    jumps = [Label() for _ in range(3)]
+    bodies = [Label() for _ in range(3)]
+    for tags in range(2):
+        gen.place(checks[tags])
+        tagged = checks[1] if tags == 0 else jumps[2]
+        gen.emit(BPF_LD_H_ABS, 12 + 4 * tags)
+        other = Label()
+        gen.jeq(VLAN_ETHERTYPES[0], tagged, other)
+        gen.place(other)
+        gen.jeq(VLAN_ETHERTYPES[1], tagged, jumps[tags])
+    for tags in range(3):
+        gen.place(jumps[tags])
+        gen.emit(BPF_JA, bodies[tags])
+    for tags in range(3):
+        gen.place(bodies[tags])
+        gen.link = 14 + 4 * tags
+        accept, reject = Label(), Label()
+        gen.node(node, accept, reject)
+        gen.place(accept)
+        gen.emit(BPF_RET_K, ACCEPT_LENGTH)
+        gen.place(reject)
+        gen.emit(BPF_RET_K, 0)
+    return gen.assemble()
+# Userspace pre-check: the same expression as a predicate over the raw frame,
+# reading only the few header bytes it needs. As in BPF, a read past the end of
+# the frame rejects the frame outright, even under a "not". Every node takes the
+# offset of the network header, found once per frame.
+
+class Truncated(Exception):
+    pass
+
+def _need(length, end):
+    if length < end:
+        raise Truncated
+
+def _ethertype(buffer, length, offset):
+    _need(length, offset + 2)
+    return buffer[offset] << 8 | buffer[offset + 1]
+
+# The network header's offset: past the MAC addresses and up to two VLAN tags
+def _link_offset(buffer, length):
+    link = 14
+    for _ in range(2):
+        if _ethertype(buffer, length, link - 2) not in VLAN_ETHERTYPES:
+            break
+        link += 4
+    return link
+
+def _compile_node(node):
+    kind = node[0]
+    if kind == 'and':
+        left, right = _compile_node(node[1]), _compile_node(node[2])
+        return lambda buffer, length, link: left(buffer, length, link) and right(buffer, length, link)
+    if kind == 'or':
+        left, right = _compile_node(node[1]), _compile_node(node[2])
+        return lambda buffer, length, link: left(buffer, length, link) or right(buffer, length, link)
+    if kind == 'not':
+        inner = _compile_node(node[1])
+        return lambda buffer, length, link: not inner(buffer, length, link)
+    if kind == 'ether':
+        ethertype = node[1]
+        return lambda buffer, length, link: _ethertype(buffer, length, link - 2) == ethertype
+    if kind == 'proto':
+        protocols = {ETHERTYPES['ip']: (node[1], IPV4_PROTOCOL), ETHERTYPES['ip6']: (node[2], IPV6_NEXT_HEADER)}
+
+        def match_proto(buffer, length, link):
+            protocol, offset = protocols.get(_ethertype(buffer, length, link - 2), (None, 0))
+            if protocol is None:
+                return False
+            _need(length, link + offset + 1)
+            return buffer[link + offset] == protocol
+        return match_proto
+    if kind == 'net':
+        _, direction, version, address, mask = node
+        ethertype, words, src, dst = ((ETHERTYPES['ip'], 1, IPV4_SRC, IPV4_DST) if version == 4 else
+                                      (ETHERTYPES['ip6'], 4, IPV6_SRC, IPV6_DST))
+        offsets = {'src': [src], 'dst': [dst]}.get(direction, [src, dst])
+        compared = address_words(words, address, mask)
+
+        # Word by word, so a truncated frame is rejected exactly where BPF would
+        def match_net(buffer, length, link):
+            if _ethertype(buffer, length, link - 2) != ethertype:
+                return False
+            for offset in offsets:
+                for at, word_mask, value in compared:
+                    start = link + offset + at
+                    _need(length, start + 4)
+                    if WORD.unpack_from(buffer, start)[0] & word_mask != value:
+                        break
+                else:
+                    return True
+            return False
+        return match_net
+    if kind == 'port':
+        _, direction, port = node
+        offsets = {'src': [0], 'dst': [2]}.get(direction, [0, 2])
+
+        def match_port(buffer, length, link):
+            ethertype = _ethertype(buffer, length, link - 2)
+            if ethertype == ETHERTYPES['ip']:
+                _need(length, link + IPV4_PROTOCOL + 1)
+                if buffer[link + IPV4_PROTOCOL] not in TCP_UDP:
+                    return False
+                fragment = link + IPV4_FRAGMENT
+                if (buffer[fragment] & 0x1f) or buffer[fragment + 1]:  # not the first fragment
+                    return False
+                start = link + (buffer[link] & 0xf) * 4
+            elif ethertype == ETHERTYPES['ip6']:
+                _need(length, link + IPV6_NEXT_HEADER + 1)
+                if buffer[link + IPV6_NEXT_HEADER] not in TCP_UDP:
+                    return False
+                start = link + IPV6_HEADER
+            else:
+                return False
+            for offset in offsets:
+                _need(length, start + offset + 2)
+                if PORT.unpack_from(buffer, start + offset)[0] == port:
+                    return True
+            return False
+        return match_port
+    raise ValueError(f"Unknown filter node {kind}")
+
+def compile_predicate(node):
+    match = _compile_node(node)
+
+    def predicate(buffer, length):
+        try:
+            return match(buffer, length, _link_offset(buffer, length))
+        except Truncated:
+            return False
+    return predicate
+
+# A compiled filter expression: `program` for the kernel, `match` for userspace.
+# `program` is None for an expression too large for BPF, which is then only
+# matched in userspace.
+class PacketFilter:
+    def __init__(self, expression):
+        self.expression = expression
+        node = parse_filter(expression)
+        try:
+            self.program = compile_bpf(node)
+        except ProgramTooLarge:
+            self.program = None
+        self.match = compile_predicate(node)
+
+    def __call__(self, buffer, length):
+        return self.match(buffer, length)
+
+    def bytecode(self):
+        return b''.join(SOCK_FILTER.pack(*insn) for insn in self.program)
+
+    # Attach the program to `sock`. Returns False where there is no program or
+    # the kernel refuses it, in which case the caller should fall back to `match`.
+    def attach(self, sock):
+        if self.program is None:
+            return False
+        code = ctypes.create_string_buffer(self.bytecode())
+        fprog = struct.pack('HP', len(self.program), ctypes.addressof(code))
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+        except OSError:
+            return False
+        return True
+
+    # tcpdump -d style listing, handy when checking a program by hand
+    def dump(self):
+        if self.program is None:
+            return "(no BPF program: the expression is only matched in userspace)"
+        return '\n'.join(f"({pos:03d}) code=0x{code:02x} jt={jt} jf={jf} k=0x{k:x}"
+                         for pos, (code, jt, jf, k) in enumerate(self.program))
@@ -1,5 +1,17 @@
-import os
+import argparse
 import datetime
+import gzip
+import heapq
+import json
+import multiprocessing
+import os
+import re
+import struct
+import time
+
+DEFAULT_LOG = '/var/log/syslog'
+# Lines without a timestamp read while looking for the next one that has it
+MAX_UNDATED_LINES = 1000
 
 def read_cron_log(log_file_path):
     if not os.path.exists(log_file_path):
@@ -9,23 +21,111 @@ def read_cron_log(log_file_path):
     with open(log_file_path, 'r') as file:
         return file.readlines()
 
+# Timestamp of a syslog line ("Month Day Time Host ..."), or None if it has none.
+# Syslog leaves out the year: assume the current one, unless that puts the line
+# in the future, in which case it was written last year.
+def line_time(line, now):
+    parts = line.split(None, 3)
+    if len(parts) < 3:
+        return None
+    try:
+        log_time = datetime.datetime.strptime(' '.join(parts[:3]), '%b %d %H:%M:%S')
+    except ValueError:
+        return None
+    log_time = log_time.replace(year=now.year)
+    if log_time - now > datetime.timedelta(days=1):
+        log_time = log_time.replace(year=now.year - 1)
+    return log_time
+
+MONTHS = {name: number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+RFC3339_ZONE = re.compile(r'(?:\.(\d{1,6})\d*)?(Z|[+-]\d\d:\d\d)?$')
+
+# Line timestamps without strptime. Handles "Oct  8 12:34:56" syslog stamps and
+# RFC 3339 ones ("2024-10-08T12:34:56.123456+02:00", rsyslog's high precision
+# format), the latter converted to local time. Log lines arrive many per second,
+# so each distinct second is only parsed once.
+class TimestampParser:
+    MISSING = object()
+    CACHE_SIZE = 4096
+
+    def __init__(self, now=None):
+        self.now = now or datetime.datetime.now()
+        self.year = self.now.year
+        # Later than this and the line must be from last year
+        self.latest = self.now + datetime.timedelta(days=1)
+        self.cache = {}
+
+    def __call__(self, line):
+        if line[:1].isdigit():
+            return self.rfc3339(line)
+        key = line[:15]
+        log_time = self.cache.get(key, self.MISSING)
+        if log_time is self.MISSING:
+            log_time = self._remember(key, self.syslog(line))
+        return log_time
+
+    def _remember(self, key, log_time):
+        if len(self.cache) >= self.CACHE_SIZE:
+            self.cache.clear()
+        self.cache[key] = log_time
+        return log_time
+
+    def syslog(self, line):
+        month = MONTHS.get(line[:3])
+        if month is None:
+            return None
+        if len(line) < 15 or line[3] != ' ' or line[6] != ' ' or line[9] != ':' or line[12] != ':':
+            return line_time(line, self.now)  # short line or unusual spacing, take the slow path
+        try:
+            log_time = datetime.datetime(self.year, month, int(line[4:6]),
+                                         int(line[7:9]), int(line[10:12]), int(line[13:15]))
+        except ValueError:
+            return None
+        if log_time > self.latest:
+            log_time = log_time.replace(year=self.year - 1)
+        return log_time
+
+    def rfc3339(self, line):
+        stamp = line.split(None, 1)[0]
+        if len(stamp) < 19 or stamp[10] not in 'Tt ':
+            return None
+        match = RFC3339_ZONE.match(stamp, 19)
+        if match is None:
+            return None
+        fraction, zone = match.groups()
+        key = stamp[:19] + (zone or '')
+        log_time = self.cache.get(key, self.MISSING)
+        if log_time is self.MISSING:
+            try:
+                log_time = datetime.datetime(int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]),
+                                             int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19]))
+                if zone:
+                    log_time = log_time.replace(tzinfo=datetime.timezone.utc if zone in 'Zz' else
+                                                datetime.datetime.strptime(zone, '%z').tzinfo)
+                    log_time = log_time.astimezone().replace(tzinfo=None)
+            except ValueError:
+                log_time = None
+            self._remember(key, log_time)
+        if log_time is not None and fraction:
+            log_time = log_time.replace(microsecond=int(fraction.ljust(6, '0')))
+        return log_time
+
 def parse_cron_entries(log_lines, time_threshold):
     recent_entries = []
+    # Get the current time once, not for every line
+    now = datetime.datetime.now()
+    parse_time = TimestampParser(now)
     for line in log_lines:
         # Check if the line contains a cron job entry
         if "CRON" in line:
             # Assuming the log format is: "Month Day Time Host CRON[PID]: (user) CMD"
-            parts = line.split()
-            if len(parts) < 6:
+            if len(line.split()) < 6:
                 continue  # Skip lines that don't have enough parts
 
-            # Extract the timestamp
-            log_time_str = ' '.join(parts[:3])  # Month Day Time
-            log_time = datetime.datetime.strptime(log_time_str, '%b %d %H:%M:%S')
-
-            # Get the current time and calculate the time difference
-            now = datetime.datetime.now()
-            log_time = log_time.replace(year=now.year)  # Assume the same year for simplicity
+            log_time = parse_time(line)
+            if log_time is None:
+                continue
             time_diff = now - log_time
 
             # Check if the entry is recent
@@ -34,12 +134,332 @@ def parse_cron_entries(log_lines, time_threshold):
 
     return recent_entries
 
-def main():
-    log_file_path = '/var/log/syslog'
-    time_threshold = datetime.timedelta(hours=1)  # Define "recent" as within the last hour
+def _decode(raw):
+    return raw.decode('utf-8', 'replace')
+
+# Offset of the first line starting at or after `pos` in a binary file
+def _line_start(file, pos):
+    if pos == 0:
+        return 0
+    file.seek(pos - 1)
+    file.readline()
+    return file.tell()
+
+# Timestamp of the first dated line at or after `offset`, None at end of file
+def _time_at(file, offset, parse_time):
+    file.seek(offset)
+    for _ in range(MAX_UNDATED_LINES):
+        raw = file.readline()
+        if not raw:
+            return None
+        log_time = parse_time(_decode(raw))
+        if log_time is not None:
+            return log_time
+    return None
+
+# Binary search for the offset of the first line logged at or after `since`.
+# Syslog is written in time order, so this needs about log2(file size) seeks
+# and short reads instead of a pass over the whole file.
+def find_offset(file, since, now):
+    parse_time = TimestampParser(now)
+    lo, hi = 0, file.seek(0, os.SEEK_END)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        log_time = _time_at(file, _line_start(file, mid), parse_time)
+        if log_time is None or log_time >= since:
+            hi = mid
+        else:
+            lo = mid + 1
+    return _line_start(file, lo)
+
+def is_cron_line(line):
+    return "CRON" in line and len(line.split()) >= 6
+
+# Stream the CRON lines logged within `time_threshold` of now, reading only the
+# tail of the file that covers that window
+def recent_cron_entries(log_file_path, time_threshold, now=None):
+    now = now or datetime.datetime.now()
+    with open(log_file_path, 'rb') as file:
+        file.seek(find_offset(file, now - time_threshold, now))
+        for raw in file:
+            line = _decode(raw)
+            if is_cron_line(line):
+                yield line.strip()
+
+# Rotated and journald logs
+
+GZIP_MAGIC = b'\x1f\x8b'
+JOURNAL_EXPORT = (b'__CURSOR=', b'__REALTIME_TIMESTAMP=')
+
+# `path` and its rotated copies (path.1, path.2.gz, ...), oldest first
+def rotated_logs(path):
+    directory = os.path.dirname(path) or '.'
+    pattern = re.compile(re.escape(os.path.basename(path)) + r'\.(\d+)(\.gz)?$')
+    rotated = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            rotated.append((int(match.group(1)), os.path.join(directory, name)))
+    paths = [path for _, path in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        paths.append(path)
+    return paths
+
+# Entries of a `journalctl -o export` stream as dicts of bytes fields. Fields
+# holding binary data or newlines come as the name, a little-endian 64-bit
+# length and the raw value.
+def journal_entries(file):
+    fields = {}
+    while True:
+        line = file.readline()
+        if line in (b'', b'\n'):
+            if fields:
+                yield fields
+                fields = {}
+            if not line:
+                return
+            continue
+        line = line[:-1] if line.endswith(b'\n') else line
+        name, equals, value = line.partition(b'=')
+        if not equals:
+            size = struct.unpack('<Q', file.read(8))[0]
+            value = file.read(size)
+            file.read(1)
+        fields[name] = value
+
+# A journal entry as (time, syslog-style line)
+def journal_line(fields):
+    try:
+        log_time = datetime.datetime.fromtimestamp(int(fields[b'__REALTIME_TIMESTAMP']) / 1000000)
+    except (KeyError, ValueError):
+        return None
+    host = _decode(fields.get(b'_HOSTNAME', b'-'))
+    ident = _decode(fields.get(b'SYSLOG_IDENTIFIER', fields.get(b'_COMM', b'-')))
+    pid = _decode(fields.get(b'SYSLOG_PID', fields.get(b'_PID', b'')))
+    message = _decode(fields.get(b'MESSAGE', b''))
+    return log_time, (f"{log_time:%b} {log_time.day:2d} {log_time:%H:%M:%S} "
+                      f"{host} {ident}[{pid}]: {message}")
+
+# Open a log as a binary stream, decompressing gzip on the fly. Returns the
+# stream, whether it is compressed and whether it is a journald export; they
+# are told apart by their first bytes.
+def open_log(path):
+    with open(path, 'rb') as file:
+        compressed = file.read(2) == GZIP_MAGIC
+    file = gzip.open(path, 'rb') if compressed else open(path, 'rb')
+    return file, compressed, file.peek(32).startswith(JOURNAL_EXPORT)
+
+# (time, line) for every CRON line among raw syslog `lines`. Lines that cannot
+# be cron entries are skipped before they are decoded or their timestamp parsed.
+def cron_lines(lines, parse_time):
+    for raw in lines:
+        if b'CRON' not in raw:
+            continue
+        line = _decode(raw)
+        if not is_cron_line(line):
+            continue
+        log_time = parse_time(line)
+        if log_time is not None:
+            yield log_time, line.strip()
+
+# (time, line) for every CRON entry in a journald export stream
+def journal_cron_lines(file):
+    for fields in journal_entries(file):
+        entry = journal_line(fields)
+        if entry and is_cron_line(entry[1]):
+            yield entry
+
+# All CRON entries logged since `since` in one file, as a time-ordered list of
+# (time, line). Only plain files can be binary-searched; compressed files and
+# journald exports are streamed.
+def scan_log_file(path, since, now):
+    # A rotated file last written before the window cannot hold anything in it
+    if datetime.datetime.fromtimestamp(os.stat(path).st_mtime) < since:
+        return []
+    file, compressed, journal = open_log(path)
+    with file:
+        if journal:
+            entries = journal_cron_lines(file)
+        else:
+            if not compressed:
+                file.seek(find_offset(file, since, now))
+            entries = cron_lines(file, TimestampParser(now))
+        entries = [entry for entry in entries if entry[0] >= since]
+    entries.sort(key=_entry_time)
+    return entries
+
+def _entry_time(entry):
+    return entry[0]
+
+# CRON lines logged within `time_threshold` of now across several log files,
+# as one stream in time order. Each file is scanned in its own process and the
+# sorted results are merged.
+def cron_entries(paths, time_threshold, now=None, workers=None):
+    now = now or datetime.datetime.now()
+    jobs = [(path, now - time_threshold, now) for path in paths]
+    if len(jobs) <= 1 or workers == 1:
+        results = [scan_log_file(*job) for job in jobs]
+    else:
+        with multiprocessing.Pool(min(workers or os.cpu_count(), len(jobs))) as pool:
+            results = pool.starmap(scan_log_file, jobs)
+    for _, line in heapq.merge(*results, key=_entry_time):
+        yield line
+
+# Where --follow got to: the inode of the file it was reading and the offset of
+# the first byte it has not reported yet
+class FollowState:
+    def __init__(self, path, inode=None, offset=0):
+        self.path = path
+        self.inode = inode
+        self.offset = offset
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return cls(path)
+        return cls(path, data.get('inode'), data.get('offset', 0))
+
+    # Written to a temporary file and renamed, so a crash never truncates it
+    def save(self, inode, offset):
+        if (inode, offset) == (self.inode, self.offset):
+            return
+        self.inode, self.offset = inode, offset
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'inode': inode, 'offset': offset}, file)
+        os.replace(tmp_path, self.path)
+
+# An open log file read incrementally from `offset`. Only complete lines are
+# returned; a partly written last line is left for the next read.
+class LogTail:
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.offset = offset
+
+    def size(self):
+        return os.fstat(self.file.fileno()).st_size
+
+    # Batches of new lines, read in chunks of at most `size` bytes
+    def lines(self, size=1 << 20):
+        while True:
+            self.file.seek(self.offset)
+            data = self.file.read(size)
+            end = data.rfind(b'\n') + 1
+            if not end:
+                if len(data) < size:
+                    return
+                end = len(data)  # a single line longer than the chunk
+            self.offset += end
+            yield data[:end].splitlines()
+
+    def close(self):
+        self.file.close()
+
+# The file rotated away from under a saved inode, e.g. syslog -> syslog.1
+def _find_rotated(log_file_path, inode):
+    directory = os.path.dirname(log_file_path) or '.'
+    base = os.path.basename(log_file_path)
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(base + '.') and not name.endswith('.gz'):
+            path = os.path.join(directory, name)
+            if os.stat(path).st_ino == inode:
+                return path
+    return None
+
+# Tail `log_file_path` and call on_entry for every new CRON line. Without saved
+# state the window of `time_threshold` before now is reported first. With
+# `state`, a restart carries on where the last run stopped, including the rest
+# of a file that was rotated in between. Rotation and truncation while running
+# are noticed by the inode changing or the file shrinking; the old file is
+# read to the end before switching.
+def follow_cron_log(log_file_path, on_entry, time_threshold, state=None, interval=1.0):
+    def report(lines):
+        for raw in lines:
+            line = _decode(raw)
+            if is_cron_line(line):
+                on_entry(line.strip())
+
+    tail = LogTail(log_file_path)
+    if state is not None and state.inode == tail.inode and state.offset <= tail.size():
+        tail.offset = state.offset
+    else:
+        rotated = None
+        if state is not None and state.inode is not None:
+            rotated = _find_rotated(log_file_path, state.inode)
+        if rotated:
+            old = LogTail(rotated, state.offset)
+            for lines in old.lines():
+                report(lines)
+            old.close()
+        else:
+            now = datetime.datetime.now()
+            tail.offset = find_offset(tail.file, now - time_threshold, now)
+    try:
+        while True:
+            for lines in tail.lines():
+                report(lines)
+            if state is not None:
+                state.save(tail.inode, tail.offset)
+            time.sleep(interval)
+            try:
+                current = os.stat(log_file_path)
+            except FileNotFoundError:
+                continue  # between rotation and the new file being created
+            if current.st_ino != tail.inode:
+                for lines in tail.lines():
+                    report(lines)
+                tail.close()
+                tail = LogTail(log_file_path)
+            elif current.st_size < tail.offset:  # truncated in place
+                tail.offset = 0
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tail.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show recent cron jobs from syslog')
+    parser.add_argument('log_files', nargs='*', default=[DEFAULT_LOG], metavar='log_file',
+                        help='syslog, rotated (.gz) or journalctl -o export files')
+    parser.add_argument('--minutes', type=float, default=60,
+                        help='how far back counts as recent (default: 60)')
+    parser.add_argument('--rotated', action='store_true',
+                        help='also read the rotated copies of each log (syslog.1, syslog.2.gz, ...)')
+    parser.add_argument('--workers', type=int, help='processes reading files in parallel')
+    parser.add_argument('--follow', action='store_true',
+                        help='keep printing new cron jobs as they are logged')
+    parser.add_argument('--state', help='file that remembers how far --follow got between runs')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between --follow polls')
+    args = parser.parse_args(argv)
+
+    time_threshold = datetime.timedelta(minutes=args.minutes)  # "recent" defaults to the last hour
+
+    log_files = []
+    for log_file_path in args.log_files:
+        if args.rotated:
+            paths = rotated_logs(log_file_path)
+        else:
+            paths = [log_file_path] if os.path.exists(log_file_path) else []
+        if not paths:
+            print(f"Log file {log_file_path} does not exist.")
+            continue
+        log_files.extend(paths)
+    if not log_files:
+        return
+
+    if args.follow:
+        if len(args.log_files) > 1:
+            parser.error('--follow takes a single log file')
+        state = FollowState.load(args.state) if args.state else None
+        follow_cron_log(args.log_files[0], print, time_threshold, state, args.interval)
+        return
 
-    log_lines = read_cron_log(log_file_path)
-    recent_cron_jobs = parse_cron_entries(log_lines, time_threshold)
+    recent_cron_jobs = list(cron_entries(log_files, time_threshold, workers=args.workers))
 
     if recent_cron_jobs:
         print("Recent cron jobs:")
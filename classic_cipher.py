@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+# Shared engine for the classical ciphers in caesar_cypher.py and
+# vigenere_cypher.py, built for bulk text. ASCII letters are shifted with their
+# case kept; everything else, including non-ASCII text, passes through and does
+# not use up key letters. Works on bytes, or on str through UTF-8, whose
+# multibyte sequences never contain ASCII letters.
+#   classic_cipher.py caesar 3 -i corpus.txt -o corpus.enc
+#   classic_cipher.py vigenere LEMON -d -i corpus.enc
+import argparse
+import re
+import sys
+
+try:
+    import numpy as np
+except ImportError:  # Vigenère then puts letters back with a slower regex pass
+    np = None
+
+UPPER = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+LOWER = UPPER.lower()
+NOT_LETTERS = bytes(b for b in range(256) if b not in UPPER + LOWER)
+LETTER_RUN = re.compile(rb'[A-Za-z]+')
+
+# TABLES[s] shifts every letter s places
+TABLES = [bytes.maketrans(UPPER + LOWER, UPPER[s:] + UPPER[:s] + LOWER[s:] + LOWER[:s])
+          for s in range(26)]
+
+# 1 for letters and 0 for everything else, as a translation table
+LETTER_FLAGS = bytes(b in UPPER + LOWER for b in range(256))
+
+# Letters of either case to their shift (A=0 ... Z=25), as a translation table
+SHIFTS = bytes.maketrans(UPPER + LOWER, bytes(range(26)) * 2)
+
+# Key letters as shifts (A=0 ... Z=25); anything but letters is ignored
+def key_shifts(key):
+    if isinstance(key, str):
+        key = key.encode('ascii', 'ignore')
+    shifts = list(key.translate(SHIFTS, NOT_LETTERS))
+    if not shifts:
+        raise ValueError("The key must contain at least one letter")
+    return shifts
+
+def _on_text(transform, text):
+    if isinstance(text, str):
+        return transform(text.encode('utf-8')).decode('utf-8')
+    return transform(text)
+
+# The shortest p for which the key repeats itself every p letters. A key
+# generated by repeating a keyword (vigenere_cypher.generateKey) is as long as
+# the text, but only its keyword's length of columns needs translating. The
+# places the key's first letters recur are tried with bytes compares; a key
+# that keeps almost repeating goes through the linear prefix function instead.
+def key_period(shifts):
+    key = bytes(shifts)
+    length = len(key)
+    head = key[:64]
+    period = key.find(head, 1)
+    for _ in range(64):
+        if period == -1:
+            # Only periods that leave less than `head` to compare are left
+            for period in range(max(1, length - len(head) + 1), length):
+                if key[period:] == key[:length - period]:
+                    return period
+            return length
+        if key[period:] == key[:length - period]:
+            return period
+        period = key.find(head, period + 1)
+    failure = [0] * (length + 1)
+    matched = 0
+    for index in range(1, length):
+        while matched and key[index] != key[matched]:
+            matched = failure[matched]
+        if key[index] == key[matched]:
+            matched += 1
+        failure[index + 1] = matched
+    return length - failure[length]
+
+# Translate letters[start:end] with `shifts` repeating from position `phase`,
+# one strided slice per key column
+def _shift_columns(letters, start, end, shifts, phase):
+    period = len(shifts)
+    for column, shift in enumerate(shifts):
+        first = start + (column - phase) % period
+        letters[first:end:period] = letters[first:end:period].translate(TABLES[shift])
+
+# Vigenère over `data` with the key starting at position `phase`. The letters
+# are pulled out and every key column is translated as one strided slice, so
+# the shifting runs at bytes.translate speed. A key that repeats every `period`
+# letters is translated with that many columns: outright when the period
+# divides the key, otherwise within each pass over the key, when there are few
+# enough of those. Returns the result and the number of letters, which is how
+# far the key moved on.
+def _vigenere(data, shifts, phase, period=None):
+    data = bytes(data)
+    letters = bytearray(data.translate(None, NOT_LETTERS))
+    count = len(letters)
+    length = len(shifts)
+    period = period or length
+    if length % period == 0:
+        _shift_columns(letters, 0, count, shifts[:period], phase % period)
+    elif period * (count // length + 2) < length:
+        start = 0
+        while start < count:
+            end = min(count, start + length - phase)
+            _shift_columns(letters, start, end, shifts[:period], phase % period)
+            start, phase = end, 0
+    else:
+        _shift_columns(letters, 0, count, shifts, phase)
+    if count == len(data):
+        return bytes(letters), count
+    if np is not None:
+        return _put_back_numpy(data, letters), count
+    return _put_back(data, letters), count
+
+# Put the translated letters back between the other bytes in one masked store
+def _put_back_numpy(data, letters):
+    result = np.frombuffer(data, np.uint8).copy()
+    result[np.frombuffer(data.translate(LETTER_FLAGS), np.bool_)] = np.frombuffer(letters, np.uint8)
+    return result.tobytes()
+
+# The same without NumPy, one run of letters at a time
+def _put_back(data, letters):
+    position = 0
+
+    def next_run(match):
+        nonlocal position
+        end = position + match.end() - match.start()
+        run = letters[position:end]
+        position = end
+        return run
+    return LETTER_RUN.sub(next_run, data)
+
+# Streaming ciphers. update() transforms the next chunk of one long message, so
+# a file can be processed in pieces of any size.
+
+class CaesarCipher:
+    def __init__(self, shift, decrypt=False):
+        self.table = TABLES[(-shift if decrypt else shift) % 26]
+
+    def update(self, data):
+        return data.translate(self.table)
+
+# Carries the key phase from one chunk to the next
+class VigenereCipher:
+    def __init__(self, key, decrypt=False):
+        shifts = key_shifts(key)
+        self.shifts = [(26 - shift) % 26 for shift in shifts] if decrypt else shifts
+        self.period = key_period(self.shifts)
+        self.phase = 0
+
+    def update(self, data):
+        result, letters = _vigenere(data, self.shifts, self.phase, self.period)
+        self.phase = (self.phase + letters) % len(self.shifts)
+        return result
+
+def caesar(text, shift, decrypt=False):
+    return _on_text(CaesarCipher(shift, decrypt).update, text)
+
+def vigenere(text, key, decrypt=False):
+    return _on_text(VigenereCipher(key, decrypt).update, text)
+
+# Run `cipher` over a binary stream chunk by chunk; returns the bytes written
+def cipher_stream(cipher, source, destination, chunk_size=1 << 22):
+    total = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return total
+        destination.write(cipher.update(chunk))
+        total += len(chunk)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Caesar and Vigenère ciphers for large files')
+    parser.add_argument('cipher', choices=('caesar', 'vigenere'))
+    parser.add_argument('key', help='shift for caesar, keyword for vigenere')
+    parser.add_argument('-d', '--decrypt', action='store_true')
+    parser.add_argument('-i', '--input', help='file to read (default: stdin)')
+    parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    parser.add_argument('--chunk', type=int, default=1 << 22, help='bytes processed at a time')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.cipher == 'caesar':
+            cipher = CaesarCipher(int(args.key), args.decrypt)
+        else:
+            cipher = VigenereCipher(args.key, args.decrypt)
+    except ValueError as e:
+        parser.error(str(e))
+
+    source = open(args.input, 'rb') if args.input else sys.stdin.buffer
+    destination = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        cipher_stream(cipher, source, destination, args.chunk)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if destination is not sys.stdout.buffer:
+            destination.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,275 +1,439 @@
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-
-# Create a new Document
-doc = Document()
-
-# Add a title
-title = doc.add_heading('Review Service API Design', level=1)
-title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-
-# Add Assumptions section
-doc.add_heading('Assumptions', level=2)
-assumptions = [
-    "The API assumes authentication and authorization are handled at a different layer (e.g., API gateway or middleware).",
-    "All requests reaching the API are pre-validated for authentication and authorization.",
-    "Users can submit only one review per product, identified by their `userId`, but can update their existing review.",
-    "Reviews will be moderated externally, and no content filtering is applied at the API level.",
-    "Reviews belong to products, so they are nested under `/products/{id}/reviews` for creation and listing.",
-    "Individual review actions (fetch, update, delete) use `/reviews/{id}` as reviews have unique IDs.",
-    "The database structure follows a NoSQL schema to store reviews in a flexible format."
-]
-
-for assumption in assumptions:
-    doc.add_paragraph(assumption, style='List Bullet')
-
-# Add Database Choice section
-doc.add_heading('Database Choice: MongoDB', level=2)
-doc.add_heading('Reasoning:', level=3)
-reasoning = [
-    "Flexible Schema: Reviews can have optional fields such as ratings, text comments, and metadata.",
-    "Scalability: MongoDB is optimized for large-scale applications with high read/write operations.",
-    "Document-based Storage: Each review can be stored as a document, making it easy to retrieve by product ID or user ID."
-]
-
-for reason in reasoning:
-    doc.add_paragraph(reason, style='List Bullet')
-
-# Add Database Schema Section
-doc.add_heading('Database Schema', level=2)
-schema_code = '''
-// Reviews Collection
-
-{
-  _id: ObjectId, // MongoDB's default unique ID
-  productId: String, // ID of the product being reviewed
-  userId: String, // unique user id
-  rating: Number, // Optional: Rating (e.g., 1-5)
-  comment: String, // Optional: Text comment
-  reviewerName: String,
-  reviewerEmail: String,
-  metadata: Object, // Optional: Additional metadata
-  createdAt: Date, // Timestamp of review creation
-  updatedAt: Date // Optional: Timestamp of review update
+#!/usr/bin/python3
+# Word documents from structured input. Each input is a JSON document (a scan
+# or audit report, or a list of them) or an OpenAPI-like API spec. Its data is
+# rendered through a section template into headings, paragraphs, bullet lists,
+# code and tables. That XML goes straight into a copy of a style template
+# .docx, python-docx's own by default. The style template and the section
+# templates are read and compiled once, and the documents of a batch are
+# rendered on a process pool.
+#   create_docx.py                                 the Review Service API design
+#   create_docx.py specs/*.json -o docs/ --workers 8
+#   create_docx.py scans.json --template report --templates my_templates/
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'review_service_api.json')
+DOCUMENT_PART = 'word/document.xml'
+CODE_FONT = 'Courier New'
+
+# Section templates that ship with the script. A template is a list of
+# blocks, each rendered from the document data:
+#   {"heading": "1. {name}", "level": 3, "align": "center"}  format string
+#   {"paragraph": "Method: {method}", "style": "List Bullet"}  format string
+#   {"bullets": "field", "item": "{name}: {value}"}            list of strings or dicts
+#   {"code": "field"}                                          text, anything else as JSON
+#   {"table": "field", "columns": ["host", "port"]}            list of dicts, lists or both
+#   {"section": "template", "each": "field"}                   once per item, or once
+# Any block can carry "when": "field" to be skipped when that field is empty.
+# In "each" sections the item's fields are added to its parent's, with
+# `number` counting from 1.
+TEMPLATES = {
+    'api': [
+        {'heading': '{title}', 'level': 1, 'align': 'center'},
+        {'paragraph': '{description}', 'when': 'description'},
+        {'heading': 'Assumptions', 'level': 2, 'when': 'assumptions'},
+        {'bullets': 'assumptions', 'when': 'assumptions'},
+        {'section': 'section', 'each': 'sections'},
+        {'heading': 'API Endpoints', 'level': 2, 'when': 'endpoints'},
+        {'section': 'api-endpoint', 'each': 'endpoints'},
+    ],
+    'api-endpoint': [
+        {'heading': '{number}. {summary}', 'level': 3},
+        {'paragraph': 'Method: {method}'},
+        {'paragraph': 'Endpoint: {path}'},
+        {'heading': 'Query Parameters:', 'level': 4, 'when': 'parameters'},
+        {'bullets': 'parameters', 'item': '- {name} ({detail}) → {description}', 'when': 'parameters'},
+        {'heading': 'Example Request:', 'level': 4, 'when': 'example'},
+        {'code': 'example', 'when': 'example'},
+        {'heading': 'Request Payload:', 'level': 4, 'when': 'request'},
+        {'code': 'request', 'when': 'request'},
+        {'heading': 'Response Payload:', 'level': 4, 'when': 'response'},
+        {'code': 'response', 'when': 'response'},
+        {'heading': 'Error Responses:', 'level': 4, 'when': 'errors'},
+        {'section': 'api-error', 'each': 'errors'},
+    ],
+    'api-error': [
+        {'paragraph': '{status} {description}:', 'style': 'List Bullet'},
+        {'code': 'body', 'when': 'body'},
+    ],
+    'report': [
+        {'heading': '{title}', 'level': 1, 'align': 'center'},
+        {'paragraph': '{summary}', 'when': 'summary'},
+        {'section': 'section', 'each': 'sections'},
+    ],
+    'section': [
+        {'heading': '{heading}', 'level': 2},
+        {'heading': '{subheading}', 'level': 3, 'when': 'subheading'},
+        {'section': 'paragraph', 'each': 'paragraphs'},
+        {'bullets': 'bullets', 'when': 'bullets'},
+        {'code': 'code', 'when': 'code'},
+        {'table': 'table', 'columns': 'columns', 'when': 'table'},
+    ],
+    'paragraph': [
+        {'paragraph': '{item}'},
+    ],
 }
-'''
-schema_paragraph = doc.add_paragraph()
-schema_paragraph.add_run(schema_code).font.name = 'Courier New'
-
-# Add API Endpoints section
-doc.add_heading('API Endpoints', level=2)
-
-# Endpoint 1: Create a Review
-doc.add_heading('1. Create a Review', level=3)
-doc.add_paragraph('Method: POST')
-doc.add_paragraph('Endpoint: /products/{id}/reviews')
-doc.add_heading('Request Payload:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "userId": "user123",
-    "rating": 5,
-    "comment": "Great product!",
-    "reviewerName": "John Doe",
-    "reviewerEmail": "john.doe@example.com",
-    "metadata": {"key": "value"}
-}''').font.name = 'Courier New'
-
-doc.add_heading('Response Payload:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "id": "unique_review_id",
-    "productId": "{id}",
-    "userId": "user123",
-    "rating": 5,
-    "comment": "Great product!",
-    "reviewerName": "John Doe",
-    "reviewerEmail": "john.doe@example.com",
-    "metadata": {"key": "value"},
-    "createdAt": "2024-10-27T10:00:00Z"
-}''').font.name = 'Courier New'
-
-doc.add_heading('Error Responses:', level=4)
-doc.add_paragraph('400 Bad Request:', style='List Bullet')
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "error": "Bad Request",
-    "message": "The request payload is invalid. Must contain at least one of rating or comment."
-}''').font.name = 'Courier New'
-
-doc.add_paragraph('409 Conflict:', style='List Bullet')
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "error": "Conflict",
-    "message": "A review already exists for this product by the same user."
-}''').font.name = 'Courier New'
-
-# Endpoint 2: Get Reviews for a Product
-doc.add_heading('2. Get Reviews for a Product', level=3)
-doc.add_paragraph('Method: GET')
-doc.add_paragraph('Endpoint: /products/{id}/reviews')
-doc.add_heading('Query Parameters:', level=4)
-doc.add_paragraph('- page (optional, default: 1) → Pagination support', style='List Bullet')
-doc.add_paragraph('- pageSize (optional, default: 10) → Limits the number of reviews returned', style='List Bullet')
-doc.add_heading('Example Request:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('GET /products/{id}/reviews?page=2&pageSize=5').font.name = 'Courier New'
-
-doc.add_heading('Response Payload:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-  "reviews": [
-    {
-      "id": "unique_review_id_6",
-      "productId": "{id}",
-      "userId": "user123",
-      "rating": 5,
-      "comment": "Great quality!",
-      "reviewerName": "Alice Brown",
-      "createdAt": "2024-10-25T14:00:00Z",
-      "metadata": {}
-    },
-    {
-      "id": "unique_review_id_7",
-      "productId": "{id}",
-      "userId": "user456",
-      "rating": 3,
-      "comment": "Average product.",
-      "reviewerName": "Bob White",
-      "createdAt": "2024-10-24T16:30:00Z",
-      "metadata": {}
-    },
-    {
-      "id": "unique_review_id_8",
-      "productId": "{id}",
-      "userId": "user789",
-      "rating": 4,
-      "comment": "Would buy again.",
-      "reviewerName": "Charlie Green",
-      "createdAt": "2024-10-23T18:15:00Z",
-      "metadata": {}
-    },
-    {
-      "id": "unique_review_id_9",
-      "productId": "{id}",
-      "userId": "user101",
-      "rating": 2,
-      "comment": "Not as expected.",
-      "reviewerName": "David Black",
-      "createdAt": "2024-10-22T19:45:00Z",
-      "metadata": {}
-    },
-    {
-      "id": "unique_review_id_10",
-      "productId": "{id}",
-      "userId": "user112",
-      "rating": 5,
-      "comment": "Loved it!",
-      "reviewerName": "Emily White",
-      "createdAt": "2024-10-21T21:30:00Z",
-      "metadata": {}
+
+BLOCK_KINDS = ('heading', 'paragraph', 'bullets', 'code', 'table', 'section')
+
+# What a document takes from its style template: every part but the body,
+# already compressed into an archive of their own, the opening of the document
+# part up to <w:body>, its section properties, and the style IDs by style name
+class StyleTemplate:
+    def __init__(self, path):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(path) as package, zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as parts:
+            for info in package.infolist():
+                if info.filename != DOCUMENT_PART:
+                    part = zipfile.ZipInfo(info.filename, info.date_time)
+                    part.compress_type = zipfile.ZIP_DEFLATED
+                    parts.writestr(part, package.read(info))
+            document = package.read(DOCUMENT_PART).decode('utf-8')
+            styles = package.read('word/styles.xml').decode('utf-8')
+        self.parts = archive.getvalue()
+        body = document.find('<w:body>')
+        if body < 0:
+            raise ValueError(f"{path} has no document body")
+        self.opening = document[:body + len('<w:body>')]
+        section = re.search(r'<w:sectPr[ >].*?</w:sectPr>', document[body:], re.S)
+        self.closing = (section.group(0) if section else '') + '</w:body></w:document>'
+        self.style_ids = {}
+        for style in re.finditer(r'<w:style [^>]*?w:styleId="([^"]*)"[^>]*>.*?<w:name w:val="([^"]*)"',
+                                 styles, re.S):
+            self.style_ids[style.group(2).lower()] = style.group(1)
+
+    def style_id(self, name):
+        style = self.style_ids.get(name.lower())
+        if style is None:
+            raise ValueError(f"The style template has no style named {name!r}")
+        return style
+
+    # Write a document with `body` (WordprocessingML paragraphs and tables)
+    # to `path`. Only the document part is compressed; it is appended to a copy
+    # of the other parts. The file is written under a temporary name and
+    # renamed, so a failed write leaves nothing behind.
+    def write(self, path, body):
+        package = io.BytesIO(self.parts)
+        with zipfile.ZipFile(package, 'a', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(DOCUMENT_PART, self.opening + body + self.closing)
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(package.getbuffer())
+        os.replace(temporary, path)
+
+def default_style_path():
+    try:
+        import docx
+    except ImportError:
+        raise ValueError("python-docx is not installed; pass --style with a .docx to take the styles from")
+    return os.path.join(os.path.dirname(docx.__file__), 'templates', 'default.docx')
+
+# Style templates by path, each read once per process
+_styles = {}
+
+def load_style(path=None):
+    path = path or default_style_path()
+    style = _styles.get(path)
+    if style is None:
+        style = _styles[path] = StyleTemplate(path)
+    return style
+
+# WordprocessingML for one paragraph. Line breaks in `text` become <w:br/>.
+def paragraph_xml(text, style=None, align=None, font=None):
+    properties = ''
+    if style:
+        properties += f'<w:pStyle w:val={quoteattr(style)}/>'
+    if align:
+        properties += f'<w:jc w:val={quoteattr(align)}/>'
+    run = f'<w:rPr><w:rFonts w:ascii="{font}" w:hAnsi="{font}"/></w:rPr>' if font else ''
+    run += '<w:br/>'.join(f'<w:t xml:space="preserve">{escape(line)}</w:t>' for line in text.split('\n'))
+    return f'<w:p><w:pPr>{properties}</w:pPr><w:r>{run}</w:r></w:p>' if properties else \
+        f'<w:p><w:r>{run}</w:r></w:p>'
+
+def table_xml(rows, style=None):
+    cells = ''.join('<w:tr>' + ''.join(f'<w:tc>{paragraph_xml(str(cell))}</w:tc>' for cell in row) + '</w:tr>'
+                    for row in rows)
+    properties = f'<w:tblStyle w:val={quoteattr(style)}/>' if style else ''
+    return f'<w:tbl><w:tblPr>{properties}<w:tblW w:w="0" w:type="auto"/></w:tblPr>{cells}</w:tbl>'
+
+def format_text(template, data, name):
+    try:
+        return template.format_map(data)
+    except (KeyError, IndexError) as e:
+        raise ValueError(f"Template {name}: {template!r} needs the field {e}")
+
+def code_text(value):
+    return value.strip('\n') if isinstance(value, str) else json.dumps(value, indent=4, ensure_ascii=False)
+
+# Templates from the built-in set or, with `directory`, NAME.json files there
+# that add to or replace them. Each is compiled against a style template once.
+class TemplateSet:
+    def __init__(self, style, directory=None):
+        self.style = style
+        self.directory = directory
+        self.compiled = {}
+
+    def source(self, name):
+        if self.directory:
+            path = os.path.join(self.directory, name + '.json')
+            if os.path.exists(path):
+                with open(path, 'r') as file:
+                    return json.load(file)
+        if name in TEMPLATES:
+            return TEMPLATES[name]
+        raise ValueError(f"Unknown template: {name}")
+
+    # The template as a list of functions, each appending one block's XML to a
+    # list for a dict of data
+    def get(self, name):
+        blocks = self.compiled.get(name)
+        if blocks is None:
+            blocks = self.compiled[name] = []
+            try:
+                blocks.extend(self._compile(block, name) for block in self.source(name))
+            except BaseException:
+                del self.compiled[name]
+                raise
+        return blocks
+
+    def _compile(self, block, name):
+        kinds = [kind for kind in BLOCK_KINDS if kind in block]
+        if len(kinds) != 1:
+            raise ValueError(f"Template {name}: a block needs exactly one of {', '.join(BLOCK_KINDS)}")
+        kind, value = kinds[0], block[kinds[0]]
+        style = self.style
+        if kind == 'heading':
+            style_id = style.style_id(f"Heading {block.get('level', 1)}")
+            align = block.get('align')
+            render = lambda data, out: out.append(paragraph_xml(format_text(value, data, name), style_id, align))
+        elif kind == 'paragraph':
+            style_id = style.style_id(block['style']) if 'style' in block else None
+            align = block.get('align')
+            render = lambda data, out: out.append(paragraph_xml(format_text(value, data, name), style_id, align))
+        elif kind == 'bullets':
+            style_id = style.style_id(block.get('style', 'List Bullet'))
+            item = block.get('item')
+
+            def render(data, out):
+                entries = data.get(value) or ()
+                for entry in [entries] if isinstance(entries, str) else entries:
+                    text = format_text(item, entry, name) if item and isinstance(entry, dict) else str(entry)
+                    out.append(paragraph_xml(text, style_id))
+        elif kind == 'code':
+            render = lambda data, out: out.append(paragraph_xml(code_text(data.get(value, '')), font=CODE_FONT))
+        elif kind == 'table':
+            columns = block.get('columns')
+            style_id = style.style_id(block.get('style', 'Table Grid'))
+
+            # Dict rows are laid out by the header, which without `columns` is
+            # every key of the dict rows in the order first seen. Lists are rows
+            # as they are, and anything else is a row of one cell.
+            def render(data, out):
+                rows = data.get(value) or []
+                if isinstance(rows, (str, dict)):
+                    rows = [rows]
+                header = data.get(columns) if isinstance(columns, str) else columns
+                if header is None:
+                    header = list(dict.fromkeys(key for row in rows if isinstance(row, dict) for key in row))
+                table = [header] if header else []
+                table.extend([row.get(column, '') for column in header] if isinstance(row, dict) else
+                             row if isinstance(row, (list, tuple)) else [row] for row in rows)
+                if table:
+                    out.append(table_xml(table, style_id))
+        else:
+            each = block.get('each')
+            self.get(value)
+
+            def render(data, out):
+                section = self.get(value)
+                items = (data.get(each) or []) if each else [None]
+                for number, entry in enumerate(items, 1):
+                    scope = data
+                    if each:
+                        scope = {**data, 'number': number}
+                        scope.update(entry if isinstance(entry, dict) else {'item': entry})
+                    for render_block in section:
+                        render_block(scope, out)
+        when = block.get('when')
+        if when is None:
+            return render
+        return lambda data, out: render(data, out) if data.get(when) else None
+
+    def render(self, name, data):
+        out = []
+        for render_block in self.get(name):
+            render_block(data, out)
+        return ''.join(out)
+
+# OpenAPI-like specs. Examples are taken from an "example" key or from the
+# first media type under "content"; x-assumptions and x-sections carry the
+# design notes that OpenAPI has no place for, and x-example an example request.
+
+def _example(node):
+    if not isinstance(node, dict):
+        return None
+    if 'example' in node:
+        return node['example']
+    content = node.get('content')
+    for media in (content if isinstance(content, dict) else {}).values():
+        if isinstance(media, dict) and 'example' in media:
+            return media['example']
+    return None
+
+# A query parameter as the api template lists it, or None for anything without
+# a name, such as an unresolved $ref
+def _parameter(parameter):
+    if not isinstance(parameter, dict) or parameter.get('in') != 'query' or 'name' not in parameter:
+        return None
+    detail = 'required' if parameter.get('required') else 'optional'
+    schema = parameter.get('schema')
+    default = (schema if isinstance(schema, dict) else {}).get('default', parameter.get('default'))
+    if default is not None:
+        detail += f", default: {default}"
+    return {'name': parameter['name'], 'detail': detail, 'description': parameter.get('description', '')}
+
+def _list(value):
+    return value if isinstance(value, list) else []
+
+# The data the api template renders, from a spec. Parts that are not what
+# OpenAPI says they should be are left out rather than failing the batch.
+def spec_document(spec):
+    info = spec.get('info')
+    info = info if isinstance(info, dict) else {}
+    paths = spec.get('paths')
+    endpoints = []
+    for path, operations in (paths if isinstance(paths, dict) else {}).items():
+        if not isinstance(operations, dict):
+            continue
+        for method, operation in operations.items():
+            if method.startswith('x-') or not isinstance(operation, dict):
+                continue
+            endpoint = {
+                'method': method.upper(),
+                'path': path,
+                'summary': operation.get('summary') or f"{method.upper()} {path}",
+                'parameters': [parameter for parameter in map(_parameter, _list(operation.get('parameters')))
+                               if parameter],
+                'example': operation.get('x-example'),
+                'request': _example(operation.get('requestBody')),
+                'response': None,
+                'errors': [],
+            }
+            responses = operation.get('responses')
+            for status, response in (responses if isinstance(responses, dict) else {}).items():
+                if str(status).startswith('2'):
+                    if endpoint['response'] is None:
+                        endpoint['response'] = _example(response)
+                else:
+                    description = response.get('description', '') if isinstance(response, dict) else ''
+                    endpoint['errors'].append({'status': status, 'description': description,
+                                               'body': _example(response)})
+            endpoints.append(endpoint)
+    return {
+        'template': 'api',
+        'title': info.get('title', 'API'),
+        'description': info.get('description'),
+        'assumptions': spec.get('x-assumptions'),
+        'sections': spec.get('x-sections'),
+        'endpoints': endpoints,
     }
-  ],
-  "total": 15,
-  "currentPage": 2,
-  "totalPages": 3
-}''').font.name = 'Courier New'
-
-doc.add_heading('Error Responses:', level=4)
-doc.add_paragraph('404 Not Found:', style='List Bullet')
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "error": "Product not found",
-    "message": "The product with ID '123' does not exist."
-}''').font.name = 'Courier New'
-
-# Endpoint 3: Get a Single Review by ID
-doc.add_heading('3. Get a Single Review by ID', level=3)
-doc.add_paragraph('Method: GET')
-doc.add_paragraph('Endpoint: /reviews/{id}')
-doc.add_heading('Example Request:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('GET /reviews/{id}').font.name = 'Courier New'
-
-doc.add_heading('Response Payload:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "id": "unique_review_id",
-    "productId": "{id}",
-    "userId": "user123",
-    "rating": 5,
-    "comment": "Great product!",
-    "reviewerName": "John Doe",
-    "reviewerEmail": "john.doe@example.com",
-    "createdAt": "2024-10-27T10:00:00Z",
-    "metadata": {}
-}''').font.name = 'Courier New'
-
-doc.add_heading('Error Responses:', level=4)
-doc.add_paragraph('404 Not Found:', style='List Bullet')
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "error": "Review not found",
-    "message": "The review with ID '123' does not exist."
-}''').font.name = 'Courier New'
-
-# Endpoint 4: Update a Review
-doc.add_heading('4. Update a Review', level=3)
-doc.add_paragraph('Method: PUT')
-doc.add_paragraph('Endpoint: /reviews/{id}')
-doc.add_heading('Request Payload:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "rating": 4,
-    "comment": "Updated comment.",
-    "metadata": {"updatedKey":"updatedValue"}
-}''').font.name = 'Courier New'
-
-doc.add_heading('Response Payload:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "id": "unique_review_id",
-    "productId": "{id}",
-    "userId": "user123",
-    "rating": 4,
-    "comment": "Updated comment.",
-    "reviewerName": "John Doe",
-    "reviewerEmail": "john.doe@example.com",
-    "createdAt": "2024-10-27T10:00:00Z",
-    "updatedAt": "2024-10-27T11:00:00Z",
-    "metadata": {"updatedKey":"updatedValue"}
-}''').font.name = 'Courier New'
-
-doc.add_heading('Error Responses:', level=4)
-doc.add_paragraph('404 Not Found:', style='List Bullet')
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "error": "Review not found",
-    "message": "The review with ID '123' does not exist."
-}''').font.name = 'Courier New'
-
-doc.add_paragraph('400 Bad Request:', style='List Bullet')
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "error": "Bad Request",
-    "message": "The request payload is invalid. Must contain at least one of rating or comment."
-}''').font.name = 'Courier New'
-
-# Endpoint 5: Delete a Review
-doc.add_heading('5. Delete a Review', level=3)
-doc.add_paragraph('Method: DELETE')
-doc.add_paragraph('Endpoint: /reviews/{id}')
-doc.add_heading('Example Request:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('DELETE /reviews/{id}').font.name = 'Courier New'
-
-doc.add_heading('Response Payload:', level=4)
-code_paragraph = doc.add_paragraph()
-code_paragraph.add_run('''{
-    "message": "Review deleted successfully",
-    "id": "123",
-    "deletedAt": "2024-10-27T12:00:00Z"
-}''').font.name = 'Courier New'
-
-# Save the document
-doc.save('Review_Service_API_Design.docx')
+
+# The documents of one input file: an API spec, one document or a list of them
+def input_documents(path):
+    with open(path, 'r') as file:
+        data = json.load(file)
+    documents = data if isinstance(data, list) else [data]
+    for document in documents:
+        if not isinstance(document, dict):
+            raise ValueError(f"{path}: a document must be a JSON object")
+        yield spec_document(document) if 'paths' in document or 'openapi' in document else document
+
+def output_name(document, fallback):
+    if document.get('output'):
+        return document['output']
+    title = re.sub(r'\W+', '_', str(document.get('title') or '')).strip('_')
+    return (title or fallback) + '.docx'
+
+# (data, template, output path) for every document of `inputs`. Documents
+# that would get the same file name are numbered.
+def plan_documents(inputs, output_dir='.', template=None):
+    jobs = []
+    seen = {}
+    for path in inputs:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for document in input_documents(path):
+            name = output_name(document, stem)
+            count = seen.get(name, 0)
+            seen[name] = count + 1
+            if count:
+                root, ext = os.path.splitext(name)
+                name = f"{root}-{count + 1}{ext}"
+            jobs.append((document, template or document.get('template', 'report'), os.path.join(output_dir, name)))
+    return jobs
+
+# State of a render worker: the style and templates, loaded and compiled in
+# the parent before the pool forks. The workers inherit them as they are, so
+# the pool has no initializer to build them again.
+_renderer = {}
+
+def init_renderer(style_path, template_dir):
+    _renderer['templates'] = TemplateSet(load_style(style_path), template_dir)
+
+def render_document(job):
+    document, template, path = job
+    templates = _renderer['templates']
+    try:
+        templates.style.write(path, templates.render(template, document))
+        return path, None
+    except (ValueError, OSError) as e:
+        return path, str(e)
+    except Exception as e:
+        # Whatever else a malformed document trips over fails that document only
+        return path, f"{type(e).__name__}: {e}"
+
+# Render every job, on `workers` processes; yields (path, error) as each
+# document is written
+def render_documents(jobs, style_path=None, template_dir=None, workers=None):
+    init_renderer(style_path, template_dir)
+    for template in {template for _, template, _ in jobs}:
+        _renderer['templates'].get(template)
+    if workers == 1 or len(jobs) < 2:
+        yield from map(render_document, jobs)
+        return
+    workers = workers or os.cpu_count()
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        yield from pool.imap_unordered(render_document, jobs, chunksize=max(1, len(jobs) // (workers * 8)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render Word documents from JSON data and API specs')
+    parser.add_argument('inputs', nargs='*', default=[DEFAULT_INPUT],
+                        help='JSON documents, lists of documents or API specs (default: the Review Service spec)')
+    parser.add_argument('-o', '--output-dir', default='.', help='where the .docx files go')
+    parser.add_argument('-t', '--template', help='section template for every document (default: from the data)')
+    parser.add_argument('--templates', help='directory of NAME.json section templates')
+    parser.add_argument('--style', help='.docx to take the styles and page setup from (default: python-docx\'s)')
+    parser.add_argument('--workers', type=int, help='documents rendered at once (default: all cores)')
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = plan_documents(args.inputs, args.output_dir, args.template)
+        os.makedirs(args.output_dir, exist_ok=True)
+        failures = 0
+        for path, error in render_documents(jobs, args.style, args.templates, args.workers):
+            if error:
+                print(f"{path}: {error}", file=sys.stderr)
+                failures += 1
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        parser.error(str(e))
+    print(f"{len(jobs) - failures} of {len(jobs)} documents written", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+# Cron job history in a local SQLite database. CRON log lines are parsed once
+# into structured events and ingested incrementally, so questions about past
+# runs are answered from indexes instead of by rescanning the logs:
+#   cron_history.py ingest /var/log/syslog --rotated
+#   cron_history.py missed "/usr/local/bin/backup" --schedule "0 3 * * *"
+#   cron_history.py unfinished --days 7
+import argparse
+import bisect
+import datetime
+import os
+import re
+import sqlite3
+import statistics
+import time
+
+from check_cron_jobs import (DEFAULT_LOG, LogTail, TimestampParser, cron_lines, journal_cron_lines,
+                             open_log, rotated_logs)
+
+DEFAULT_DB = os.path.expanduser('~/.cron_history.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    time REAL NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    command TEXT NOT NULL,
+    UNIQUE (time, host, pid, kind, command)
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE INDEX IF NOT EXISTS events_user ON events (user, time);
+CREATE INDEX IF NOT EXISTS events_command ON events (command, time);
+CREATE INDEX IF NOT EXISTS events_pid ON events (host, pid, time);
+CREATE TABLE IF NOT EXISTS sources (
+    inode INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL
+);
+'''
+
+# Event kinds. Debian cron logs CMD when a job starts and, with -L 2, END when
+# it finishes; cronie logs CMDEND. Every job also runs inside a PAM session
+# whose opening and closing is logged.
+START = 'start'
+END = 'end'
+SESSION_OPEN = 'session-open'
+SESSION_CLOSE = 'session-close'
+
+CRON_SOURCE = re.compile(r'(\S+) \S*[Cc][Rr][Oo][Nn]\S*\[(\d+)\]: (.*)$')
+JOB_MESSAGE = re.compile(r'\(([^)]*)\) (CMD|END|CMDEND) \((.*)\)$')
+SESSION_MESSAGE = re.compile(r'pam_unix\(cron[^)]*\): session (opened|closed) for user ([^\s(]+)')
+
+# One cron event from a CRON log line
+def parse_event(log_time, line):
+    # Skip the timestamp, which is either 3 syslog fields or one RFC 3339 field
+    rest = line.split(None, 1 if line[:1].isdigit() else 3)[-1]
+    match = CRON_SOURCE.match(rest)
+    if match is None:
+        return None
+    host, pid, message = match.groups()
+    job = JOB_MESSAGE.match(message)
+    if job:
+        user, kind, command = job.groups()
+        kind = START if kind == 'CMD' else END
+    else:
+        session = SESSION_MESSAGE.match(message)
+        if session is None:
+            return None
+        kind = SESSION_OPEN if session.group(1) == 'opened' else SESSION_CLOSE
+        user, command = session.group(2), ''
+    return log_time.timestamp(), host, int(pid), user, kind, command
+
+def connect(path=DEFAULT_DB):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+# Insert the events of (time, line) CRON entries; returns how many were new
+def _store(db, entries):
+    events = (event for event in (parse_event(*entry) for entry in entries) if event is not None)
+    return db.executemany('INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?)', events).rowcount
+
+# Read new events from the log files into `db`. Plain files are tracked by
+# inode, so each run only reads what was appended since the last one, and a
+# file keeps its progress when rotation renames it. Compressed and journald
+# files are read whole; events seen before are ignored by the UNIQUE
+# constraint. Every file is committed with its new offset in one transaction.
+# Returns the number of new events.
+def ingest(db, paths, now=None):
+    parse_time = TimestampParser(now)
+    count = 0
+    for path in paths:
+        stat = os.stat(path)
+        row = db.execute('SELECT offset FROM sources WHERE inode = ?', (stat.st_ino,)).fetchone()
+        offset = row[0] if row else 0
+        if offset > stat.st_size:  # truncated, or a new file reusing the inode
+            offset = 0
+        elif row and offset == stat.st_size:
+            continue
+        with db:
+            file, compressed, journal = open_log(path)
+            if compressed or journal:
+                with file:
+                    count += _store(db, journal_cron_lines(file) if journal else cron_lines(file, parse_time))
+                offset = stat.st_size
+            else:
+                file.close()
+                tail = LogTail(path, offset)
+                try:
+                    for lines in tail.lines():
+                        count += _store(db, cron_lines(lines, parse_time))
+                finally:
+                    tail.close()
+                offset = tail.offset
+            db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)', (stat.st_ino, path, offset))
+    return count
+
+# Queries. Times are datetimes in local time, as in the logs.
+
+def _epoch(when):
+    return when.timestamp()
+
+def runs(db, since, until, command=None, user=None):
+    query = 'SELECT time, host, pid, user, command FROM events WHERE kind = ? AND time BETWEEN ? AND ?'
+    params = [START, _epoch(since), _epoch(until)]
+    if command is not None:
+        query += ' AND command = ?'
+        params.append(command)
+    if user is not None:
+        query += ' AND user = ?'
+        params.append(user)
+    return db.execute(query + ' ORDER BY time', params).fetchall()
+
+# Jobs that started in the window but never logged completion: no END line from
+# the same process and no close of the PAM session around it. Debian logs the
+# session from the parent cron process, whose PID is usually one below the
+# job's. Jobs younger than `grace` seconds may simply still be running.
+def unfinished(db, since, until, grace=3600, now=None):
+    now = now or datetime.datetime.now()
+    until = min(until, now - datetime.timedelta(seconds=grace))
+    return db.execute('''
+        SELECT s.time, s.host, s.pid, s.user, s.command FROM events s
+        WHERE s.kind = ? AND s.time BETWEEN ? AND ?
+        AND NOT EXISTS (SELECT 1 FROM events e WHERE e.host = s.host AND e.pid = s.pid
+                        AND e.time >= s.time AND e.kind = ? AND e.command = s.command)
+        AND NOT EXISTS (SELECT 1 FROM events c WHERE c.host = s.host AND c.pid IN (s.pid, s.pid - 1)
+                        AND c.time >= s.time AND c.kind = ? AND c.user = s.user)
+        ORDER BY s.time''', (START, _epoch(since), _epoch(until), END, SESSION_CLOSE)).fetchall()
+
+# Cron schedules ("*/15 0-6 * * 1-5"): each field becomes the set of values it
+# allows
+
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+CRON_NAMES = {name: number for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+CRON_NAMES.update((name, number) for number, name in enumerate(
+    ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')))
+CRON_MACROS = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@midnight': '0 0 * * *',
+               '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *', '@yearly': '0 0 1 1 *',
+               '@annually': '0 0 1 1 *'}
+
+def _cron_value(text):
+    return CRON_NAMES[text.lower()] if text.lower() in CRON_NAMES else int(text)
+
+def _cron_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        part, _, step = part.partition('/')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(_cron_value, part.split('-', 1))
+        else:
+            start = end = _cron_value(part)
+            if step:
+                end = high
+        if not low <= start <= end <= high:
+            raise ValueError(f"Cron field '{text}' is out of range")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+class CronSchedule:
+    def __init__(self, expression):
+        fields = CRON_MACROS.get(expression, expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected 5 cron fields in '{expression}'")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _cron_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS))
+        # 0 and 7 are both Sunday; Python counts Monday as 0
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _runs_on(self, day):
+        if day.month not in self.months:
+            return False
+        on_day = day.day in self.days
+        on_weekday = day.weekday() in self.weekdays
+        # When both are restricted cron runs on either, otherwise on the one given
+        if not self.any_day and not self.any_weekday:
+            return on_day or on_weekday
+        return on_day and on_weekday
+
+    # Every time in [since, until) the job should have started
+    def times(self, since, until):
+        day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+        hours, minutes = sorted(self.hours), sorted(self.minutes)
+        while day < until:
+            if self._runs_on(day):
+                for hour in hours:
+                    for minute in minutes:
+                        when = day.replace(hour=hour, minute=minute)
+                        if since <= when < until:
+                            yield when
+            day += datetime.timedelta(days=1)
+
+# Expected runs of `command` that never started. With a cron `schedule` every
+# scheduled time without a start within `tolerance` seconds counts as missed.
+# Without one, the usual interval is taken to be the median gap between runs,
+# and any gap of more than 1.5 intervals counts as the runs that fit into it.
+def missed(db, command, since, until, schedule=None, tolerance=120):
+    started = [row[0] for row in runs(db, since, until, command)]
+    if schedule is not None:
+        result = []
+        for expected in CronSchedule(schedule).times(since, until):
+            at = _epoch(expected)
+            index = bisect.bisect_left(started, at)
+            if index == len(started) or started[index] > at + tolerance:
+                result.append(expected)
+        return result
+    if len(started) < 3:
+        return []
+    interval = statistics.median(b - a for a, b in zip(started, started[1:]))
+    result = []
+    for previous, current in zip(started, started[1:]):
+        gap = current - previous
+        if interval and gap > interval * 1.5:
+            for step in range(1, round(gap / interval)):
+                result.append(datetime.datetime.fromtimestamp(previous + step * interval))
+    return result
+
+def _format_time(epoch):
+    return datetime.datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+def _print_runs(rows):
+    for epoch, host, pid, user, command in rows:
+        print(f"{_format_time(epoch)} {host} [{pid}] ({user}) {command}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query an indexed history of cron jobs')
+    parser.add_argument('--db', default=DEFAULT_DB, help=f'history database (default: {DEFAULT_DB})')
+    commands = parser.add_subparsers(dest='action', required=True)
+
+    ingest_parser = commands.add_parser('ingest', help='read new cron log lines into the database')
+    ingest_parser.add_argument('log_files', nargs='*', default=[DEFAULT_LOG], metavar='log_file')
+    ingest_parser.add_argument('--rotated', action='store_true',
+                               help='also read the rotated copies of each log')
+
+    window = argparse.ArgumentParser(add_help=False)
+    window.add_argument('--days', type=float, default=7, help='how far back to look (default: 7)')
+
+    runs_parser = commands.add_parser('runs', parents=[window], help='list job starts')
+    runs_parser.add_argument('--command', help='only this exact command')
+    runs_parser.add_argument('--user')
+
+    missed_parser = commands.add_parser('missed', parents=[window],
+                                        help='scheduled runs of a job that never started')
+    missed_parser.add_argument('command', help='the exact command cron logs for the job')
+    missed_parser.add_argument('--schedule', help='its cron schedule, e.g. "0 3 * * *"')
+    missed_parser.add_argument('--tolerance', type=float, default=120,
+                               help='seconds a start may lag its scheduled time')
+
+    unfinished_parser = commands.add_parser('unfinished', parents=[window],
+                                            help='jobs that started but never logged completion')
+    unfinished_parser.add_argument('--grace', type=float, default=3600,
+                                   help='ignore jobs started less than this many seconds ago')
+    args = parser.parse_args(argv)
+
+    db = connect(args.db)
+    try:
+        if args.action == 'ingest':
+            paths = []
+            for log_file_path in args.log_files:
+                paths.extend(rotated_logs(log_file_path) if args.rotated else [log_file_path])
+            start = time.perf_counter()
+            paths = [path for path in paths if os.path.exists(path)]
+            count = ingest(db, paths)
+            print(f"{count} new events from {len(paths)} files in {time.perf_counter() - start:.3f} s")
+            return
+
+        until = datetime.datetime.now()
+        since = until - datetime.timedelta(days=args.days)
+        if args.action == 'runs':
+            _print_runs(runs(db, since, until, args.command, args.user))
+        elif args.action == 'unfinished':
+            _print_runs(unfinished(db, since, until, args.grace))
+        else:
+            try:
+                result = missed(db, args.command, since, until, args.schedule, args.tolerance)
+            except ValueError as e:
+                parser.error(str(e))
+            for expected in result:
+                print(f"missed {expected:%Y-%m-%d %H:%M}")
+            print(f"{len(result)} missed runs of {args.command}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+#!/usr/bin/python3
+# Key recovery for the classical ciphers in this repo, for CTF and training use.
+#   Caesar:    every shift scored by chi-squared against English letter counts
+#   Vigenère:  key length from the index of coincidence, then each column
+#              solved as a Caesar cipher
+#   Playfair:  simulated annealing over keys, scored with n-gram statistics,
+#              several restarts in parallel
+# Playfair needs n-gram statistics: a counts file ("TION 13168375" per line)
+# or any long English text to count them from.
+#   cryptanalysis.py vigenere -i secret.txt
+#   cryptanalysis.py playfair -i secret.txt --corpus english.txt --restarts 8
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import sys
+from collections import Counter
+
+from classic_cipher import NOT_LETTERS, TABLES, caesar, key_shifts, vigenere
+import playfair_cypher
+
+try:
+    import numpy as np
+except ImportError:  # Scoring and Playfair decryption then loop in Python
+    np = None
+
+# Relative letter frequencies of English text, A to Z
+ENGLISH_FREQUENCIES = [
+    0.08167, 0.01492, 0.02782, 0.04253, 0.12702, 0.02228, 0.02015, 0.06094, 0.06966,
+    0.00153, 0.00772, 0.04025, 0.02406, 0.06749, 0.07507, 0.01929, 0.00095, 0.05987,
+    0.06327, 0.09056, 0.02758, 0.00978, 0.02360, 0.00150, 0.01974, 0.00074]
+RANDOM_IOC = 1 / 26
+
+# Upper-case letters only, as bytes
+def letters_only(text):
+    if isinstance(text, str):
+        text = text.encode('ascii', 'ignore')
+    return text.upper().translate(None, NOT_LETTERS)
+
+def letter_counts(letters):
+    return [letters.count(letter) for letter in range(65, 91)]
+
+# How far `counts`, read with every letter moved back `shift` places, is from
+# English. Lower is more English.
+def chi_squared(counts, shift=0):
+    total = sum(counts)
+    if not total:
+        return 0.0
+    score = 0.0
+    for letter, frequency in enumerate(ENGLISH_FREQUENCIES):
+        expected = total * frequency
+        observed = counts[(letter + shift) % 26]
+        score += (observed - expected) ** 2 / expected
+    return score
+
+# The shift a Caesar cipher most likely used. Only the 26 letter counts are
+# rotated; the text is never decrypted to score a shift.
+def caesar_shift(letters):
+    counts = letter_counts(letters)
+    return min(range(26), key=lambda shift: chi_squared(counts, shift))
+
+def crack_caesar(text):
+    shift = caesar_shift(letters_only(text))
+    return shift, caesar(text, shift, decrypt=True)
+
+def index_of_coincidence(counts):
+    total = sum(counts)
+    if total < 2:
+        return 0.0
+    return sum(count * (count - 1) for count in counts) / (total * (total - 1))
+
+# Average index of coincidence of the columns for each key length. At the
+# right length (and its multiples) every column is a Caesar cipher of English
+# and the IoC jumps from about 0.038 to about 0.066.
+def key_length_scores(letters, max_length=20):
+    scores = {}
+    for length in range(1, min(max_length, max(1, len(letters) // 2)) + 1):
+        columns = [letter_counts(letters[column::length]) for column in range(length)]
+        scores[length] = sum(map(index_of_coincidence, columns)) / length
+    return scores
+
+# Key lengths worth solving, shortest first: those whose IoC is closer to
+# English than to random text, relative to the best one
+def candidate_key_lengths(letters, max_length=20, limit=4):
+    scores = key_length_scores(letters, max_length)
+    best = max(scores.values())
+    threshold = best - (best - RANDOM_IOC) * 0.15
+    return [length for length, score in sorted(scores.items()) if score >= threshold][:limit]
+
+def solve_vigenere_key(letters, length):
+    return ''.join(chr(65 + caesar_shift(letters[column::length])) for column in range(length))
+
+# A key that is a repeat of a shorter one, e.g. LEMONLEMON, cut to LEMON
+def shortest_period(key):
+    for length in range(1, len(key)):
+        if len(key) % length == 0 and key[:length] * (len(key) // length) == key:
+            return key[:length]
+    return key
+
+def _solve_length(job):
+    letters, length, model = job
+    key = solve_vigenere_key(letters, length)
+    return model.score(bytes(_vigenere_letters(letters, key))), -length, key
+
+def _vigenere_letters(letters, key):
+    shifts = key_shifts(key)
+    result = bytearray(letters)
+    for column, shift in enumerate(shifts):
+        result[column::len(shifts)] = result[column::len(shifts)].translate(TABLES[-shift % 26])
+    return result
+
+# Recover a Vigenère key. With an n-gram `model` each promising key length is
+# solved column by column and the candidates are compared on the whole
+# decryption. Letter frequencies alone cannot tell the key length from its
+# multiples, so without a model the shortest promising length is taken.
+def crack_vigenere(text, max_length=20, model=None, workers=None):
+    letters = letters_only(text)
+    if not letters:
+        raise ValueError("No letters to analyse")
+    lengths = candidate_key_lengths(letters, max_length)
+    if model is None:
+        key = solve_vigenere_key(letters, lengths[0])
+    else:
+        jobs = [(letters, length, model) for length in lengths]
+        if workers == 1 or len(jobs) == 1:
+            results = list(map(_solve_length, jobs))
+        else:
+            with multiprocessing.get_context('fork').Pool(
+                    min(workers or os.cpu_count(), len(jobs))) as pool:
+                results = pool.map(_solve_length, jobs)
+        key = max(results)[2]
+    key = shortest_period(key)
+    return key, vigenere(text, key, decrypt=True)
+
+# Log probabilities of the n-grams of English, from counts. score() sums them
+# over every n-gram in a text; higher is more English. With NumPy the table is
+# one dense array indexed by the n-gram's base-26 value and a text is scored
+# in a few vector operations.
+class NgramModel:
+    def __init__(self, counts):
+        if not counts:
+            raise ValueError("No n-gram counts")
+        self.n = len(next(iter(counts)))
+        total = sum(counts.values())
+        self.floor = math.log10(0.01 / total)
+        table = [self.floor] * 26 ** self.n
+        for ngram, count in counts.items():
+            table[self._index(ngram.encode('ascii'))] = math.log10(count / total)
+        self.table = np.array(table, np.float32) if np is not None else table
+
+    @staticmethod
+    def _index(ngram):
+        index = 0
+        for letter in ngram:
+            index = index * 26 + letter - 65
+        return index
+
+    # From a file of "NGRAM count" lines
+    @classmethod
+    def load(cls, path):
+        counts = {}
+        with open(path, 'r') as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) == 2 and parts[0].isalpha():
+                    counts[parts[0].upper()] = counts.get(parts[0].upper(), 0) + int(parts[1])
+        return cls(counts)
+
+    # Counted from an English text
+    @classmethod
+    def train(cls, text, n=4):
+        letters = letters_only(text).decode('ascii')
+        return cls(Counter(letters[i:i + n] for i in range(len(letters) - n + 1)))
+
+    # Score upper-case letters (bytes) or an array of letter numbers 0-25
+    def score(self, letters):
+        if np is not None:
+            if isinstance(letters, (bytes, bytearray)):
+                letters = np.frombuffer(letters, np.uint8) - 65
+            return float(self.table[self.indices(letters)].sum())
+        if isinstance(letters, (bytes, bytearray)):
+            letters = [letter - 65 for letter in letters]
+        n, table, size = self.n, self.table, 26 ** self.n
+        index = 0
+        score = 0.0
+        for position, letter in enumerate(letters):
+            index = (index * 26 + letter) % size
+            if position >= n - 1:
+                score += table[index]
+        return score
+
+    def indices(self, letters):
+        letters = letters.astype(np.intp)
+        count = len(letters) - self.n + 1
+        if count <= 0:
+            return np.zeros(0, np.intp)
+        index = letters[:count].copy()
+        for offset in range(1, self.n):
+            index *= 26
+            index += letters[offset:offset + count]
+        return index
+
+# Playfair. A key is a permutation of the 25 letters (no J) in grid order.
+
+PLAYFAIR_ALPHABET = 'ABCDEFGHIKLMNOPQRSTUVWXYZ'
+# Letter number 0-24 in the grid alphabet -> 0-25 in the full one
+TO_ALPHABET = [ord(letter) - 65 for letter in PLAYFAIR_ALPHABET]
+
+# Decryption only depends on where the two letters sit, so it is tabled once
+# for all 625 pairs of grid positions
+def _position_table():
+    first, second = [], []
+    for a in range(25):
+        for b in range(25):
+            row1, col1, row2, col2 = a // 5, a % 5, b // 5, b % 5
+            if row1 == row2:
+                first.append(row1 * 5 + (col1 - 1) % 5)
+                second.append(row2 * 5 + (col2 - 1) % 5)
+            elif col1 == col2:
+                first.append((row1 - 1) % 5 * 5 + col1)
+                second.append((row2 - 1) % 5 * 5 + col2)
+            else:
+                first.append(row1 * 5 + col2)
+                second.append(row2 * 5 + col1)
+    return first, second
+
+DECRYPT_FIRST, DECRYPT_SECOND = _position_table()
+if np is not None:
+    DECRYPT_FIRST = np.array(DECRYPT_FIRST, np.intp)
+    DECRYPT_SECOND = np.array(DECRYPT_SECOND, np.intp)
+
+# Prepared ciphertext as grid letter numbers, split into first and second
+# letters of each digraph
+def playfair_digraphs(text):
+    letters = playfair_cypher.prepare(text)
+    if len(letters) % 2:
+        raise ValueError("Playfair ciphertext must have an even number of letters")
+    numbers = [PLAYFAIR_ALPHABET.index(letter) for letter in letters]
+    first, second = numbers[0::2], numbers[1::2]
+    if np is not None:
+        return np.array(first, np.intp), np.array(second, np.intp)
+    return first, second
+
+# Decrypt digraphs under grid `key`; returns full-alphabet letter numbers
+def playfair_decrypt(key, first, second):
+    if np is not None:
+        grid = np.array(key, np.intp)
+        where = np.empty(25, np.intp)
+        where[grid] = np.arange(25)
+        pairs = where[first] * 25 + where[second]
+        letters = np.array(TO_ALPHABET, np.intp)[grid]
+        plain = np.empty(len(first) * 2, np.intp)
+        plain[0::2] = letters[DECRYPT_FIRST[pairs]]
+        plain[1::2] = letters[DECRYPT_SECOND[pairs]]
+        return plain
+    where = [0] * 25
+    for position, letter in enumerate(key):
+        where[letter] = position
+    plain = []
+    for a, b in zip(first, second):
+        pair = where[a] * 25 + where[b]
+        plain.append(TO_ALPHABET[key[DECRYPT_FIRST[pair]]])
+        plain.append(TO_ALPHABET[key[DECRYPT_SECOND[pair]]])
+    return plain
+
+# A small random change to a grid: mostly two letters swapped, sometimes rows
+# or columns swapped or the grid mirrored
+def mutate(key, rng):
+    key = list(key)
+    choice = rng.random()
+    if choice < 0.9:
+        a, b = rng.sample(range(25), 2)
+        key[a], key[b] = key[b], key[a]
+    elif choice < 0.92:
+        a, b = rng.sample(range(5), 2)
+        key[a * 5:a * 5 + 5], key[b * 5:b * 5 + 5] = key[b * 5:b * 5 + 5], key[a * 5:a * 5 + 5]
+    elif choice < 0.94:
+        a, b = rng.sample(range(5), 2)
+        for row in range(0, 25, 5):
+            key[row + a], key[row + b] = key[row + b], key[row + a]
+    elif choice < 0.96:
+        key.reverse()
+    elif choice < 0.98:
+        key = [key[row * 5 + col] for row in range(4, -1, -1) for col in range(5)]
+    else:
+        key = [key[row * 5 + col] for row in range(5) for col in range(4, -1, -1)]
+    return key
+
+# State of an annealing worker process, set up once by init_annealer
+_annealer = {}
+
+def init_annealer(model, first, second):
+    _annealer['model'] = model
+    _annealer['first'] = first
+    _annealer['second'] = second
+
+# One simulated annealing run from a random grid. The temperature falls
+# linearly to zero; a worse key is accepted with probability exp(delta / T).
+def anneal(seed, iterations=200000, temperature=None):
+    model, first, second = _annealer['model'], _annealer['first'], _annealer['second']
+    rng = random.Random(seed)
+    if temperature is None:
+        # Scores grow with the text, so the starting temperature does too.
+        # Tuned for quadgram counts from a large corpus.
+        temperature = 10 + 0.087 * (len(first) * 2 - 84)
+    key = list(range(25))
+    rng.shuffle(key)
+    score = model.score(playfair_decrypt(key, first, second))
+    best_key, best_score = key, score
+    for step in range(iterations):
+        heat = temperature * (1 - step / iterations)
+        child = mutate(key, rng)
+        child_score = model.score(playfair_decrypt(child, first, second))
+        delta = child_score - score
+        if delta >= 0 or (heat > 0 and rng.random() < math.exp(delta / heat)):
+            key, score = child, child_score
+            if score > best_score:
+                best_key, best_score = key, score
+    best_score, best_key = polish(best_key, best_score)
+    return best_score, ''.join(PLAYFAIR_ALPHABET[letter] for letter in best_key)
+
+# Every grid one step from `key`: two letters swapped, or a row or column
+# moved to another place
+def neighbours(key):
+    for a in range(24):
+        for b in range(a + 1, 25):
+            child = list(key)
+            child[a], child[b] = child[b], child[a]
+            yield child
+    for a in range(5):
+        for b in range(5):
+            if a != b:
+                order = list(range(5))
+                order.insert(b, order.pop(a))
+                yield [key[row * 5 + col] for row in order for col in range(5)]
+                yield [key[row * 5 + col] for row in range(5) for col in order]
+
+# Annealing often stops a step or two short of the key; climb through the
+# neighbours until none improves the score
+def polish(key, score):
+    model, first, second = _annealer['model'], _annealer['first'], _annealer['second']
+    improved = True
+    while improved:
+        improved = False
+        for child in neighbours(key):
+            child_score = model.score(playfair_decrypt(child, first, second))
+            if child_score > score:
+                key, score, improved = child, child_score, True
+                break
+    return score, key
+
+def _anneal(job):
+    return anneal(*job)
+
+# Recover a Playfair grid: `restarts` independent annealing runs spread over a
+# process pool, best score wins. Returns the grid as a 25-letter key, which
+# playfair_cypher accepts as is, and the decryption.
+def crack_playfair(text, model, restarts=None, iterations=200000, temperature=None,
+                   workers=None, seed=None):
+    first, second = playfair_digraphs(text)
+    workers = workers or os.cpu_count()
+    # A single run finds the key only some of the time
+    restarts = restarts or max(workers, 4)
+    rng = random.Random(seed)
+    jobs = [(rng.getrandbits(64), iterations, temperature) for _ in range(restarts)]
+    if workers == 1:
+        init_annealer(model, first, second)
+        results = list(map(_anneal, jobs))
+    else:
+        with multiprocessing.get_context('fork').Pool(
+                min(workers, restarts), init_annealer, (model, first, second)) as pool:
+            results = pool.map(_anneal, jobs)
+    _, key = max(results)
+    return key, playfair_cypher.playfair(key, text, False)
+
+def load_model(args):
+    if args.ngrams:
+        return NgramModel.load(args.ngrams)
+    if args.corpus:
+        with open(args.corpus, 'r', errors='ignore') as file:
+            return NgramModel.train(file.read(), args.n)
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recover classical cipher keys from ciphertext')
+    parser.add_argument('cipher', choices=('caesar', 'vigenere', 'playfair'))
+    parser.add_argument('-i', '--input', help='ciphertext file (default: stdin)')
+    parser.add_argument('--ngrams', help='n-gram counts file, one "NGRAM count" per line')
+    parser.add_argument('--corpus', help='English text to count n-grams from')
+    parser.add_argument('-n', type=int, default=4, help='n-gram length when counting a corpus')
+    parser.add_argument('--max-key-length', type=int, default=20, help='longest Vigenère key tried')
+    parser.add_argument('--restarts', type=int,
+                        help='Playfair annealing runs (default: one per worker, at least 4)')
+    parser.add_argument('--iterations', type=int, default=200000, help='steps per annealing run')
+    parser.add_argument('--temperature', type=float,
+                        help='starting annealing temperature (default: from the text length)')
+    parser.add_argument('--workers', type=int, help='worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    if args.input:
+        with open(args.input, 'r', errors='ignore') as file:
+            text = file.read()
+    else:
+        text = sys.stdin.read()
+
+    try:
+        model = load_model(args)
+        if args.cipher == 'caesar':
+            key, plain = crack_caesar(text)
+        elif args.cipher == 'vigenere':
+            key, plain = crack_vigenere(text, args.max_key_length, model, args.workers)
+        else:
+            if model is None:
+                parser.error('playfair needs n-gram statistics: give --ngrams or --corpus')
+            key, plain = crack_playfair(text, model, args.restarts, args.iterations,
+                                        args.temperature, args.workers, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Key: {key}")
+    print(plain)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+# Reverse lookup of known digests through a precomputed index. A wordlist is
+# hashed once per algorithm (MD5 and SHA-256 by default, as in
+# automated_hash_string.py) into an index file of sorted fixed-width records,
+# digest then the 6-byte offset of the word in the wordlist. A table of where
+# each 16-bit digest prefix starts sits in the header, so a lookup is one table
+# read and a short binary search in the memory-mapped file: nothing is loaded
+# up front. Many digests at once are looked up with a sorted merge join.
+#   digest_index.py build rockyou.txt
+#   digest_index.py lookup rockyou.txt 5f4dcc3b5aa765d61d8327deb882cf99
+#   digest_index.py lookup rockyou.txt -f leaked.txt
+import argparse
+import bisect
+import collections
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+
+from batch_hash import algorithm_label, parse_algorithm
+from hash_crack import ALGORITHM_BY_LENGTH, digest_function, read_blocks, read_targets, show_candidate
+
+MAGIC = b'DIGIDX1\0'
+# Magic, algorithm label, digest width, record count, wordlist size and mtime
+HEADER = struct.Struct('<8s24sHQQQ')
+HEADER_SIZE = 64
+PREFIXES = 1 << 16
+# Start of the records for each 16-bit prefix, plus the end
+TABLE = struct.Struct(f'<{PREFIXES + 1}Q')
+RECORDS_START = HEADER_SIZE + TABLE.size
+OFFSET_SIZE = 6
+# The build sorts the records in this many runs, split on the first byte
+PARTITIONS = 64
+DEFAULT_ALGORITHMS = ('md5', 'sha256')
+
+def index_path(wordlist, label):
+    return f"{wordlist}.{label}.idx"
+
+# Workers turn a block of the wordlist into records, already split by
+# partition, for every algorithm being built
+_indexer = {}
+
+def init_indexer(algorithms):
+    _indexer['digests'] = [digest_function(*algorithm) for algorithm in algorithms]
+
+def index_block(job):
+    start, block = job
+    digests = _indexer['digests']
+    partitions = [[[] for _ in range(PARTITIONS)] for _ in digests]
+    shift = 8 - (PARTITIONS.bit_length() - 1)
+    position = start
+    for line in block.split(b'\n'):
+        word = line[:-1] if line.endswith(b'\r') else line
+        if word:
+            offset = position.to_bytes(OFFSET_SIZE, 'big')
+            for digest, parts in zip(digests, partitions):
+                value = digest(word)
+                parts[value[0] >> shift].append(value + offset)
+        position += len(line) + 1
+    return [[b''.join(part) for part in parts] for parts in partitions]
+
+# Hash `wordlist` once into an index per algorithm. The records are spread
+# over partition files by their first byte while hashing, then each partition
+# is sorted in memory and appended, so the build needs memory for one
+# partition rather than the whole index.
+def build_index(wordlist, algorithms, workers=None, block_size=1 << 20):
+    workers = workers or os.cpu_count()
+    paths = [index_path(wordlist, algorithm_label(*algorithm)) for algorithm in algorithms]
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(wordlist))) as scratch, \
+            open(wordlist, 'rb') as source:
+        stat = os.fstat(source.fileno())
+        spills = [[open(os.path.join(scratch, f"{a}-{p}"), 'w+b') for p in range(PARTITIONS)]
+                  for a in range(len(algorithms))]
+        try:
+            with multiprocessing.get_context('fork').Pool(workers, init_indexer, (algorithms,)) as pool:
+                pending = collections.deque()
+                start = 0
+                blocks = read_blocks(source, block_size)
+                while True:
+                    while len(pending) < workers * 2:
+                        block = next(blocks, None)
+                        if block is None:
+                            break
+                        pending.append(pool.apply_async(index_block, ((start, block),)))
+                        start += len(block)
+                    if not pending:
+                        break
+                    for files, parts in zip(spills, pending.popleft().get()):
+                        for file, part in zip(files, parts):
+                            file.write(part)
+            counts = []
+            for (name, size), files, path in zip(algorithms, spills, paths):
+                width = len(digest_function(name, size)(b''))
+                counts.append(_write_index(path, algorithm_label(name, size), width, files, stat))
+        finally:
+            for files in spills:
+                for file in files:
+                    file.close()
+    return list(zip(paths, counts))
+
+def _write_index(path, label, width, partitions, stat):
+    record = width + OFFSET_SIZE
+    bounds = [0] * (PREFIXES + 1)
+    count = 0
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as out:
+        out.seek(RECORDS_START)
+        per_partition = PREFIXES // PARTITIONS
+        for number, file in enumerate(partitions):
+            file.seek(0)
+            data = file.read()
+            records = sorted(data[i:i + record] for i in range(0, len(data), record))
+            first = number * per_partition
+            for prefix in range(first, first + per_partition):
+                bounds[prefix] = count + bisect.bisect_left(records, prefix.to_bytes(2, 'big'))
+            out.write(b''.join(records))
+            count += len(records)
+        bounds[PREFIXES] = count
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, label.encode('ascii'), width, count, stat.st_size,
+                              stat.st_mtime_ns).ljust(HEADER_SIZE, b'\0'))
+        out.write(TABLE.pack(*bounds))
+    os.replace(temporary, path)
+    return count
+
+# An index opened for lookups, with its wordlist
+class DigestIndex:
+    def __init__(self, path, wordlist):
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < RECORDS_START:
+            self.map.close()
+            raise ValueError(f"{path} is not a digest index")
+        magic, label, self.width, self.count, size, mtime = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a digest index")
+        self.label = label.rstrip(b'\0').decode('ascii')
+        self.record = self.width + OFFSET_SIZE
+        with open(wordlist, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                self.map.close()
+                raise ValueError(f"{path} is out of date with {wordlist}; rebuild it")
+            self.words = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def close(self):
+        self.map.close()
+        if isinstance(self.words, mmap.mmap):
+            self.words.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    # The digest of record `index`, so bisect can search the records in place
+    def __getitem__(self, index):
+        start = RECORDS_START + index * self.record
+        return self.map[start:start + self.width]
+
+    def _bounds(self, digest):
+        prefix = digest[0] << 8 | digest[1]
+        return struct.unpack_from('<2Q', self.map, HEADER_SIZE + prefix * 8)
+
+    def word_at(self, offset):
+        end = self.words.find(b'\n', offset)
+        word = self.words[offset:end if end >= 0 else len(self.words)]
+        return word[:-1] if word.endswith(b'\r') else word
+
+    def _word(self, index):
+        start = RECORDS_START + index * self.record + self.width
+        return self.word_at(int.from_bytes(self.map[start:start + OFFSET_SIZE], 'big'))
+
+    # The word behind `digest`, or None
+    def lookup(self, digest):
+        if len(digest) != self.width:
+            return None
+        low, high = self._bounds(digest)
+        index = bisect.bisect_left(self, digest, low, high)
+        if index < high and self[index] == digest:
+            return self._word(index)
+        return None
+
+    # Sorted merge join: (digest, word) for each of `digests` in the index,
+    # in digest order. Every search starts where the one before ended.
+    def join(self, digests):
+        index = 0
+        for digest in sorted(set(digests)):
+            if len(digest) != self.width:
+                continue
+            low, high = self._bounds(digest)
+            index = bisect.bisect_left(self, digest, max(low, index), high)
+            if index < high and self[index] == digest:
+                yield digest, self._word(index)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precomputed digest index over a wordlist')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='hash a wordlist into indexes')
+    build.add_argument('wordlist')
+    build.add_argument('-a', '--algorithm', action='append',
+                       help='algorithm to index, repeatable (default: md5 and sha256)')
+    build.add_argument('--workers', type=int, help='worker processes (default: all cores)')
+    lookup = commands.add_parser('lookup', help='find the words behind digests')
+    lookup.add_argument('wordlist')
+    lookup.add_argument('digests', nargs='*', help='hex digests')
+    lookup.add_argument('-f', '--file', help='file of hex digests, one per line')
+    lookup.add_argument('-a', '--algorithm', help='index to use (default: from the digest length)')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'build':
+            algorithms = [parse_algorithm(spec) for spec in args.algorithm or DEFAULT_ALGORITHMS]
+            for path, count in build_index(args.wordlist, algorithms, args.workers):
+                print(f"{path}: {count} entries")
+            return 0
+
+        digests = read_targets(args.digests)
+        if args.file:
+            with open(args.file, 'r') as file:
+                digests |= read_targets(file)
+        by_width = collections.defaultdict(list)
+        for digest in digests:
+            by_width[len(digest)].append(digest)
+        found = 0
+        for width, group in sorted(by_width.items()):
+            spec = args.algorithm or ALGORITHM_BY_LENGTH.get(width * 2)
+            if spec is None:
+                print(f"No algorithm has {width * 2}-digit digests", file=sys.stderr)
+                continue
+            path = index_path(args.wordlist, algorithm_label(*parse_algorithm(spec)))
+            with DigestIndex(path, args.wordlist) as index:
+                for digest, word in index.join(group):
+                    print(f"{digest.hex()}:{show_candidate(word)}")
+                    found += 1
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    return 0 if found == len(digests) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
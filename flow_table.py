@@ -0,0 +1,140 @@
+# Per-flow aggregation for packet_sniffer. Packets are counted against their
+# 5-tuple instead of being printed one by one, so output stays small and
+# memory stays bounded however long the capture runs.
+import heapq
+import socket
+import struct
+from collections import OrderedDict
+
+# src ip, dst ip, protocol, src port, dst port packed into 13 bytes, or 37 for
+# IPv6. A bytes key hashes fast and is far smaller than a tuple of five objects.
+FLOW_KEY = struct.Struct('!4s4sBHH')
+FLOW_KEY6 = struct.Struct('!16s16sBHH')
+FLOW_KEYS = {4: FLOW_KEY, 16: FLOW_KEY6}
+# The part of a key after the addresses
+PORTS = struct.Struct('!BHH')
+# Where the source and destination addresses are in the IPv4 and IPv6 headers
+ADDRESS_OFFSETS = {0x0800: (12, 20), 0x86dd: (8, 40)}
+
+PROTOCOL_NAMES = {1: 'icmp', 6: 'tcp', 17: 'udp', 58: 'icmp6'}
+TCP_FLAG_NAMES = 'FSRPAUEC'
+
+def format_tcp_flags(flags):
+    return ''.join(name for bit, name in enumerate(TCP_FLAG_NAMES) if flags >> bit & 1) or '-'
+
+# Counters for one direction of one conversation
+class Flow:
+    __slots__ = ('key', 'packets', 'bytes', 'first_seen', 'last_seen', 'tcp_flags')
+
+    def __init__(self, key, now):
+        self.key = key
+        self.packets = 0
+        self.bytes = 0
+        self.first_seen = now
+        self.last_seen = now
+        self.tcp_flags = 0
+
+    # The 5-tuple is only unpacked when the flow is reported
+    def five_tuple(self):
+        if len(self.key) == FLOW_KEY.size:
+            src, dst, protocol, src_port, dst_port = FLOW_KEY.unpack(self.key)
+            return socket.inet_ntoa(src), socket.inet_ntoa(dst), protocol, src_port, dst_port
+        src, dst, protocol, src_port, dst_port = FLOW_KEY6.unpack(self.key)
+        return (socket.inet_ntop(socket.AF_INET6, src), socket.inet_ntop(socket.AF_INET6, dst),
+                protocol, src_port, dst_port)
+
+    def format(self):
+        src, dst, protocol, src_port, dst_port = self.five_tuple()
+        name = PROTOCOL_NAMES.get(protocol, str(protocol))
+        if protocol in (6, 17):
+            if ':' in src:
+                src, dst = f"[{src}]", f"[{dst}]"
+            src, dst = f"{src}:{src_port}", f"{dst}:{dst_port}"
+        line = (f"{name:<4} {src:>21} -> {dst:<21} packets={self.packets} bytes={self.bytes} "
+                f"duration={self.last_seen - self.first_seen:.3f}s")
+        if protocol == 6:
+            line += f" flags={format_tcp_flags(self.tcp_flags)}"
+        return line
+
+# Flows in least-recently-seen order. Every packet moves its flow to the end of
+# the OrderedDict, so idle flows collect at the front and expiring them never
+# scans the active ones. At `max_flows` the least recently seen flow is evicted
+# early to make room.
+class FlowTable:
+    def __init__(self, idle_timeout=60.0, max_flows=100000, on_expire=None):
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.on_expire = on_expire
+        self.flows = OrderedDict()
+        self.packets = 0
+        self.skipped = 0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    # Count a decoded packet (packet_sniffer.Packet) of `size` bytes seen at `now`.
+    # While an IP packet still has its frame, the addresses are sliced out of
+    # the IP header, where they are already in key order, and only the
+    # transport layer is decoded, so no field goes through the lazy lookup.
+    def add(self, packet, size, now):
+        offsets = ADDRESS_OFFSETS.get(packet.ethertype) if packet.buffer is not None else None
+        if offsets is not None and packet.protocol is not None:
+            start = packet.network_start
+            packet.transport(packet)
+            key = b''.join((packet.buffer[start + offsets[0]:start + offsets[1]],
+                            PORTS.pack(packet.protocol, packet.src_port or 0, packet.dst_port or 0)))
+        else:
+            src_ip = packet.src_ip
+            if src_ip is None:
+                self.skipped += 1
+                return None
+            key = FLOW_KEYS[len(src_ip)].pack(src_ip, packet.dst_ip, packet.protocol,
+                                              packet.src_port or 0, packet.dst_port or 0)
+        self.packets += 1
+        flows = self.flows
+        flow = flows.get(key)
+        if flow is None:
+            if len(flows) >= self.max_flows:
+                self.evicted += 1
+                self._expire(flows.popitem(last=False)[1])
+            flow = flows[key] = Flow(key, now)
+            self.created += 1
+        else:
+            flows.move_to_end(key)
+        flow.packets += 1
+        flow.bytes += size
+        flow.last_seen = now
+        if packet.tcp_flags:
+            flow.tcp_flags |= packet.tcp_flags
+        return flow
+
+    # Drop flows idle for longer than idle_timeout as of `now`
+    def expire(self, now):
+        flows = self.flows
+        deadline = now - self.idle_timeout
+        count = 0
+        while flows:
+            flow = next(iter(flows.values()))
+            if flow.last_seen > deadline:
+                break
+            flows.popitem(last=False)
+            self.expired += 1
+            self._expire(flow)
+            count += 1
+        return count
+
+    def _expire(self, flow):
+        if self.on_expire is not None:
+            self.on_expire(flow)
+
+    def top(self, count=10, by='bytes'):
+        return heapq.nlargest(count, self.flows.values(), key=lambda flow: getattr(flow, by))
+
+    def summary(self, count=10, by='bytes'):
+        lines = [f"flows active={len(self.flows)} created={self.created} expired={self.expired} "
+                 f"evicted={self.evicted} packets={self.packets} non-ip={self.skipped}"]
+        lines.extend(flow.format() for flow in self.top(count, by))
+        return '\n'.join(lines) + '\n'
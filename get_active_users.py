@@ -1,24 +1,254 @@
-def get_active_users():
-    active_users = []
+#!/usr/bin/python3
+# User inventory from passwd data: the local /etc/passwd, the system's NSS
+# sources (LDAP, SSSD, ...) or passwd snapshots collected from many hosts.
+#   get_active_users.py                         active local users
+#   get_active_users.py list --source nss --all
+#   get_active_users.py fleet snapshots/        users and UID clashes per host
+#   get_active_users.py diff monday/ tuesday/   what changed on every host
+import argparse
+import collections
+import multiprocessing
+import os
+import pwd
+import subprocess
+import sys
+import time
+
+PASSWD = '/etc/passwd'
+MIN_UID = 1000
+
+PasswdEntry = collections.namedtuple('PasswdEntry', 'name uid gid home shell')
+
+# Entries from passwd-format lines, each line split once. Comments, NIS
+# "+"/"-" lines and malformed lines are skipped.
+def parse_passwd(lines):
+    entries = []
+    for line in lines:
+        fields = line.rstrip('\n').split(':')
+        if len(fields) != 7 or fields[0][:1] in ('', '#', '+', '-'):
+            continue
+        try:
+            entries.append(PasswdEntry(fields[0], int(fields[2]), int(fields[3]), fields[5], fields[6]))
+        except ValueError:
+            continue
+    return entries
+
+def is_active(entry, min_uid=MIN_UID):
+    return entry.uid >= min_uid and entry.name != 'nobody'
+
+# Parsed passwd files by path, with the stat fields they were parsed at
+_file_cache = {}
+
+# Entries of a passwd file, parsed again only when the file has changed or
+# been replaced since the last call
+def read_passwd(path=PASSWD):
+    stat = os.stat(path)
+    key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    cached = _file_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    with open(path, 'r', errors='replace') as file:
+        entries = parse_passwd(file)
+    _file_cache[path] = (key, entries)
+    return entries
+
+# NSS answers have no mtime to check, so they are kept for `ttl` seconds
+_nss_cache = {}
+
+# Every user the system's NSS sources know, through getpwall() in this
+# process or through the getent command
+def nss_entries(use_getent=False, ttl=60):
+    cached = _nss_cache.get(use_getent)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    if use_getent:
+        output = subprocess.run(['getent', 'passwd'], capture_output=True, text=True, check=True).stdout
+        entries = parse_passwd(output.splitlines())
+    else:
+        entries = [PasswdEntry(p.pw_name, p.pw_uid, p.pw_gid, p.pw_dir, p.pw_shell) for p in pwd.getpwall()]
+    _nss_cache[use_getent] = (time.monotonic(), entries)
+    return entries
+
+def user_entries(source='files', path=PASSWD):
+    if source == 'files':
+        return read_passwd(path)
+    if source in ('nss', 'getent'):
+        return nss_entries(source == 'getent')
+    raise ValueError(f"Unknown source: {source}")
+
+def get_active_users(source='files', path=PASSWD, min_uid=MIN_UID):
     try:
-        with open('/etc/passwd', 'r') as file:
-            # Using list comprehension to filter active users
-            active_users = [
-                line.split(':')[0]  # Get the username
-                for line in file
-                if int(line.split(':')[2]) >= 1000 and line.split(':')[0] != 'nobody'  # Check UID and exclude 'nobody'
-            ]
-    except FileNotFoundError:
-        print("The /etc/passwd file does not exist.")
-    except ValueError:
-        print("Error converting UID to integer.")
-    except Exception as e:
+        return [entry.name for entry in user_entries(source, path) if is_active(entry, min_uid)]
+    except FileNotFoundError as e:
+        if source == 'files':
+            print(f"The {path} file does not exist.")
+        else:
+            print(f"The {e.filename or 'getent'} command was not found.")
+    except (OSError, subprocess.CalledProcessError) as e:
         print(f"An error occurred: {e}")
+    return []
+
+# Snapshots from a fleet. A snapshot is a passwd file named after its host
+# (web01.passwd, web01) or a host directory holding etc/passwd or passwd.
+
+def host_name(path):
+    name = os.path.basename(path)
+    if name == 'passwd':
+        parent = os.path.dirname(path)
+        if os.path.basename(parent) == 'etc':
+            parent = os.path.dirname(parent)
+        return os.path.basename(os.path.abspath(parent))
+    return name[:-len('.passwd')] if name.endswith('.passwd') else name
+
+# Snapshot files under `paths`; a directory is a host directory if it holds
+# a passwd file and a directory of snapshots otherwise
+def snapshot_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for inner in ('etc/passwd', 'passwd'):
+            if os.path.isfile(os.path.join(path, inner)):
+                yield os.path.join(path, inner)
+                break
+        else:
+            for name in sorted(os.listdir(path)):
+                yield from snapshot_files([os.path.join(path, name)])
+
+def _load_snapshot(path):
+    try:
+        with open(path, 'r', errors='replace') as file:
+            return host_name(path), parse_passwd(file), None
+    except OSError as e:
+        return host_name(path), None, f"{path}: {e.strerror}"
+
+# Parse many snapshots on a process pool; returns {host: entries} and the
+# errors
+def load_snapshots(paths, workers=None):
+    files = list(snapshot_files(paths))
+    if workers == 1 or len(files) < 2:
+        results = list(map(_load_snapshot, files))
+    else:
+        workers = workers or os.cpu_count()
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_load_snapshot, files, chunksize=max(1, len(files) // (workers * 4)))
+    snapshots, errors = {}, []
+    for host, entries, error in results:
+        if error:
+            errors.append(error)
+        else:
+            snapshots[host] = entries
+    return snapshots, errors
+
+UserChange = collections.namedtuple('UserChange', 'name old new')
+
+# Users added, removed and changed between two lists of entries. Changes
+# carry the old and new entry.
+def diff_entries(old, new):
+    before = {entry.name: entry for entry in old}
+    after = {entry.name: entry for entry in new}
+    added = [after[name] for name in after if name not in before]
+    removed = [before[name] for name in before if name not in after]
+    changed = [UserChange(name, before[name], after[name])
+               for name in after if name in before and before[name] != after[name]]
+    return added, removed, changed
+
+# Names that have different UIDs on different hosts: {name: {uid: [hosts]}}
+def uid_conflicts(snapshots):
+    uids = collections.defaultdict(lambda: collections.defaultdict(list))
+    for host, entries in snapshots.items():
+        for entry in entries:
+            uids[entry.name][entry.uid].append(host)
+    return {name: dict(by_uid) for name, by_uid in uids.items() if len(by_uid) > 1}
+
+# A few hosts by name, many as a count
+def describe_hosts(hosts, limit=5):
+    if len(hosts) > limit:
+        return f"{len(hosts)} hosts"
+    return ', '.join(sorted(hosts))
+
+def format_change(change):
+    fields = [f"{field} {old!r} -> {new!r}" for field, old, new
+              in zip(PasswdEntry._fields, change.old, change.new) if old != new]
+    return f"~ {change.name}: {', '.join(fields)}"
+
+def print_diff(old, new, prefix=''):
+    added, removed, changed = diff_entries(old, new)
+    for entry in added:
+        print(f"{prefix}+ {entry.name} uid={entry.uid} gid={entry.gid} {entry.home} {entry.shell}")
+    for entry in removed:
+        print(f"{prefix}- {entry.name} uid={entry.uid}")
+    for change in changed:
+        print(prefix + format_change(change))
+    return len(added) + len(removed) + len(changed)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='User inventory from passwd data')
+    parser.set_defaults(source='files', path=PASSWD, all=False, min_uid=MIN_UID)
+    commands = parser.add_subparsers(dest='command')
+    listing = commands.add_parser('list', help='users of this system (the default)')
+    listing.add_argument('--source', choices=('files', 'nss', 'getent'), default='files')
+    listing.add_argument('--path', default=PASSWD, help='passwd file for the files source')
+    listing.add_argument('--all', action='store_true', help='system accounts too, with details')
+    listing.add_argument('--min-uid', type=int, default=MIN_UID)
+    fleet = commands.add_parser('fleet', help='active users and UID clashes across snapshots')
+    fleet.add_argument('snapshots', nargs='+', help='passwd snapshots or directories of them')
+    fleet.add_argument('--min-uid', type=int, default=MIN_UID)
+    fleet.add_argument('--workers', type=int)
+    diff = commands.add_parser('diff', help='changes between two snapshots or two snapshot sets')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--workers', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command in (None, 'list'):
+        if not args.all:
+            print("Active users:")
+            for user in get_active_users(args.source, args.path, args.min_uid):
+                print(user)
+            return 0
+        try:
+            entries = user_entries(args.source, args.path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            parser.error(str(e))
+        for entry in entries:
+            print(f"{entry.name:<20} {entry.uid:>7} {entry.gid:>7}  {entry.home:<28} {entry.shell}")
+        return 0
+
+    if args.command == 'fleet':
+        snapshots, errors = load_snapshots(args.snapshots, args.workers)
+        for error in errors:
+            print(error, file=sys.stderr)
+        for host, entries in sorted(snapshots.items()):
+            users = [entry.name for entry in entries if is_active(entry, args.min_uid)]
+            print(f"{host}: {len(users)} active: {' '.join(users)}")
+        conflicts = uid_conflicts(snapshots)
+        for name, by_uid in sorted(conflicts.items()):
+            where = '; '.join(f"uid {uid} on {describe_hosts(hosts)}" for uid, hosts in sorted(by_uid.items()))
+            print(f"UID clash for {name}: {where}")
+        return 1 if errors or conflicts else 0
 
-    return active_users
+    # Two files are compared directly; otherwise hosts are matched by name
+    if os.path.isfile(args.old) and os.path.isfile(args.new):
+        (_, old, error_old), (_, new, error_new) = _load_snapshot(args.old), _load_snapshot(args.new)
+        if error_old or error_new:
+            parser.error(error_old or error_new)
+        return 1 if print_diff(old, new) else 0
+    old, errors = load_snapshots([args.old], args.workers)
+    new, more_errors = load_snapshots([args.new], args.workers)
+    for error in errors + more_errors:
+        print(error, file=sys.stderr)
+    changes = 0
+    for host in sorted(old.keys() | new.keys()):
+        if host not in new:
+            print(f"{host}: gone")
+        elif host not in old:
+            print(f"{host}: new host, {len(new[host])} users")
+        else:
+            changes += print_diff(old[host], new[host], f"{host}: ")
+            continue
+        changes += 1
+    return 1 if changes else 0
 
 if __name__ == "__main__":
-    users = get_active_users()
-    print("Active users:")
-    for user in users:
-        print(user)
+    raise SystemExit(main())
@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+# Match leaked digests against a wordlist, for audits of our own password
+# stores. The wordlist is streamed in blocks that are hashed on a process pool,
+# with only a few blocks in flight, so memory stays flat however long the list
+# is. Each word can be expanded by hashcat-style rules ("c$1" = capitalise and
+# append 1). Targets are hex digests, one per line, kept in a set, or a sorted
+# binary digest file (--write-sorted) that the workers share through mmap.
+#   hash_crack.py leaked.txt rockyou.txt --rule : --rule c --rule '$1'
+#   zcat words.gz | hash_crack.py -a md5 leaked.txt -
+import argparse
+import bisect
+import collections
+import hashlib
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+
+from batch_hash import parse_algorithm
+
+BLOCK_SIZE = 1 << 20
+# Algorithm guessed from the length of a hex digest
+ALGORITHM_BY_LENGTH = {32: 'md5', 40: 'sha1', 64: 'sha256', 96: 'sha384', 128: 'sha512'}
+
+# One-argument function returning the raw digest of bytes
+def digest_function(name, size=None):
+    constructor = getattr(hashlib, name, None)
+    if constructor is None:
+        return lambda data: hashlib.new(name, data).digest()
+    if name.startswith('shake_'):
+        return lambda data: constructor(data).digest(size)
+    if size is not None:
+        return lambda data: constructor(data, digest_size=size).digest()
+    return lambda data: constructor(data).digest()
+
+def digest_size(name, size=None):
+    return len(digest_function(name, size)(b''))
+
+# Rules. A rule is a string of functions applied left to right, a subset of
+# hashcat's: : l u c C t r d f [ ] $X ^X sXY @X. Spaces are ignored.
+
+SIMPLE_FUNCTIONS = {
+    ':': lambda word: word,
+    'l': bytes.lower,
+    'u': bytes.upper,
+    'c': lambda word: word[:1].upper() + word[1:].lower(),
+    'C': lambda word: word[:1].lower() + word[1:].upper(),
+    't': bytes.swapcase,
+    'r': lambda word: word[::-1],
+    'd': lambda word: word + word,
+    'f': lambda word: word + word[::-1],
+    '[': lambda word: word[1:],
+    ']': lambda word: word[:-1],
+}
+
+def compile_rule(rule):
+    functions = []
+    text = rule.replace(' ', '').encode('latin-1')
+    position = 0
+    while position < len(text):
+        op = chr(text[position])
+        if op in SIMPLE_FUNCTIONS:
+            if op != ':':
+                functions.append(SIMPLE_FUNCTIONS[op])
+            position += 1
+            continue
+        arity = {'$': 1, '^': 1, '@': 1, 's': 2}.get(op)
+        if arity is None:
+            raise ValueError(f"Bad rule {rule!r}: unknown function {op!r}")
+        args = text[position + 1:position + 1 + arity]
+        if len(args) != arity:
+            raise ValueError(f"Bad rule {rule!r}: {op} needs {arity} character(s)")
+        if op == '$':
+            functions.append(lambda word, tail=args: word + tail)
+        elif op == '^':
+            functions.append(lambda word, head=args: head + word)
+        elif op == '@':
+            functions.append(lambda word, char=args: word.replace(char, b''))
+        else:
+            functions.append(lambda word, old=args[:1], new=args[1:]: word.replace(old, new))
+        position += 1 + arity
+    return tuple(functions)
+
+def read_rules(lines):
+    return [line.rstrip('\r\n') for line in lines
+            if line.strip() and not line.startswith('#')]
+
+# Candidates for `words` under compiled `rules`. Each rule is mapped over the
+# whole list at once; a word's repeated candidates are hashed only once.
+def mutations(words, rules):
+    columns = []
+    for functions in rules:
+        column = words
+        for function in functions:
+            column = list(map(function, column))
+        columns.append(column)
+    if len(columns) == 1:
+        return columns[0]
+    return [candidate for row in zip(*columns) for candidate in dict.fromkeys(row)]
+
+# Targets
+
+# Hex digests from lines like "digest" or "digest:anything", as raw bytes
+def read_targets(lines):
+    targets = set()
+    for number, line in enumerate(lines, 1):
+        field = line.strip().split(':', 1)[0]
+        if not field or field.startswith('#'):
+            continue
+        try:
+            targets.add(bytes.fromhex(field))
+        except ValueError:
+            raise ValueError(f"Line {number} is not a hex digest: {field!r}")
+    return targets
+
+def write_sorted_digests(digests, path):
+    with open(path, 'wb') as file:
+        file.write(b''.join(sorted(set(digests))))
+
+# A file of sorted fixed-width raw digests, searched in place. A bitmap of
+# the 24-bit digest prefixes present turns away almost every miss before the
+# binary search.
+class SortedDigests:
+    def __init__(self, path, width):
+        self.width = width
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % width:
+            self.file.close()
+            raise ValueError(f"{path} is not a file of {width}-byte digests")
+        self.count = size // width
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.prefixes = bytearray(1 << 21)
+        for a, b, c in zip(self.map[0::width], self.map[1::width], self.map[2::width]):
+            prefix = a << 16 | b << 8 | c
+            self.prefixes[prefix >> 3] |= 1 << (prefix & 7)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start = index * self.width
+        return self.map[start:start + self.width]
+
+    def __contains__(self, digest):
+        prefix = digest[0] << 16 | digest[1] << 8 | digest[2]
+        if not self.prefixes[prefix >> 3] & 1 << (prefix & 7):
+            return False
+        index = bisect.bisect_left(self, digest)
+        return index < self.count and self[index] == digest
+
+    def __iter__(self):
+        return (self[index] for index in range(self.count))
+
+    # The given digests that are in the file, like set.intersection
+    def intersection(self, digests):
+        prefixes = self.prefixes
+        found = set()
+        for digest in digests:
+            prefix = digest[0] << 16 | digest[1] << 8 | digest[2]
+            if prefixes[prefix >> 3] & 1 << (prefix & 7) and digest in self:
+                found.add(digest)
+        return found
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+# The wordlist in blocks of whole lines of about `size` bytes
+def read_blocks(stream, size=BLOCK_SIZE):
+    rest = b''
+    while True:
+        data = stream.read(size)
+        if not data:
+            if rest:
+                yield rest
+            return
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        if end:
+            rest = data[end:]
+            yield data[:end]
+        else:
+            rest = data
+
+# Workers. The targets and rules are set up once per process by init_worker;
+# a forked worker shares them with the parent instead of receiving a copy.
+_cracker = {}
+
+def init_worker(algorithm, targets, rules):
+    _cracker['digest'] = digest_function(*algorithm)
+    _cracker['targets'] = targets
+    _cracker['rules'] = [compile_rule(rule) for rule in rules] if rules else None
+
+# Hash every candidate in a block; returns the words read, the candidates
+# hashed and the (digest, candidate) matches. The targets are checked for the
+# whole block in one intersection.
+def crack_block(block):
+    digest, targets, rules = _cracker['digest'], _cracker['targets'], _cracker['rules']
+    words = [word for word in block.replace(b'\r', b'').split(b'\n') if word]
+    candidates = mutations(words, rules) if rules else words
+    values = list(map(digest, candidates))
+    found = targets.intersection(values)
+    hits = [(value, candidate) for value, candidate in zip(values, candidates) if value in found] if found else []
+    return len(words), len(candidates), hits
+
+Progress = collections.namedtuple('Progress', 'words candidates found elapsed')
+
+# Run the blocks through a pool of `workers` processes, at most `window`
+# blocks queued at a time. Yields a Progress after every block and each match
+# as (digest, candidate). Stops early once every target is found.
+def crack(blocks, algorithm, targets, rules=None, workers=None, window=None):
+    workers = workers or os.cpu_count()
+    window = window or workers * 2
+    found = set()
+    words = candidates = 0
+    start = time.monotonic()
+    with multiprocessing.get_context('fork').Pool(workers, init_worker, (algorithm, targets, rules)) as pool:
+        pending = collections.deque()
+        blocks = iter(blocks)
+        while True:
+            while len(pending) < window:
+                block = next(blocks, None)
+                if block is None:
+                    break
+                pending.append(pool.apply_async(crack_block, (block,)))
+            if not pending:
+                return
+            block_words, block_candidates, hits = pending.popleft().get()
+            words += block_words
+            candidates += block_candidates
+            for digest, candidate in hits:
+                if digest not in found:
+                    found.add(digest)
+                    yield digest, candidate
+            yield Progress(words, candidates, len(found), time.monotonic() - start)
+            if len(found) == len(targets):
+                return
+
+# A candidate as text, in hashcat's $HEX[...] form if it is not printable UTF-8
+def show_candidate(candidate):
+    try:
+        text = candidate.decode('utf-8')
+        if text.isprintable() and ':' not in text:
+            return text
+    except UnicodeDecodeError:
+        pass
+    return f"$HEX[{candidate.hex()}]"
+
+def format_rate(value):
+    for unit in ('', 'k', 'M', 'G'):
+        if value < 1000:
+            return f"{value:.1f}{unit}"
+        value /= 1000
+    return f"{value:.1f}T"
+
+def format_progress(progress, total):
+    rate = progress.candidates / progress.elapsed if progress.elapsed else 0.0
+    return (f"{format_rate(progress.words)} words, {format_rate(progress.candidates)} hashes, "
+            f"{format_rate(rate)} H/s, {progress.found}/{total} found")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find the wordlist entries behind leaked digests')
+    parser.add_argument('targets', help='hex digests, one per line (binary with --sorted)')
+    parser.add_argument('wordlist', nargs='?', default='-', help='wordlist file, - for stdin')
+    parser.add_argument('-a', '--algorithm', help='hash algorithm (default: from the digest length)')
+    parser.add_argument('--sorted', action='store_true', help='targets is a sorted binary digest file')
+    parser.add_argument('--write-sorted', metavar='FILE', help='convert the targets to a sorted binary file and exit')
+    parser.add_argument('-j', '--rule', action='append', default=[], help='mutation rule, repeatable')
+    parser.add_argument('--rules-file', help='file of rules, one per line')
+    parser.add_argument('--workers', type=int, help='worker processes (default: all cores)')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help='wordlist bytes per task')
+    parser.add_argument('--progress', type=float, default=5.0, help='seconds between progress lines, 0 for none')
+    args = parser.parse_args(argv)
+
+    targets = None
+    try:
+        rules = list(args.rule)
+        if args.rules_file:
+            with open(args.rules_file, 'r') as file:
+                rules.extend(read_rules(file))
+        for rule in rules:
+            compile_rule(rule)
+        if args.sorted:
+            if not args.algorithm:
+                parser.error('--sorted needs --algorithm')
+            algorithm = parse_algorithm(args.algorithm)
+            targets = SortedDigests(args.targets, digest_size(*algorithm))
+        else:
+            with open(args.targets, 'r') as file:
+                targets = read_targets(file)
+            if not targets:
+                parser.error('no target digests')
+            width = len(next(iter(targets)))
+            if any(len(digest) != width for digest in targets):
+                parser.error('target digests have different lengths')
+            algorithm = parse_algorithm(args.algorithm or ALGORITHM_BY_LENGTH.get(width * 2, '?'))
+            if digest_size(*algorithm) != width:
+                parser.error(f'{args.algorithm} digests are not {width * 2} hex digits')
+        if args.write_sorted:
+            write_sorted_digests(targets, args.write_sorted)
+            return 0
+        wordlist = sys.stdin.buffer if args.wordlist == '-' else open(args.wordlist, 'rb')
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    last = time.monotonic()
+    progress = None
+    try:
+        for event in crack(read_blocks(wordlist, args.block_size), algorithm, targets, rules or None,
+                           args.workers):
+            if isinstance(event, Progress):
+                progress = event
+                if args.progress and time.monotonic() - last >= args.progress:
+                    print(format_progress(progress, len(targets)), file=sys.stderr)
+                    last = time.monotonic()
+            else:
+                digest, candidate = event
+                print(f"{digest.hex()}:{show_candidate(candidate)}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if wordlist is not sys.stdin.buffer:
+            wordlist.close()
+        if isinstance(targets, SortedDigests):
+            targets.close()
+    if progress:
+        print(format_progress(progress, len(targets)), file=sys.stderr)
+    return 0 if progress and progress.found == len(targets) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
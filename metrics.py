@@ -0,0 +1,323 @@
+#!/usr/bin/python3
+# Instrumentation shared by packet_sniffer and port_scanner: counters and
+# HDR-style latency histograms kept in a registry. The registry is exposed as
+# Prometheus text on a local HTTP endpoint or as a periodic one-line summary.
+# Recording is an add under a lock, and nothing is formatted until someone
+# looks. Values kept elsewhere (the capture pipeline's counters, the kernel's
+# drop counts) are read through collectors only when the registry is read. An
+# opt-in sampling profiler shows where the time goes.
+#   port_scanner.py --metrics-port 9464 10.0.0.0/24 & curl -s localhost:9464/metrics
+#   packet_sniffer.py --stats-interval 5 --profile sniffer.folded
+import collections
+import http.server
+import os
+import sys
+import threading
+
+class Counter:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+# Latencies in log-linear buckets, as HdrHistogram keeps them: every power of
+# two is split into SUB_BUCKETS / 2 equal steps, so any value is known to
+# within 1/64 of itself, from a microsecond to hours, in a few thousand
+# counters at most
+class Histogram:
+    SUB_BITS = 7
+    SUB_BUCKETS = 1 << SUB_BITS
+    HALF = SUB_BUCKETS // 2
+    # Bucket bounds of the Prometheus exposition, in seconds
+    BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+              0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    __slots__ = ('counts', 'count', 'sum', 'max', 'lock')
+
+    def __init__(self):
+        self.counts = [0] * self.SUB_BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def index(cls, micros):
+        if micros < cls.SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - cls.SUB_BITS
+        return shift * cls.HALF + (micros >> shift)
+
+    # The microseconds just past the end of bucket `index`
+    @classmethod
+    def upper(cls, index):
+        if index < cls.SUB_BUCKETS:
+            return index + 1
+        shift = index // cls.HALF - 1
+        return (index - shift * cls.HALF + 1) << shift
+
+    def record(self, seconds):
+        micros = max(0, int(seconds * 1e6))
+        index = self.index(micros)
+        with self.lock:
+            counts = self.counts
+            if index >= len(counts):
+                counts.extend([0] * (index + 1 - len(counts)))
+            counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if micros > self.max:
+                self.max = micros
+
+    # The value `fraction` of the recordings are at or below, in seconds
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        wanted = max(1, fraction * self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(self.upper(index) - 1, self.max) / 1e6
+        return self.max / 1e6
+
+    # Recordings at or below each of `bounds` (seconds), cumulative
+    def cumulative(self, bounds):
+        totals = []
+        seen = 0
+        index = 0
+        counts = self.counts
+        for bound in bounds:
+            limit = bound * 1e6
+            while index < len(counts) and self.upper(index) - 1 <= limit:
+                seen += counts[index]
+                index += 1
+            totals.append(seen)
+        return totals
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+Sample = collections.namedtuple('Sample', 'name kind help labels value')
+
+# Metrics by name and labels. A collector is a function returning Samples; it
+# is called every time the registry is read.
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def _get(self, factory, kind, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        entry = self.metrics.get(key)
+        if entry is None:
+            entry = self.metrics[key] = Sample(name, kind, help, labels, factory())
+        elif entry.kind != kind:
+            raise ValueError(f"{name} is already a {entry.kind}")
+        return entry.value
+
+    def counter(self, name, help, **labels):
+        return self._get(Counter, 'counter', name, help, labels)
+
+    def histogram(self, name, help, **labels):
+        return self._get(Histogram, 'histogram', name, help, labels)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        self.collectors.remove(collector)
+
+    # Every metric, registered ones first, grouped by name
+    def samples(self):
+        samples = list(self.metrics.values())
+        for collector in list(self.collectors):
+            samples.extend(collector())
+        order = {}
+        for sample in samples:
+            order.setdefault(sample.name, len(order))
+        return sorted(samples, key=lambda sample: order[sample.name])
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        last = None
+        for name, kind, help, labels, value in self.samples():
+            if name != last:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                last = name
+            if kind != 'histogram':
+                lines.append(f"{name}{_labels(labels)} {_number(getattr(value, 'value', value))}")
+                continue
+            for bound, count in zip(value.BOUNDS, value.cumulative(value.BOUNDS)):
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {value.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(value.sum)}")
+            lines.append(f"{name}_count{_labels(labels)} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+    # One line: counters as name=value, histograms as their count and
+    # percentiles in milliseconds
+    def summary(self):
+        fields = []
+        for name, kind, _, labels, value in self.samples():
+            name = name[:-len('_total')] if name.endswith('_total') else name
+            label = ','.join(str(label) for label in labels.values())
+            name = f"{name}[{label}]" if label else name
+            if kind == 'histogram':
+                fields.append(f"{name}=n:{value.count},p50:{value.percentile(0.5) * 1e3:.2f}ms,"
+                              f"p99:{value.percentile(0.99) * 1e3:.2f}ms,max:{value.max / 1e3:.2f}ms")
+            else:
+                fields.append(f"{name}={_number(getattr(value, 'value', value))}")
+        return ' '.join(fields)
+
+# The registry the scripts' instruments live in
+REGISTRY = Registry()
+
+# Serve `registry` as Prometheus text at /metrics from a daemon thread. Binds
+# to localhost unless told otherwise. Returns the server; shutdown() stops it.
+def serve(registry, port, host='127.0.0.1'):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Writes the registry's summary line to `out` every `interval` seconds, and
+# once more when stopped
+class StatsReporter:
+    def __init__(self, registry, interval, out=None):
+        self.registry = registry
+        self.interval = interval
+        self.out = out or sys.stderr
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            print(self.registry.summary(), file=self.out, flush=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        print(self.registry.summary(), file=self.out, flush=True)
+
+# The instrumentation a command line asked for: a /metrics endpoint on
+# `metrics_port`, the summary line every `stats_interval` seconds and a
+# sampling profile written to `profile` when stopped. Each is left out when
+# its argument is None.
+class Instruments:
+    def __init__(self, registry, metrics_port=None, stats_interval=None, profile=None,
+                 host='127.0.0.1'):
+        self.registry = registry
+        self.metrics_port = metrics_port
+        self.stats_interval = stats_interval
+        self.profile = profile
+        self.host = host
+        self.server = self.reporter = self.profiler = None
+
+    # Raises OSError when the endpoint cannot be bound
+    def start(self):
+        if self.metrics_port is not None:
+            self.server = serve(self.registry, self.metrics_port, self.host)
+        if self.stats_interval:
+            self.reporter = StatsReporter(self.registry, self.stats_interval).start()
+        if self.profile:
+            self.profiler = SamplingProfiler().start()
+        return self
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler.write(self.profile)
+            print(f"{self.profiler.samples} profile samples written to {self.profile}", file=sys.stderr)
+        if self.reporter is not None:
+            self.reporter.stop()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+# Opt-in sampling profiler. A thread looks at the stack of every other thread
+# in this process every `interval` seconds and counts what it sees; write()
+# saves the counts as collapsed stacks, which flamegraph.pl and speedscope
+# read. Worker processes are not sampled.
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    name = names.get(code)
+                    if name is None:
+                        name = names[code] = (f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                                              f"{code.co_firstlineno})")
+                    stack.append(name)
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+    # The functions seen most often anywhere on a stack, with their share of
+    # the samples
+    def top(self, count=10):
+        seen = collections.Counter()
+        for stack, hits in self.stacks.items():
+            for name in set(stack.split(';')):
+                seen[name] += hits
+        total = sum(self.stacks.values()) or 1
+        return [(name, hits / total) for name, hits in seen.most_common(count)]
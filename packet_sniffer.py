@@ -1,18 +1,295 @@
+import argparse
+import collections
+import mmap
+import multiprocessing
+import queue
+import select
+import signal
 import socket
 import struct
+import sys
+import threading
 import time
 
-def packet_sniffer():
+import metrics
+from bpf_filter import PacketFilter
+from flow_table import FlowTable
+from pcap_file import PcapReader, PcapWriter
+
+# Header layouts are compiled once and read straight out of the receive buffer
+ETH_HEADER = struct.Struct('!6s6sH')
+VLAN_TAG = struct.Struct('!HH')
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+# Version, traffic class and flow label, payload length, next header, hop limit
+IPV6_HEADER = struct.Struct('!IHBB16s16s')
+TCP_HEADER = struct.Struct('!HHLLBBHHH')
+UDP_HEADER = struct.Struct('!HHHH')
+ICMP_HEADER = struct.Struct('!BBH')
+
+ETH_LENGTH = ETH_HEADER.size
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = 0x8100
+ETHERTYPE_QINQ = 0x88a8
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_ICMPV6 = 58
+
+ETHERTYPE_NAMES = {0x0800: 'IPv4', 0x0806: 'ARP', 0x86dd: 'IPv6', 0x8100: '802.1Q', 0x88a8: '802.1ad',
+                   0x8847: 'MPLS', 0x88cc: 'LLDP'}
+
+MAX_FRAME = 65535
+
+# Not exported by the socket module
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+ETH_P_ALL = 3
+TPACKET_STATS = struct.Struct('II')
+
+# TPACKET_V3 ring layouts (linux/if_packet.h)
+TPACKET_REQ3 = struct.Struct('IIIIIII')
+# tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1's
+# block_status, num_pkts, offset_to_first_pkt
+TPACKET_BLOCK_DESC = struct.Struct('IIIII')
+TPACKET_BLOCK_STATUS = 8
+# tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac
+TPACKET3_HDR = struct.Struct('IIIIIIH')
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# Fields of each layer. Only `length`, `ethertype`, `protocol`, the layer
+# offsets and `ip_header_length` are found while the frame is walked; the rest
+# are unpacked from the frame the first time one of their layer's fields is
+# read. Fields of layers that are not present are None.
+LAYER_FIELDS = {
+    'link': ('dest_mac', 'src_mac', 'vlan_ids'),
+    'network': ('version', 'ttl', 'src_ip', 'dst_ip'),
+    'transport': ('src_port', 'dst_port', 'tcp_flags', 'udp_length', 'udp_checksum',
+                  'icmp_type', 'icmp_code'),
+}
+FIELD_LAYERS = {field: layer for layer, fields in LAYER_FIELDS.items() for field in fields}
+
+# Headers of one frame, decoded lazily. `link`, `network` and `transport` hold
+# the function that fills in each layer's fields from the frame, or one that
+# sets them to None for a layer that was not found. The packet reads from the
+# frame it was decoded from, so a packet that is kept after its buffer is
+# reused must be load()ed first.
+class Packet:
+    __slots__ = ('buffer', 'length', 'ethertype', 'link', 'network', 'transport',
+                 'network_start', 'ip_header_length', 'protocol', 'transport_start',
+                 *FIELD_LAYERS)
+
+    def __init__(self, buffer, length, ethertype):
+        self.buffer = buffer
+        self.length = length
+        self.ethertype = ethertype
+        self.link = decode_ethernet_fields
+        self.network = clear_network_fields
+        self.transport = clear_transport_fields
+        self.network_start = ETH_LENGTH
+        self.ip_header_length = self.protocol = self.transport_start = None
+
+    # Only called for fields that have not been filled in yet
+    def __getattr__(self, name):
+        layer = FIELD_LAYERS.get(name)
+        if layer is None:
+            raise AttributeError(name)
+        getattr(self, layer)(self)
+        return getattr(self, name)
+
+    # Unpack every field now and let go of the frame
+    def load(self):
+        for field in FIELD_LAYERS:
+            getattr(self, field)
+        self.buffer = None
+        return self
+
+    # Addresses are kept as raw bytes and only formatted when someone asks
+    @property
+    def src_addr(self):
+        return format_ip(self.src_ip)
+
+    @property
+    def dst_addr(self):
+        return format_ip(self.dst_ip)
+
+def _clear_fields(layer):
+    fields = LAYER_FIELDS[layer]
+
+    def clear(packet):
+        for field in fields:
+            setattr(packet, field, None)
+    return clear
+
+clear_network_fields = _clear_fields('network')
+clear_transport_fields = _clear_fields('transport')
+
+def format_ip(address):
+    if not address:
+        return None
+    if len(address) == 4:
+        return socket.inet_ntoa(address)
+    return socket.inet_ntop(socket.AF_INET6, address)
+
+def open_raw_socket(interface=None):
+    # Create raw socket (requires admin privileges)
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(ETH_P_ALL))
+    if interface:
+        sock.bind((interface, ETH_P_ALL))
+    return sock
+
+# Packets seen and dropped by the kernel since the last call (the kernel resets
+# the counters on every read), or None for sockets that do not support it and
+# for sources that are not sockets at all
+def read_kernel_stats(sock):
+    try:
+        return TPACKET_STATS.unpack(sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS.size))
+    except (OSError, AttributeError):
+        return None
+
+# Capture through a memory-mapped TPACKET_V3 RX ring. The kernel fills whole
+# blocks of frames in memory shared with us, so there is no syscall or copy per
+# frame; we only poll when the next block is not ready yet. Frames are yielded
+# as memoryviews into the ring and are only valid until the generator advances,
+# because the block is then handed back to the kernel.
+class MmapCapture:
+    def __init__(self, interface=None, block_size=1 << 22, block_count=64, frame_size=2048,
+                 retire_timeout_ms=60, frame_filter=None):
+        self.block_size = block_size
+        self.block_count = block_count
+        self.sock = open_raw_socket(interface)
+        try:
+            # Attached before the ring exists, so every frame in it has been filtered
+            self.check = install_filter(self.sock, frame_filter)
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            frame_count = block_size // frame_size * block_count
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, TPACKET_REQ3.pack(
+                block_size, block_count, frame_size, frame_count, retire_timeout_ms, 0, 0))
+            self.ring = mmap.mmap(self.sock.fileno(), block_size * block_count,
+                                  mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except OSError:
+            self.sock.close()
+            raise
+        self.view = memoryview(self.ring)
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        self.next_block = 0
+
+    # Yields (frame, caplen, wirelen, timestamp) for every captured frame. Stops
+    # after `timeout` seconds without a ready block, or runs forever when timeout
+    # is None.
+    def frames(self, timeout=None):
+        view = self.view
+        poll_ms = -1 if timeout is None else int(timeout * 1000)
+        while True:
+            block = self.next_block * self.block_size
+            _, _, status, count, offset = TPACKET_BLOCK_DESC.unpack_from(view, block)
+            if not status & TP_STATUS_USER:
+                if not self.poller.poll(poll_ms):
+                    return
+                continue
+            offset += block
+            check = self.check
+            for _ in range(count):
+                next_offset, sec, nsec, snaplen, wirelen, _, mac = TPACKET3_HDR.unpack_from(view, offset)
+                frame = view[offset + mac:offset + mac + snaplen]
+                if check is None or check(frame, snaplen):
+                    yield frame, snaplen, wirelen, sec + nsec * 1e-9
+                offset += next_offset
+            struct.pack_into('I', view, block + TPACKET_BLOCK_STATUS, TP_STATUS_KERNEL)
+            self.next_block = (self.next_block + 1) % self.block_count
+
+    def close(self):
+        self.view.release()
+        try:
+            self.ring.close()
+        except BufferError:
+            # A caller still holds a frame; the mapping goes away with it
+            pass
+        self.sock.close()
+
+def mmap_sniffer(on_packet, interface=None, frame_filter=None, registry=None):
+    capture = MmapCapture(interface, frame_filter=frame_filter)
+    stats = None
+    if registry is not None:
+        stats = PipelineStats()
+        registry.add_collector(pipeline_collector(stats, capture.sock))
+    try:
+        print("Starting packet capture... (Press Ctrl+C to stop)")
+        for frame, length, _, _ in capture.frames():
+            if stats is not None:
+                stats.captured += 1
+            packet = decode_packet(frame, length)
+            if packet is not None:
+                if stats is not None:
+                    stats.decoded += 1
+                on_packet(packet)
+    except KeyboardInterrupt:
+        print("\nCapture stopped by user")
+    finally:
+        capture.close()
+
+# Attach `frame_filter` (a bpf_filter.PacketFilter) to `sock` so the kernel
+# drops unwanted frames before they are copied to us. Frames that arrived before
+# the program was attached are discarded. Returns the check the caller still has
+# to run on each raw frame: None when the kernel took the filter.
+def install_filter(sock, frame_filter):
+    if frame_filter is None:
+        return None
+    if not frame_filter.attach(sock):
+        return frame_filter.match
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    scratch = bytearray(MAX_FRAME)
+    try:
+        while True:
+            sock.recv_into(scratch)
+    except BlockingIOError:
+        pass
+    finally:
+        sock.settimeout(timeout)
+    return None
+
+# With a metrics `registry`, the capture's counters and the kernel's drop counts
+# are exported through it
+def packet_sniffer(on_packet=None, interface=None, use_mmap=False, frame_filter=None,
+                   registry=None):
+    if on_packet is None:
+        on_packet = print_packet
+    if use_mmap:
+        mmap_sniffer(on_packet, interface, frame_filter, registry)
+        return
+    stats = None if registry is None else PipelineStats()
+    # One preallocated buffer is reused for every frame; recv_into fills it in place
+    buffer = bytearray(MAX_FRAME)
+    view = memoryview(buffer)
+    sniffer = None
     try:
-        # Create raw socket (requires admin privileges)
-        sniffer = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(3))
+        sniffer = open_raw_socket(interface)
         sniffer.settimeout(2)
+        check = install_filter(sniffer, frame_filter)
+        if stats is not None:
+            registry.add_collector(pipeline_collector(stats, sniffer))
 
         print("Starting packet capture... (Press Ctrl+C to stop)")
         while True:
             try:
-                raw_packet = sniffer.recvfrom(65535)[0]
-                parse_packet(raw_packet)
+                length = sniffer.recv_into(buffer)
+                if stats is not None:
+                    stats.captured += 1
+                if check is not None and not check(view, length):
+                    if stats is not None:
+                        stats.filtered += 1
+                    continue
+                packet = decode_packet(view, length)
+                if packet is not None:
+                    if stats is not None:
+                        stats.decoded += 1
+                    on_packet(packet)
 
             except socket.timeout:
                 # Handle timeout gracefully
@@ -20,69 +297,651 @@ def packet_sniffer():
 
     except KeyboardInterrupt:
         print("\nCapture stopped by user")
+    finally:
+        if sniffer is not None:
+            sniffer.close()
+
+# Frame records (frame, caplen, wirelen, timestamp) from a live capture, in the
+# same shape MmapCapture.frames and pcap_file.PcapReader produce. The socket or
+# ring is closed when the generator is.
+def live_frames(interface=None, use_mmap=False, frame_filter=None):
+    if use_mmap:
+        capture = MmapCapture(interface, frame_filter=frame_filter)
+        try:
+            print("Starting packet capture... (Press Ctrl+C to stop)", file=sys.stderr)
+            yield from capture.frames()
+        finally:
+            capture.close()
+        return
+    buffer = bytearray(MAX_FRAME)
+    view = memoryview(buffer)
+    sniffer = open_raw_socket(interface)
+    try:
+        check = install_filter(sniffer, frame_filter)
+        print("Starting packet capture... (Press Ctrl+C to stop)", file=sys.stderr)
+        while True:
+            length = sniffer.recv_into(buffer)
+            if check is None or check(view, length):
+                yield view, length, length, time.time()
     finally:
         sniffer.close()
 
+# Record raw frames to `writer` (a pcap_file.PcapWriter) without decoding them
+def save_capture(writer, interface=None, use_mmap=False, frame_filter=None):
+    count = 0
+    frames = live_frames(interface, use_mmap, frame_filter)
+    try:
+        for frame, caplen, wirelen, timestamp in frames:
+            writer.write(frame, caplen, wirelen, timestamp)
+            count += 1
+    except KeyboardInterrupt:
+        print("\nCapture stopped by user", file=sys.stderr)
+    finally:
+        frames.close()
+        writer.close()
+    return count
+
+# Flow mode: fold every frame record into `table` (a flow_table.FlowTable) and
+# write the top flows every `report_interval` seconds of capture time, then once
+# more at the end. Idle flows are expired as the capture clock moves on, so a
+# replayed file gives the same report every time.
+def aggregate_flows(records, table, out=None, top=10, report_interval=10.0):
+    out = out or sys.stdout
+    now = next_expire = next_report = None
+    try:
+        for frame, caplen, wirelen, timestamp in records:
+            if timestamp is not None:
+                now = timestamp
+            elif now is None:
+                now = time.time()
+            packet = decode_packet(frame, caplen)
+            if packet is None:
+                continue
+            table.add(packet, wirelen, now)
+            if next_expire is None:
+                next_expire = now + 1
+                next_report = now + report_interval if report_interval else None
+            if now >= next_expire:
+                table.expire(now)
+                next_expire = now + 1
+            if next_report is not None and now >= next_report:
+                out.write(table.summary(top))
+                out.flush()
+                next_report = now + report_interval
+    except KeyboardInterrupt:
+        print("\nCapture stopped by user", file=sys.stderr)
+    finally:
+        if hasattr(records, 'close'):
+            records.close()
+    out.write(table.summary(top))
+    return table
+
+# Feed every frame of a pcap or pcapng file through the decoder, as fast as the
+# file can be read. No privileges or interface needed. Returns the number of
+# frames read.
+def replay(path, on_packet=None, frame_filter=None):
+    if on_packet is None:
+        on_packet = print_packet
+    count = 0
+    with PcapReader(path) as reader:
+        for frame, length, _, _ in reader:
+            count += 1
+            if frame_filter is not None and not frame_filter(frame, length):
+                continue
+            packet = decode_packet(frame, length)
+            if packet is not None:
+                on_packet(packet)
+    return count
+
+# Makes a pcap file look like a socket to run_pipeline: every recv_into copies
+# the next frame, and an empty read marks the end of the file
+class PcapSource:
+    def __init__(self, reader):
+        self.frames = iter(reader)
+
+    def recv_into(self, buffer):
+        for frame, length, _, _ in self.frames:
+            length = min(length, len(buffer))
+            buffer[:length] = frame[:length]
+            return length
+        return 0
+
+# Layer decoders by the Ethertype and by the IP protocol number that announce
+# them. A decoder is called as decoder(packet, buffer, offset, length) with the
+# offset its header starts at. If the header fits in the frame it records the
+# layer on the packet: its offset, and the function that fills in every field
+# of that layer from packet.buffer once one of them is read. It returns the
+# (table, key, offset) of the header that follows; None ends the walk.
+ETHERTYPE_DECODERS = {}
+IP_PROTOCOL_DECODERS = {}
+
+def register_ethertype(ethertype, decoder):
+    ETHERTYPE_DECODERS[ethertype] = decoder
+
+def register_ip_protocol(protocol, decoder):
+    IP_PROTOCOL_DECODERS[protocol] = decoder
+
+# Decode the first `length` bytes of `buffer` (bytes, bytearray or memoryview)
+# without slicing it. Only the bytes needed to find each layer are read here.
+# Returns None for frames shorter than an Ethernet header.
+def decode_packet(buffer, length=None):
+    if length is None:
+        length = len(buffer)
+    if length < ETH_LENGTH:
+        return None
+    ethertype = buffer[12] << 8 | buffer[13]
+    packet = Packet(buffer, length, ethertype)
+    table, key, offset = ETHERTYPE_DECODERS, ethertype, ETH_LENGTH
+    while True:
+        decoder = table.get(key)
+        if decoder is None:
+            return packet
+        step = decoder(packet, buffer, offset, length)
+        if step is None:
+            return packet
+        table, key, offset = step
+
+def decode_ethernet_fields(packet):
+    buffer = packet.buffer
+    packet.dest_mac, packet.src_mac, _ = ETH_HEADER.unpack_from(buffer, 0)
+    packet.vlan_ids = tuple(VLAN_TAG.unpack_from(buffer, tag)[0] & 0xfff
+                            for tag in range(ETH_LENGTH, packet.network_start, 4)) or None
+
+# 802.1Q and 802.1ad tags: the Ethertype after the tag says what follows, and
+# `ethertype` ends up as that of the payload
+def decode_vlan(packet, buffer, offset, length):
+    if length < offset + VLAN_TAG.size:
+        return None
+    packet.ethertype = buffer[offset + 2] << 8 | buffer[offset + 3]
+    packet.network_start = offset + VLAN_TAG.size
+    return ETHERTYPE_DECODERS, packet.ethertype, packet.network_start
+
+def decode_ipv4(packet, buffer, offset, length):
+    if length < offset + IPV4_HEADER.size:
+        return None
+    header_length = (buffer[offset] & 0xF) * 4
+    if header_length < IPV4_HEADER.size:
+        return None
+    packet.network = decode_ipv4_fields
+    packet.network_start = offset
+    packet.ip_header_length = header_length
+    packet.protocol = buffer[offset + 9]
+    packet.transport_start = offset + header_length
+    # Only the first fragment carries the transport header
+    if (buffer[offset + 6] & 0x1F) | buffer[offset + 7]:
+        return None
+    return IP_PROTOCOL_DECODERS, packet.protocol, packet.transport_start
+
+def decode_ipv4_fields(packet):
+    (version_ihl, _, _, _, _, packet.ttl, _, _,
+     packet.src_ip, packet.dst_ip) = IPV4_HEADER.unpack_from(packet.buffer, packet.network_start)
+    packet.version = version_ihl >> 4
+
+# Extension headers skipped to find the upper-layer protocol, with the unit of
+# their length field: each is 8 bytes plus that many units more. A fragment
+# header is always 8 bytes.
+IPV6_FRAGMENT = 44
+IPV6_EXTENSION_UNITS = {0: 8, 43: 8, 60: 8, 51: 4, IPV6_FRAGMENT: 0}
+
+def decode_ipv6(packet, buffer, offset, length):
+    if length < offset + IPV6_HEADER.size:
+        return None
+    packet.network = decode_ipv6_fields
+    packet.network_start = offset
+    protocol = buffer[offset + 6]
+    start = offset + IPV6_HEADER.size
+    fragment = 0
+    while protocol in IPV6_EXTENSION_UNITS and not fragment and length >= start + 8:
+        if protocol == IPV6_FRAGMENT:
+            fragment = (buffer[start + 2] << 8 | buffer[start + 3]) >> 3
+        protocol, start = buffer[start], start + 8 + buffer[start + 1] * IPV6_EXTENSION_UNITS[protocol]
+    packet.ip_header_length = start - offset
+    packet.protocol = protocol
+    packet.transport_start = start
+    # Only the first fragment carries the transport header
+    if fragment or protocol in IPV6_EXTENSION_UNITS:
+        return None
+    return IP_PROTOCOL_DECODERS, protocol, start
+
+def decode_ipv6_fields(packet):
+    first, _, _, packet.ttl, packet.src_ip, packet.dst_ip = IPV6_HEADER.unpack_from(
+        packet.buffer, packet.network_start)
+    packet.version = first >> 28
+
+def decode_tcp(packet, buffer, offset, length):
+    if length >= offset + TCP_HEADER.size:
+        packet.transport = decode_tcp_fields
+    return None
+
+def decode_tcp_fields(packet):
+    tcph = TCP_HEADER.unpack_from(packet.buffer, packet.transport_start)
+    packet.src_port = tcph[0]
+    packet.dst_port = tcph[1]
+    packet.tcp_flags = tcph[5]
+    packet.udp_length = packet.udp_checksum = packet.icmp_type = packet.icmp_code = None
+
+def decode_udp(packet, buffer, offset, length):
+    if length >= offset + UDP_HEADER.size:
+        packet.transport = decode_udp_fields
+    return None
+
+def decode_udp_fields(packet):
+    (packet.src_port, packet.dst_port,
+     packet.udp_length, packet.udp_checksum) = UDP_HEADER.unpack_from(packet.buffer, packet.transport_start)
+    packet.tcp_flags = packet.icmp_type = packet.icmp_code = None
+
+# ICMP and ICMPv6 share the type and code layout
+def decode_icmp(packet, buffer, offset, length):
+    if length >= offset + ICMP_HEADER.size:
+        packet.transport = decode_icmp_fields
+    return None
+
+def decode_icmp_fields(packet):
+    packet.icmp_type, packet.icmp_code, _ = ICMP_HEADER.unpack_from(packet.buffer, packet.transport_start)
+    packet.src_port = packet.dst_port = packet.tcp_flags = packet.udp_length = packet.udp_checksum = None
+
+register_ethertype(ETHERTYPE_VLAN, decode_vlan)
+register_ethertype(ETHERTYPE_QINQ, decode_vlan)
+register_ethertype(ETHERTYPE_IPV4, decode_ipv4)
+register_ethertype(ETHERTYPE_IPV6, decode_ipv6)
+register_ip_protocol(IPPROTO_TCP, decode_tcp)
+register_ip_protocol(IPPROTO_UDP, decode_udp)
+register_ip_protocol(IPPROTO_ICMP, decode_icmp)
+register_ip_protocol(IPPROTO_ICMPV6, decode_icmp)
+
+def format_ethertype(ethertype):
+    name = ETHERTYPE_NAMES.get(ethertype)
+    return f"0x{ethertype:04x} ({name})" if name else f"0x{ethertype:04x}"
+
+# The text print_packet writes, as one string
+def format_packet(packet):
+    lines = [
+        f"\nEthernet Frame:",
+        f"Destination: {format_mac(packet.dest_mac)}, Source: {format_mac(packet.src_mac)}, "
+        f"Protocol: {format_ethertype(packet.ethertype)}",
+    ]
+    if packet.vlan_ids:
+        lines.append(f"VLAN: {', '.join(map(str, packet.vlan_ids))}")
+
+    if packet.version is not None:
+        lines.append(f"IP Packet:")
+        lines.append(f"Version: {packet.version}, Header Length: {packet.ip_header_length} bytes")
+        lines.append(f"{'Hop Limit' if packet.version == 6 else 'TTL'}: {packet.ttl}, "
+                     f"Protocol: {packet.protocol}")
+        lines.append(f"Source: {packet.src_addr}, Destination: {packet.dst_addr}")
+        lines.append(f"Transport Layer Start: {packet.transport_start}")
+
+        if packet.tcp_flags is not None:
+            lines.append(f"TCP Segment:")
+            lines.append(f"TCP Ports: {packet.src_port}->{packet.dst_port} Flags: {packet.tcp_flags:08b}")
+
+        elif packet.udp_length is not None:
+            lines.append(f"UDP Datagram:")
+            lines.append(f"UDP Ports: {packet.src_port}->{packet.dst_port} Length: {packet.udp_length} bytes")
+            lines.append(f"Checksum: {packet.udp_checksum}")
+
+        elif packet.icmp_type is not None:
+            lines.append(f"ICMP{'v6' if packet.protocol == IPPROTO_ICMPV6 else ''} Message:")
+            lines.append(f"Type: {packet.icmp_type}, Code: {packet.icmp_code}")
+
+    return '\n'.join(lines) + '\n'
+
+def print_packet(packet):
+    sys.stdout.write(format_packet(packet))
+
 def parse_packet(raw_packet):
-    # Parse Ethernet header (first 14 bytes)
-    eth_header = raw_packet[:14]
-    eth = struct.unpack('!6s6sH', eth_header)
-    dest_mac = format_mac(eth[0])
-    src_mac = format_mac(eth[1])
-    proto = socket.htons(eth[2])
-
-    print(f"\nEthernet Frame:")
-    print(f"Destination: {dest_mac}, Source: {src_mac}, Protocol: {proto}")
-
-    # Parse IP packets (Ethertype 0x0800)
-    if proto == 8:
-        ip_header = raw_packet[14:34]
-        iph = struct.unpack('!BBHHHBBH4s4s', ip_header)
-
-        version_ihl = iph[0]
-        version = version_ihl >> 4
-        ihl = version_ihl & 0xF
-        ttl = iph[5]
-        protocol = iph[6]
-        s_addr = socket.inet_ntoa(iph[8])
-        d_addr = socket.inet_ntoa(iph[9])
-        # Calculate IP header length and transport layer start position
-        ip_header_length = ihl * 4
-        transport_start = 14 + ip_header_length  # Ethernet(14) + IP header length
-
-        print(f"IP Packet:")
-        print(f"Version: {version}, Header Length: {ip_header_length} bytes")
-        print(f"TTL: {ttl}, Protocol: {protocol}")
-        print(f"Source: {s_addr}, Destination: {d_addr}")
-        print(f"Transport Layer Start: {transport_start}")
-
-        # TCP protocol (6)
-        if protocol == 6 and len(raw_packet) >= transport_start + 20:
-            tcp_header = raw_packet[transport_start:transport_start+20]
-            tcph = struct.unpack('!HHLLBBHHH', tcp_header)
-
-            source_port = tcph[0]
-            dest_port = tcph[1]
-            flags = tcph[5]
-
-            print(f"TCP Segment:")
-            print(f"TCP Ports: {source_port}->{dest_port} Flags: {flags:08b}")
-
-        elif protocol == 17 and len(raw_packet) >= transport_start + 8:
-            udp_header = raw_packet[transport_start:transport_start+8]
-            udph = struct.unpack('!HHHH', udp_header)
-        
-            source_port = udph[0]
-            dest_port = udph[1]
-            length = udph[2]
-            checksum = udph[3]
-
-            print(f"UDP Datagram:")
-            print(f"UDP Ports: {udph[0]}->{udph[1]} Length: {length} bytes")
-            print(f"Checksum: {checksum}")
+    packet = decode_packet(raw_packet)
+    if packet is not None:
+        print_packet(packet)
+    return packet
 
 def format_mac(bytes_addr):
-    return ':'.join(f'{b:02x}' for b in bytes_addr)
+    return bytes_addr.hex(':')
+
+# Counters for the capture pipeline. `ring_drops` are frames the capture stage
+# had to throw away because every ring slot was still waiting to be decoded;
+# `backpressure` counts the batches that found the ring more than 3/4 full.
+class PipelineStats:
+    __slots__ = ('captured', 'ring_drops', 'backpressure', 'decoded', 'filtered', 'written',
+                 'kernel_packets', 'kernel_drops')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def format(self):
+        return ' '.join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+
+# Fixed-size frame slots in one anonymous shared mapping. The mapping is created
+# before the decode workers fork, so they read frames straight out of it without
+# any copy or pickling. Slots are used in order: the capture stage owns
+# [head, tail + slots) and the decoders own [tail, head).
+class PacketRing:
+    def __init__(self, slots=8192, slot_size=2048):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.memory = mmap.mmap(-1, slots * slot_size)
+        self.view = memoryview(self.memory)
+        self.views = [self.view[i * slot_size:(i + 1) * slot_size] for i in range(slots)]
+        self.head = 0
+        self.tail = 0
+
+    def in_use(self):
+        return self.head - self.tail
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.views = []
+        self.view.release()
+        self.memory.close()
+
+# State of a decode worker process, set up once by init_decoder
+_decoder = {}
+
+def init_decoder(memory, slot_size, frame_filter, packet_filter, formatter):
+    # Ctrl+C is handled by the parent, which drains the ring before shutting us down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _decoder['view'] = memoryview(memory)
+    _decoder['slot_size'] = slot_size
+    _decoder['frame_filter'] = frame_filter
+    _decoder['filter'] = packet_filter
+    _decoder['format'] = formatter
+
+# Decode a batch of (slot, length) pairs in a worker. Frames failing the raw
+# `frame_filter` pre-check are skipped before decoding and packets failing
+# `packet_filter` after it. Returns the batch size, the number of decoded,
+# filtered and written frames and the batch's output as one string, so the
+# output stage does a single write per batch.
+def decode_batch(batch):
+    view = _decoder['view']
+    slot_size = _decoder['slot_size']
+    frame_filter = _decoder['frame_filter']
+    packet_filter = _decoder['filter']
+    formatter = _decoder['format']
+    decoded = filtered = 0
+    chunks = []
+    for slot, length in batch:
+        offset = slot * slot_size
+        frame = view[offset:offset + length]
+        if frame_filter is not None and not frame_filter(frame, length):
+            filtered += 1
+            continue
+        packet = decode_packet(frame, length)
+        if packet is None:
+            continue
+        decoded += 1
+        if packet_filter is not None and not packet_filter(packet):
+            filtered += 1
+            continue
+        chunks.append(formatter(packet))
+    return len(batch), decoded, filtered, len(chunks), ''.join(chunks)
+
+# Capture stage: only moves frames from the socket into ring slots and hands
+# batches of slot numbers, with the time each batch was handed over, to the
+# decoders. It never waits on them; when the
+# ring is full the frame is read into a scratch buffer and counted as dropped.
+# A `lossless` source (a file being replayed) waits for free slots instead.
+def capture_frames(source, ring, batches, stats, stop, batch_size=256, lossless=False):
+    scratch = bytearray(MAX_FRAME)
+    batch = []
+    while not stop.is_set():
+        try:
+            if ring.in_use() >= ring.slots:
+                if lossless:
+                    if batch:
+                        batches.put((time.monotonic(), batch))
+                        batch = []
+                    time.sleep(0.001)
+                    continue
+                source.recv_into(scratch)
+                stats.ring_drops += 1
+                continue
+            slot = ring.head % ring.slots
+            length = source.recv_into(ring.views[slot])
+            if not length:  # the source was shut down
+                break
+            batch.append((slot, length))
+            ring.head += 1
+            stats.captured += 1
+            idle = False
+        except socket.timeout:
+            idle = True
+        except OSError:
+            break
+        # Flush full batches, and partial ones whenever the link goes quiet
+        if batch and (len(batch) >= batch_size or idle):
+            if ring.in_use() * 4 > ring.slots * 3:
+                stats.backpressure += 1
+            batches.put((time.monotonic(), batch))
+            batch = []
+    if batch:
+        batches.put((time.monotonic(), batch))
+    batches.put(None)
+
+# The batches for the decoders; the times they were handed over go to `handed`
+def _drain(batches, handed):
+    while True:
+        item = batches.get()
+        if item is None:
+            return
+        handed.append(item[0])
+        yield item[1]
+
+# Reading the kernel's counters resets them, so the capture and a metrics
+# scrape must not both add what they read at the same time
+_kernel_stats_lock = threading.Lock()
+
+def update_kernel_stats(source, stats):
+    with _kernel_stats_lock:
+        counts = read_kernel_stats(source)
+        if counts:
+            stats.kernel_packets += counts[0]
+            stats.kernel_drops += counts[1]
+
+# Metric name, help and labels of each PipelineStats counter
+PIPELINE_METRICS = {
+    'captured': ('sniffer_packets_received_total', 'Frames read from the capture source', {}),
+    'decoded': ('sniffer_packets_decoded_total', 'Frames decoded into packets', {}),
+    'filtered': ('sniffer_packets_filtered_total', 'Frames rejected by the capture filter', {}),
+    'written': ('sniffer_packets_written_total', 'Packets written to the output', {}),
+    'ring_drops': ('sniffer_packets_dropped_total', 'Frames dropped before decoding', {'where': 'ring'}),
+    'kernel_drops': ('sniffer_packets_dropped_total', 'Frames dropped before decoding', {'where': 'kernel'}),
+    'kernel_packets': ('sniffer_kernel_packets_total', 'Frames the kernel passed to the socket', {}),
+    'backpressure': ('sniffer_backpressure_batches_total', 'Batches that found the ring 3/4 full', {}),
+}
+
+# A metrics collector for `stats`. The kernel's counters for `source` are read
+# whenever it is called, so a scrape costs the capture loop nothing.
+def pipeline_collector(stats, source=None):
+    def collect():
+        if source is not None:
+            update_kernel_stats(source, stats)
+        return [metrics.Sample(name, 'counter', help, labels, getattr(stats, field))
+                for field, (name, help, labels) in PIPELINE_METRICS.items()]
+    return collect
+
+# Capture, decode and output as separate stages: a capture thread fills the
+# ring, a process pool decodes and filters batches, and the calling thread
+# writes each batch's output in one call and hands its slots back to the ring.
+# Batches come back in capture order, so slots are released in order too.
+# `source` is anything with recv_into, normally the raw socket or a PcapSource.
+# With a metrics `registry`, the counters are exported through it along with
+# the time from each batch leaving the capture stage to its output being written.
+def run_pipeline(source, out=None, workers=None, packet_filter=None, formatter=format_packet,
+                 ring_slots=8192, slot_size=2048, batch_size=256, stats_interval=None,
+                 frame_filter=None, lossless=False, registry=None):
+    out = out or sys.stdout
+    ring = PacketRing(ring_slots, slot_size)
+    stats = PipelineStats()
+    latency = None
+    if registry is not None:
+        registry.add_collector(pipeline_collector(stats, source))
+        latency = registry.histogram('sniffer_batch_latency_seconds',
+                                     'Time from a batch leaving capture to its output being written')
+    handed = collections.deque()
+    batches = queue.SimpleQueue()
+    stop = threading.Event()
+    # The workers must fork after the ring exists so they share its mapping
+    pool = multiprocessing.get_context('fork').Pool(
+        workers, init_decoder, (ring.memory, slot_size, frame_filter, packet_filter, formatter))
+    capture = threading.Thread(target=capture_frames, daemon=True,
+                               args=(source, ring, batches, stats, stop, batch_size, lossless))
+    capture.start()
+
+    def write_results(results):
+        next_report = time.monotonic() + stats_interval if stats_interval else None
+        for count, decoded, filtered, written, text in results:
+            ring.tail += count
+            handed_at = handed.popleft()
+            stats.decoded += decoded
+            stats.filtered += filtered
+            if text:
+                out.write(text)
+                stats.written += written
+            if latency is not None:
+                latency.record(time.monotonic() - handed_at)
+            if next_report and time.monotonic() >= next_report:
+                update_kernel_stats(source, stats)
+                print(stats.format(), file=sys.stderr)
+                next_report += stats_interval
+
+    results = pool.imap(decode_batch, _drain(batches, handed))
+    try:
+        try:
+            write_results(results)
+        except KeyboardInterrupt:
+            # Stop capturing, but finish what is already in the ring
+            stop.set()
+            write_results(results)
+    finally:
+        stop.set()
+        capture.join()
+        pool.terminate()
+        pool.join()
+        ring.close()
+        out.flush()
+        update_kernel_stats(source, stats)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Raw socket packet sniffer')
+    parser.add_argument('-i', '--interface', help='capture on one interface instead of all')
+    parser.add_argument('-r', '--read', help='decode frames from a pcap or pcapng file instead')
+    parser.add_argument('--mmap', action='store_true',
+                        help='read frames from a memory-mapped TPACKET_V3 ring')
+    parser.add_argument('-f', '--filter',
+                        help='capture filter over IPv4 and IPv6 with up to two VLAN tags, '
+                             'e.g. "tcp and port 443"')
+    parser.add_argument('--workers', type=int,
+                        help='decode in a pipeline with this many worker processes')
+    parser.add_argument('-w', '--output', help='write decoded packets to a file instead of stdout')
+    parser.add_argument('--save', help='record raw frames to this pcap file instead of decoding them')
+    parser.add_argument('--pcapng', action='store_true', help='record in pcapng rather than pcap')
+    parser.add_argument('--rotate-size', type=float, help='start a new file every N megabytes')
+    parser.add_argument('--rotate-seconds', type=float, help='start a new file every N seconds')
+    parser.add_argument('--flows', action='store_true',
+                        help='aggregate packets per 5-tuple and print the top flows instead')
+    parser.add_argument('--top', type=int, default=10, help='flows listed in each flow report')
+    parser.add_argument('--report-interval', type=float, default=10.0,
+                        help='seconds of capture time between flow reports (0 for only at exit)')
+    parser.add_argument('--idle-timeout', type=float, default=60.0,
+                        help='forget flows idle for this many seconds')
+    parser.add_argument('--max-flows', type=int, default=100000, help='flows kept in memory at most')
+    parser.add_argument('--ring-slots', type=int, default=8192, help='frames the capture ring holds')
+    parser.add_argument('--snaplen', type=int, default=2048, help='bytes kept per frame')
+    parser.add_argument('--batch', type=int, default=256, help='frames per decode batch')
+    parser.add_argument('--stats-interval', type=float, help='print capture counters every N seconds')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve capture counters and kernel drops as Prometheus text on this port')
+    parser.add_argument('--profile', help='sample the capture while it runs and write collapsed stacks here')
+    args = parser.parse_args(argv)
+
+    frame_filter = None
+    if args.filter:
+        try:
+            frame_filter = PacketFilter(args.filter)
+        except ValueError as e:
+            parser.error(str(e))
+
+    registry = None
+    if args.metrics_port is not None or args.stats_interval:
+        registry = metrics.REGISTRY
+    # The pipeline prints its own counters; the plain live capture uses the
+    # registry's summary line
+    live = not (args.save or args.flows or args.workers or args.read)
+    instruments = metrics.Instruments(registry, args.metrics_port,
+                                      args.stats_interval if live else None, args.profile)
+    try:
+        instruments.start()
+    except OSError as e:
+        parser.error(f"Cannot serve metrics on port {args.metrics_port}: {e}")
+    try:
+        if args.save:
+            if args.read:
+                parser.error('--save records a live capture and cannot be combined with --read')
+            rotate_bytes = int(args.rotate_size * 1000000) if args.rotate_size else None
+            writer = PcapWriter(args.save, args.pcapng, rotate_bytes=rotate_bytes,
+                                rotate_seconds=args.rotate_seconds)
+            count = save_capture(writer, args.interface, args.mmap, frame_filter)
+            print(f"{count} frames written", file=sys.stderr)
+            return
+
+        if args.flows:
+            if args.workers:
+                parser.error('--flows aggregates in one process and cannot be combined with --workers')
+            table = FlowTable(args.idle_timeout, args.max_flows)
+            out = open(args.output, 'w') if args.output else sys.stdout
+            try:
+                if args.read:
+                    with PcapReader(args.read) as reader:
+                        records = (record for record in reader
+                                   if frame_filter is None or frame_filter(record[0], record[1]))
+                        aggregate_flows(records, table, out, args.top, args.report_interval)
+                else:
+                    aggregate_flows(live_frames(args.interface, args.mmap, frame_filter), table, out,
+                                    args.top, args.report_interval)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            return
+
+        if not args.workers and not args.read:
+            packet_sniffer(interface=args.interface, use_mmap=args.mmap, frame_filter=frame_filter,
+                           registry=registry)
+            return
+
+        out = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            if args.read and not args.workers:
+                start = time.perf_counter()
+                count = replay(args.read, lambda packet: out.write(format_packet(packet)), frame_filter)
+                elapsed = time.perf_counter() - start
+                print(f"{count} frames in {elapsed:.3f} s ({count / max(elapsed, 1e-9):.0f} frames/s)",
+                      file=sys.stderr)
+                return
+
+            if args.read:
+                reader = PcapReader(args.read)
+                source, check = PcapSource(reader), frame_filter
+            else:
+                reader = source = open_raw_socket(args.interface)
+                source.settimeout(0.1)
+                check = install_filter(source, frame_filter)
+                print("Starting packet capture... (Press Ctrl+C to stop)", file=sys.stderr)
+            try:
+                stats = run_pipeline(source, out, args.workers, ring_slots=args.ring_slots,
+                                     slot_size=args.snaplen, batch_size=args.batch,
+                                     stats_interval=args.stats_interval, frame_filter=check,
+                                     lossless=bool(args.read), registry=registry)
+            finally:
+                reader.close()
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"\nCapture stopped: {stats.format()}", file=sys.stderr)
+    finally:
+        instruments.stop()
 
 if __name__ == "__main__":
-    packet_sniffer()
+    main()
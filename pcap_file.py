@@ -0,0 +1,237 @@
+# pcap and pcapng files for packet_sniffer: a buffered, append-only writer with
+# size and time based rotation, and an mmap-backed reader for offline replay.
+# Both deal in the same frame records the capture code produces:
+# (frame, caplen, wirelen, timestamp).
+import mmap
+import os
+import struct
+import time
+
+LINKTYPE_ETHERNET = 1
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAP_HEADER = struct.Struct('IHHiIII')
+PCAP_RECORD = struct.Struct('IIII')
+
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER = 0x1a2b3c4d
+PCAPNG_BLOCK = struct.Struct('II')
+PCAPNG_SHB_BODY = struct.Struct('IHHq')
+PCAPNG_IDB_BODY = struct.Struct('HHI')
+PCAPNG_EPB_BODY = struct.Struct('IIIII')
+PCAPNG_OPTION = struct.Struct('HH')
+PCAPNG_OPT_TSRESOL = 9
+
+def _pad4(length):
+    return (length + 3) & ~3
+
+# Append-only capture writer. Records collect in memory and go to disk in
+# `buffer_size` chunks. With `rotate_bytes` or `rotate_seconds` set, output is
+# spread over numbered files (capture-00000.pcap, capture-00001.pcap, ...) and
+# a new one is started once the current file is too big or too old. Existing
+# files are appended to rather than truncated.
+class PcapWriter:
+    def __init__(self, path, pcapng=False, snaplen=65535, linktype=LINKTYPE_ETHERNET,
+                 rotate_bytes=None, rotate_seconds=None, buffer_size=1 << 20):
+        self.path = path
+        self.pcapng = pcapng
+        self.snaplen = snaplen
+        self.linktype = linktype
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.index = 0
+        self.file = None
+        self._open()
+
+    def _file_name(self):
+        if not (self.rotate_bytes or self.rotate_seconds):
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f"{root}-{self.index:05d}{ext}"
+
+    def _open(self):
+        self.file = open(self._file_name(), 'ab')
+        self.file_bytes = self.file.tell()
+        self.opened = time.monotonic()
+        # pcapng allows a new section at any point, so an appended pcapng file
+        # stays valid; a pcap file only has a header at the very start
+        if self.pcapng or self.file_bytes == 0:
+            self.buffer += self._header()
+
+    def _header(self):
+        if not self.pcapng:
+            return PCAP_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0, self.snaplen, self.linktype)
+        shb = PCAPNG_SHB_BODY.pack(PCAPNG_BYTE_ORDER, 1, 0, -1)
+        idb = PCAPNG_IDB_BODY.pack(self.linktype, 0, self.snaplen)
+        return self._block(PCAPNG_SHB, shb) + self._block(PCAPNG_IDB, idb)
+
+    @staticmethod
+    def _block(block_type, body):
+        length = 12 + len(body)
+        return PCAPNG_BLOCK.pack(block_type, length) + body + struct.pack('I', length)
+
+    def write(self, frame, caplen=None, wirelen=None, timestamp=None):
+        if caplen is None:
+            caplen = len(frame)
+        caplen = min(caplen, self.snaplen)
+        if wirelen is None:
+            wirelen = caplen
+        if timestamp is None:
+            timestamp = time.time()
+        usec = int(timestamp * 1000000)
+        buffer = self.buffer
+        if self.pcapng:
+            padded = _pad4(caplen)
+            length = 32 + padded
+            buffer += PCAPNG_BLOCK.pack(PCAPNG_EPB, length)
+            buffer += PCAPNG_EPB_BODY.pack(0, usec >> 32, usec & 0xffffffff, caplen, wirelen)
+            buffer += frame[:caplen]
+            buffer += bytes(padded - caplen)
+            buffer += struct.pack('I', length)
+        else:
+            buffer += PCAP_RECORD.pack(usec // 1000000, usec % 1000000, caplen, wirelen)
+            buffer += frame[:caplen]
+        if len(buffer) >= self.buffer_size:
+            self.flush()
+        if self._should_rotate():
+            self.rotate()
+
+    def _should_rotate(self):
+        if self.rotate_bytes and self.file_bytes + len(self.buffer) >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds) and time.monotonic() - self.opened >= self.rotate_seconds
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file_bytes += len(self.buffer)
+            self.buffer.clear()
+        self.file.flush()
+
+    def rotate(self):
+        self.flush()
+        self.file.close()
+        self.index += 1
+        self._open()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Reads pcap (micro- or nanosecond, either byte order) and pcapng files through
+# mmap. Frames are memoryviews into the mapping, so replay never copies packet
+# data; they are only valid while the reader is open.
+class PcapReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self.file.close()
+            raise ValueError(f"{path} is empty")
+        self.view = memoryview(self.map)
+        magic = self.view[:4].tobytes()
+        if magic == struct.pack('<I', PCAPNG_SHB):
+            self.pcapng = True
+        elif magic in (struct.pack('<I', PCAP_MAGIC), struct.pack('>I', PCAP_MAGIC),
+                       struct.pack('<I', PCAP_MAGIC_NS), struct.pack('>I', PCAP_MAGIC_NS)):
+            self.pcapng = False
+        else:
+            self.close()
+            raise ValueError(f"{path} is not a pcap or pcapng file")
+
+    def __iter__(self):
+        return self._pcapng_frames() if self.pcapng else self._pcap_frames()
+
+    def _pcap_frames(self):
+        view = self.view
+        order = '<' if view[:4].tobytes() in (struct.pack('<I', PCAP_MAGIC),
+                                              struct.pack('<I', PCAP_MAGIC_NS)) else '>'
+        magic = struct.unpack_from(order + 'I', view, 0)[0]
+        scale = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+        self.linktype = struct.unpack_from(order + 'I', view, 20)[0]
+        record = struct.Struct(order + 'IIII')
+        offset = PCAP_HEADER.size
+        end = len(view)
+        while offset + record.size <= end:
+            sec, frac, caplen, wirelen = record.unpack_from(view, offset)
+            offset += record.size
+            if offset + caplen > end:  # truncated last record
+                return
+            yield view[offset:offset + caplen], caplen, wirelen, sec + frac * scale
+            offset += caplen
+
+    def _pcapng_frames(self):
+        view = self.view
+        end = len(view)
+        offset = 0
+        order = '<'
+        interfaces = []
+        while offset + 12 <= end:
+            block_type, length = struct.unpack_from(order + 'II', view, offset)
+            if block_type == PCAPNG_SHB:
+                # The byte-order magic decides how this whole section is read
+                order = '<' if view[offset + 8:offset + 12].tobytes() == struct.pack(
+                    '<I', PCAPNG_BYTE_ORDER) else '>'
+                block_type, length = struct.unpack_from(order + 'II', view, offset)
+                interfaces = []
+            if length < 12 or offset + length > end:
+                return
+            body = offset + 8
+            if block_type == PCAPNG_IDB:
+                linktype, _, snaplen = struct.unpack_from(order + 'HHI', view, body)
+                interfaces.append(self._tsresol(order, body + 8, offset + length - 4))
+                self.linktype = linktype
+            elif block_type == PCAPNG_EPB:
+                interface, high, low, caplen, wirelen = struct.unpack_from(order + 'IIIII', view, body)
+                data = body + 20
+                scale = interfaces[interface] if interface < len(interfaces) else 1e-6
+                yield view[data:data + caplen], caplen, wirelen, ((high << 32) | low) * scale
+            elif block_type == PCAPNG_SPB:
+                wirelen = struct.unpack_from(order + 'I', view, body)[0]
+                caplen = min(wirelen, length - 16)
+                yield view[body + 4:body + 4 + caplen], caplen, wirelen, None
+            offset += length
+
+    # Seconds per timestamp unit from an IDB's if_tsresol option (default usec)
+    def _tsresol(self, order, offset, end):
+        view = self.view
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(order + 'HH', view, offset)
+            if code == 0:
+                break
+            if code == PCAPNG_OPT_TSRESOL and length >= 1:
+                value = view[offset + 4]
+                return 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+            offset += 4 + _pad4(length)
+        return 1e-6
+
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # A caller still holds a frame; the mapping goes away with it
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
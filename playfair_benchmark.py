@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# Time Playfair encryption and decryption over growing messages. With the
+# digraph tables the time per letter should stay flat as the message grows;
+# the old implementation rebuilt the message for every filler and got slower
+# per letter the longer the text.
+import argparse
+import random
+import time
+
+import playfair_cypher
+
+def timed(work):
+    start = time.perf_counter()
+    result = work()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Playfair cipher')
+    parser.add_argument('--key', default='playfair example')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000, 5000000],
+                        help='message lengths in letters')
+    parser.add_argument('--chunk', type=int, default=1 << 16, help='streaming chunk size')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    _, schedule = timed(lambda: playfair_cypher.key_schedule(args.key + '!'))
+    _, cached = timed(lambda: playfair_cypher.key_schedule(args.key + '!'))
+    print(f"key schedule {schedule * 1e3:8.3f} ms, cached {cached * 1e6:.1f} us")
+
+    print(f"{'letters':>10} {'encrypt':>10} {'decrypt':>10} {'stream':>10}  ns/letter")
+    failed = False
+    for size in args.sizes:
+        message = ''.join(rng.choices(alphabet, k=size))
+        cipher_text, t_encrypt = timed(lambda: playfair_cypher.playfair(args.key, message))
+        plain_text, t_decrypt = timed(lambda: playfair_cypher.playfair(args.key, cipher_text, False))
+
+        def stream():
+            cipher = playfair_cypher.PlayfairCipher(args.key)
+            parts = [cipher.update(message[i:i + args.chunk]) for i in range(0, size, args.chunk)]
+            return ''.join(parts) + cipher.final()
+        streamed, t_stream = timed(stream)
+
+        print(f"{size:>10} {t_encrypt:9.3f}s {t_decrypt:9.3f}s {t_stream:9.3f}s  "
+              f"{t_encrypt / size * 1e9:.0f}")
+        # Decryption gives back the prepared message with its fillers
+        if streamed != cipher_text or plain_text != playfair_cypher.separate_same_letters(
+                playfair_cypher.prepare(message)):
+            print("MISMATCH: round trip or streaming output differs")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,20 +1,19 @@
+import functools
+
+FILLER = 'X'
+# Filler for a doubled X, and for padding a message that ends in X
+ALT_FILLER = 'Q'
+# Read J as I and drop everything but letters (after upper-casing)
+PREPARE = str.maketrans({chr(c): None for c in range(128) if not chr(c).isalpha()} | {'J': 'I'})
+
 def create_matrix(key):
-    key = key.upper()
-    matrix = [[0 for i in range(5)] for j in range(5)]
+    key = key.upper().replace('J', 'I')
     letters_added = []
-    row = 0
-    col = 0
 
     # Add the key to the matrix
     for letter in key:
-        if letter not in letters_added and letter.isalpha():  # Ensure only alphabetic letters
-            matrix[row][col] = letter
+        if letter not in letters_added and 'A' <= letter <= 'Z':  # Ensure only alphabetic letters
             letters_added.append(letter)
-            if col == 4:
-                col = 0
-                row += 1
-            else:
-                col += 1
 
     # Add the rest of the alphabet to the matrix
     for letter in range(65, 91):  # A=65 ... Z=90
@@ -22,58 +21,102 @@ def create_matrix(key):
             continue
         if chr(letter) not in letters_added:
             letters_added.append(chr(letter))
-    
+
+    return [letters_added[row * 5:row * 5 + 5] for row in range(5)]
+
+# Letter -> (row, col), so finding a letter is one dict lookup
+def letter_positions(matrix):
+    return {letter: (row, col) for row, letters in enumerate(matrix) for col, letter in enumerate(letters)}
+
+# Every digraph and what it turns into, for both directions: 625 entries each.
+# Cached, so a key's schedule is only worked out once.
+@functools.lru_cache(maxsize=256)
+def key_schedule(key):
+    matrix = create_matrix(key)
+    positions = letter_positions(matrix)
+    tables = []
+    for inc in (1, -1):
+        table = {}
+        for l1, (row1, col1) in positions.items():
+            for l2, (row2, col2) in positions.items():
+                if row1 == row2:  # Rule 2: Same row
+                    pair = matrix[row1][(col1 + inc) % 5] + matrix[row2][(col2 + inc) % 5]
+                elif col1 == col2:  # Rule 3: Same column
+                    pair = matrix[(row1 + inc) % 5][col1] + matrix[(row2 + inc) % 5][col2]
+                else:  # Rule 4: Rectangle
+                    pair = matrix[row1][col2] + matrix[row2][col1]
+                table[l1 + l2] = pair
+        tables.append(table)
+    return tuple(tables)
+
+def prepare(message):
+    return message.encode('ascii', 'ignore').decode('ascii').upper().translate(PREPARE)
+
+def _filler(letter):
+    return ALT_FILLER if letter == FILLER else FILLER
+
+# Split prepared letters into digraphs, putting a filler between doubled
+# letters. Returns the digraphs and a trailing letter still waiting for its
+# partner. One pass; the message is never rebuilt.
+def digraphs(letters):
+    pairs = []
+    append = pairs.append
     index = 0
-    for i in range(5):
-        for j in range(5):
-            matrix[i][j] = letters_added[index]
+    end = len(letters) - 1
+    while index < end:
+        l1 = letters[index]
+        l2 = letters[index + 1]
+        if l1 == l2:  # Insert a filler between repeated letters
+            append(l1 + _filler(l1))
             index += 1
-    return matrix
+        else:
+            append(l1 + l2)
+            index += 2
+    return pairs, letters[index:]
 
 # Add fillers if the same letter appears as a pair
 def separate_same_letters(message):
-    index = 0
-    while index < len(message):
-        l1 = message[index]
-        if index == len(message) - 1:  # Last character
-            message += 'X'
-            index += 2
-            continue
-        l2 = message[index + 1]
-        if l1 == l2:  # Insert 'X' between repeated letters
-            message = message[:index + 1] + "X" + message[index + 1:]
-        index += 2
-    return message
+    pairs, rest = digraphs(message)
+    if rest:
+        pairs.append(rest + _filler(rest))
+    return ''.join(pairs)
 
 # Return the index of a letter in the matrix
 def indexOf(letter, matrix):
-    for i in range(5):
-        try:
-            index = matrix[i].index(letter)
-            return (i, index)
-        except ValueError:
-            continue
-    return None  # In case the letter is not found (shouldn't happen)
+    return letter_positions(matrix).get(letter)
+
+# Streaming Playfair: update() takes the message in chunks of any size and
+# returns the text for every digraph completed so far; final() pads and flushes
+# a letter left over at the end
+class PlayfairCipher:
+    def __init__(self, key, encrypt=True):
+        self.table = key_schedule(key)[0 if encrypt else 1]
+        self.encrypt = encrypt
+        self.pending = ''
+
+    def update(self, chunk):
+        letters = self.pending + prepare(chunk)
+        if self.encrypt:
+            pairs, self.pending = digraphs(letters)
+        else:
+            # Ciphertext has no doubled digraphs, just pair it up
+            end = len(letters) & ~1
+            pairs = [letters[i:i + 2] for i in range(0, end, 2)]
+            self.pending = letters[end:]
+        return ''.join(map(self.table.__getitem__, pairs))
+
+    def final(self):
+        rest, self.pending = self.pending, ''
+        if not rest:
+            return ''
+        if not self.encrypt:
+            raise ValueError("Playfair ciphertext must have an even number of letters")
+        return self.table[rest + _filler(rest)]
 
 # Implementation of the Playfair cipher
 def playfair(key, message, encrypt=True):
-    inc = 1 if encrypt else -1
-    matrix = create_matrix(key)
-    message = message.upper().replace(' ', '')
-    message = separate_same_letters(message)
-    cipher_text = ''
-
-    for l1, l2 in zip(message[0::2], message[1::2]):
-        row1, col1 = indexOf(l1, matrix)
-        row2, col2 = indexOf(l2, matrix)
-        if row1 == row2:  # Rule 2: Same row
-            cipher_text += matrix[row1][(col1 + inc) % 5] + matrix[row2][(col2 + inc) % 5]
-        elif col1 == col2:  # Rule 3: Same column
-            cipher_text += matrix[(row1 + inc) % 5][col1] + matrix[(row2 + inc) % 5][col2]
-        else:  # Rule 4: Rectangle
-            cipher_text += matrix[row1][col2] + matrix[row2][col1]
-
-    return cipher_text
+    cipher = PlayfairCipher(key, encrypt)
+    return cipher.update(message) + cipher.final()
 
 # Main application
 if __name__ == '__main__':
@@ -1,32 +1,728 @@
+import argparse
+import asyncio
+import bisect
+import collections
+import ipaddress
+import itertools
+import json
+import os
+import signal
 import socket
+import sys
+import time
 from concurrent import futures
 
+import metrics
+
+MAX_PORT = 65535
+FULL_RANGE = range(0, MAX_PORT + 1)
+
+# Probe outcomes and connect round trips, kept in metrics.REGISTRY, for connect
+# and SYN scans alike. Results are counted per attempt: a probe that is retried
+# after getting no answer adds a timeout each time. Every SYN-ACK and RST is an
+# RTT sample; silence and unreachable errors are not.
+PROBES_SENT = metrics.REGISTRY.counter('scanner_probes_sent_total', 'Probes sent')
+PROBE_RESULTS = {
+    state: metrics.REGISTRY.counter('scanner_probes_total',
+                                    'Probes by result; closed means refused', result=state)
+    for state in ('open', 'closed', 'timeout', 'filtered')
+}
+CONNECT_RTT = metrics.REGISTRY.histogram('scanner_connect_rtt_seconds',
+                                         'Time for a connect to be accepted or refused')
+
+def record_probe(state, elapsed):
+    PROBE_RESULTS[state].inc()
+    if state == 'open' or state == 'closed':
+        CONNECT_RTT.record(elapsed)
+
 def verify_port(targetIp, p_Number, timeout):
-    TCPsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    TCPsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    TCPsock.settimeout(timeout)
-    try:
-        TCPsock.connect((targetIp, p_Number))
-        return (p_Number)
-    except:
-        return
+    # The with block closes the socket as soon as the probe is done instead of
+    # leaving the descriptor to the garbage collector
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as TCPsock:
+        TCPsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        TCPsock.settimeout(timeout)
+        PROBES_SENT.inc()
+        start = time.perf_counter()
+        try:
+            TCPsock.connect((targetIp, p_Number))
+            state = 'open'
+        except ConnectionRefusedError:
+            state = 'closed'
+        except socket.timeout:
+            state = 'timeout'
+        except OSError:
+            state = 'filtered'
+    record_probe(state, time.perf_counter() - start)
+    if state == 'open':
+        return p_Number
 
-def find_port(targetIp, timeout):
+def find_port(targetIp, timeout, ports=None):
     tpSize = 500
     portsToCheck = 10000
+    if ports is None:
+        ports = range(0, portsToCheck, 1)
     executor = futures.ThreadPoolExecutor(max_workers=tpSize)
     checks = [
         executor.submit(verify_port, targetIp, port, timeout)
-        for port in range(0, portsToCheck, 1)
+        for port in ports
     ]
+    open_ports = []
     for response in futures.as_completed(checks):
         if (response.result()):
             print('Port: {}'.format(response.result())," - Ok")
+            open_ports.append(response.result())
+    executor.shutdown()
+    return open_ports
+
+# Spaces out new connects to the same host so we never exceed `rate` per second.
+# A rate of None (or 0) disables the limit.
+class HostRateLimiter:
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.next_slot = {}
+
+    async def wait(self, host):
+        if not self.rate:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + 1.0 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+# Resolve once up front instead of letting every probe hit the resolver
+def resolve_target(targetIp):
+    family, _, _, _, address = socket.getaddrinfo(
+        targetIp, None, type=socket.SOCK_STREAM)[0]
+    return family, address[0]
+
+# Every in-flight probe holds one descriptor, so raise the soft limit if we can
+# and keep some headroom below it
+def clamp_in_flight(max_in_flight):
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return max_in_flight
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = max_in_flight + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        if hard != resource.RLIM_INFINITY:
+            wanted = min(wanted, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+            soft = wanted
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return max_in_flight
+    return max(1, min(max_in_flight, soft - 64))
+
+# Non-blocking connect probe. Returns 'open', 'closed' (refused), 'filtered'
+# (the network said unreachable) or 'timeout' (no answer at all).
+async def async_probe_port(family, address, p_Number, timeout):
+    loop = asyncio.get_running_loop()
+    TCPsock = socket.socket(family, socket.SOCK_STREAM)
+    TCPsock.setblocking(False)
+    PROBES_SENT.inc()
+    start = time.perf_counter()
+    try:
+        # asyncio.timeout avoids the extra task wait_for wraps around every probe
+        if hasattr(asyncio, 'timeout'):
+            async with asyncio.timeout(timeout):
+                await loop.sock_connect(TCPsock, (address, p_Number))
+        else:
+            await asyncio.wait_for(loop.sock_connect(TCPsock, (address, p_Number)), timeout)
+        state = 'open'
+    except ConnectionRefusedError:
+        state = 'closed'
+    except asyncio.TimeoutError:
+        state = 'timeout'
+    except OSError:
+        state = 'filtered'
+    finally:
+        TCPsock.close()
+    record_probe(state, time.perf_counter() - start)
+    return state
+
+# Probe timing in the spirit of nmap's -T templates: the starting timeout, the
+# bounds the adaptive timeout is kept within, how often a probe that got no
+# answer is retried, and the minimum delay between probes to one host.
+TimingTemplate = collections.namedtuple(
+    'TimingTemplate', ['initial', 'minimum', 'maximum', 'retries', 'delay'])
+
+TIMING_TEMPLATES = {
+    'paranoid': TimingTemplate(300.0, 0.1, 10.0, 5, 300.0),
+    'sneaky': TimingTemplate(15.0, 0.1, 10.0, 5, 15.0),
+    'polite': TimingTemplate(1.0, 0.1, 10.0, 3, 0.4),
+    'normal': TimingTemplate(1.0, 0.1, 10.0, 2, 0),
+    'aggressive': TimingTemplate(0.5, 0.1, 1.25, 1, 0),
+    'insane': TimingTemplate(0.25, 0.05, 0.3, 0, 0),
+}
+
+# A fixed timeout with no retries, which is how the scanner always used to behave
+def fixed_timing(timeout):
+    return TimingTemplate(timeout, timeout, timeout, 0, 0)
+
+# `timing` may be a template name, a TimingTemplate or None for a fixed timeout
+def pick_timing(timing, timeout):
+    if timing is None:
+        return fixed_timing(timeout)
+    if isinstance(timing, str):
+        return TIMING_TEMPLATES[timing]
+    return timing
+
+# An explicit rate wins over the template's delay between probes
+def probe_rate(rate, template):
+    if rate:
+        return rate
+    return 1.0 / template.delay if template.delay else None
+
+# Per-host connect timeout derived from measured RTTs the same way TCP computes
+# its retransmission timeout (RFC 6298): smoothed RTT plus four deviations.
+# A timeout doubles it up to the template's maximum, and the doubled value
+# stands until the next RTT is measured.
+class HostTiming:
+    def __init__(self, template):
+        self.template = template
+        self.srtt = None
+        self.rttvar = None
+        self.current = template.initial
+
+    def timeout(self):
+        return self.current
+
+    def observe(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.current = min(self.template.maximum,
+                           max(self.template.minimum, self.srtt + 4 * self.rttvar))
+
+    # A probe given `used` seconds went unanswered. Probes that were already in
+    # flight with the same timeout back it off only once between them.
+    def back_off(self, used):
+        self.current = max(self.current, min(self.template.maximum, 2 * used))
+
+# Probe with the host's current timeout and retry answers that never came. Both
+# SYN-ACKs and RSTs are RTT samples; only a probe that is still silent after the
+# last retry is reported as filtered.
+async def async_probe_adaptive(family, address, p_Number, timing):
+    loop = asyncio.get_running_loop()
+    for _ in range(timing.template.retries + 1):
+        start = loop.time()
+        timeout = timing.timeout()
+        state = await async_probe_port(family, address, p_Number, timeout)
+        if state == 'timeout':
+            timing.back_off(timeout)
+            continue
+        if state != 'filtered':
+            timing.observe(loop.time() - start)
+        return state
+    return 'filtered'
+
+# Returns the port number when the connect succeeds
+async def async_verify_port(family, address, p_Number, timeout):
+    if await async_probe_port(family, address, p_Number, timeout) == 'open':
+        return p_Number
+    return None
+
+# Scan `ports` (0-65535 by default) with at most `max_in_flight` connects outstanding.
+# A fixed set of workers pulls from one shared port iterator, so memory does not
+# grow with the size of the range.
+async def async_find_port(targetIp, timeout, ports=None, max_in_flight=1000, rate=None,
+                          on_open=None, timing=None):
+    family, address = resolve_target(targetIp)
+    port_iter = iter(FULL_RANGE if ports is None else ports)
+    template = pick_timing(timing, timeout)
+    host_timing = HostTiming(template)
+    limiter = HostRateLimiter(probe_rate(rate, template))
+    open_ports = []
+
+    async def worker():
+        for port in port_iter:
+            await limiter.wait(address)
+            if await async_probe_adaptive(family, address, port, host_timing) == 'open':
+                open_ports.append(port)
+                if on_open:
+                    on_open(port)
+
+    workers = clamp_in_flight(max_in_flight)
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return sorted(open_ports)
+
+def find_port_async(targetIp, timeout, ports=None, max_in_flight=1000, rate=None, timing=None):
+    def report(port):
+        print('Port: {}'.format(port), " - Ok")
+    return asyncio.run(async_find_port(targetIp, timeout, ports, max_in_flight, rate, report,
+                                       timing))
+
+ScanResult = collections.namedtuple('ScanResult', ['host', 'port', 'state'])
+
+# Turn a port spec such as "1-1024,3306,8080-8090" into a list of ranges
+def parse_ports(spec):
+    port_ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        first = int(first)
+        last = int(last) if last else first
+        if not 0 <= first <= last <= MAX_PORT:
+            raise ValueError(f"Invalid port range: {part}")
+        port_ranges.append(range(first, last + 1))
+    if not port_ranges:
+        raise ValueError(f"No ports in spec: {spec!r}")
+    return port_ranges
+
+# Lazily expand CIDR ranges, single addresses and host names. A /16 is never
+# materialised as a list.
+def expand_targets(targets):
+    if isinstance(targets, str):
+        targets = targets.replace(',', ' ').split()
+    for target in targets:
+        target = target.strip()
+        if not target or target.startswith('#'):
+            continue
+        if '/' in target:
+            network = ipaddress.ip_network(target, strict=False)
+            for address in network.hosts():
+                yield str(address)
+        else:
+            yield target
+
+# Sorted, merged set of inclusive [first, last] integer intervals
+class RangeSet:
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for first, last in intervals:
+            self.add_range(first, last)
+
+    def add(self, n):
+        self.add_range(n, n)
+
+    def add_range(self, first, last):
+        # Intervals i..j-1 overlap or touch [first, last] and are merged into it
+        i = bisect.bisect_left(self.ends, first - 1)
+        j = bisect.bisect_right(self.starts, last + 1)
+        if i < j:
+            first = min(first, self.starts[i])
+            last = max(last, self.ends[j - 1])
+        self.starts[i:j] = [first]
+        self.ends[i:j] = [last]
+
+    def __contains__(self, n):
+        i = bisect.bisect_right(self.starts, n) - 1
+        return i >= 0 and self.ends[i] >= n
+
+    def intervals(self):
+        return [[first, last] for first, last in zip(self.starts, self.ends)]
+
+    # The parts of `port_ranges` not covered by this set
+    def subtract(self, port_ranges):
+        for port_range in port_ranges:
+            lo, hi = port_range.start, port_range.stop - 1
+            i = bisect.bisect_left(self.ends, lo)
+            while lo <= hi:
+                if i == len(self.starts) or self.starts[i] > hi:
+                    yield range(lo, hi + 1)
+                    break
+                if self.starts[i] > lo:
+                    yield range(lo, self.starts[i])
+                lo = self.ends[i] + 1
+                i += 1
+
+# Checkpoint of a batch scan. Hosts are identified by their position in the
+# expanded target list, so the same targets and ports must be used on resume.
+# Finished hosts collapse into index ranges; only the hosts in the scheduler's
+# window carry per-port ranges, which keeps the file small for any sweep size.
+class ScanState:
+    VERSION = 1
+
+    def __init__(self, path, targets, hosts_file, ports, interval=5.0):
+        self.path = path
+        self.targets = list(targets)
+        self.hosts_file = hosts_file
+        self.ports = ports
+        self.interval = interval
+        self.hosts_done = RangeSet()
+        self.ports_done = {}
+        self.last_flush = time.monotonic()
+
+    @classmethod
+    def load(cls, path, interval=5.0):
+        with open(path, 'r') as file:
+            data = json.load(file)
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported scan state version in {path}")
+        state = cls(path, data['targets'], data['hosts_file'], data['ports'], interval)
+        state.hosts_done = RangeSet(data['hosts_done'])
+        state.ports_done = {int(index): RangeSet(intervals)
+                            for index, intervals in data['ports_done'].items()}
+        return state
+
+    def host_done(self, index):
+        return index in self.hosts_done
+
+    def remaining(self, index, port_ranges):
+        done = self.ports_done.get(index)
+        return list(done.subtract(port_ranges)) if done else port_ranges
+
+    def mark_port(self, index, port):
+        if index not in self.hosts_done:
+            self.ports_done.setdefault(index, RangeSet()).add(port)
+        self.maybe_flush()
+
+    def mark_host(self, index):
+        self.hosts_done.add(index)
+        self.ports_done.pop(index, None)
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    # Write to a temporary file and rename it so a crash mid-write never leaves
+    # a truncated checkpoint behind
+    def flush(self):
+        data = {
+            'version': self.VERSION,
+            'targets': self.targets,
+            'hosts_file': self.hosts_file,
+            'ports': self.ports,
+            'hosts_done': self.hosts_done.intervals(),
+            'ports_done': {str(index): done.intervals() for index, done in self.ports_done.items()},
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self.path)
+        self.last_flush = time.monotonic()
+
+# Hands out (host, port) pairs round-robin over a window of active hosts. A host
+# that already has `per_host` probes outstanding is skipped, so one slow or
+# filtered host only ever ties up its own share of the workers.
+class FairScheduler:
+    class Host:
+        def __init__(self, index, name, ports, timing):
+            self.index = index
+            self.name = name
+            self.ports = ports
+            self.in_flight = 0
+            self.pending = 0
+            self.exhausted = False
+            # Whether the host's 'unresolved' result has been sent
+            self.reported = False
+            # A probe was cancelled before its port was recorded, so the host
+            # cannot be finished in this run
+            self.abandoned = False
+            self.timing = HostTiming(timing)
+            self.address = asyncio.ensure_future(
+                asyncio.get_running_loop().getaddrinfo(name, None, type=socket.SOCK_STREAM))
+
+    def __init__(self, hosts, port_ranges, timing, window=256, per_host=32, state=None):
+        self.hosts = enumerate(hosts)
+        self.timing = timing
+        self.port_ranges = port_ranges
+        self.window = window
+        self.per_host = per_host
+        self.state = state
+        self.active = collections.deque()
+        self.released = asyncio.Event()
+
+    def _refill(self):
+        while self.hosts is not None and len(self.active) < self.window:
+            index, name = next(self.hosts, (None, None))
+            if name is None:
+                self.hosts = None
+                break
+            port_ranges = self.port_ranges
+            if self.state:
+                if self.state.host_done(index):
+                    continue
+                port_ranges = self.state.remaining(index, port_ranges)
+            ports = itertools.chain.from_iterable(port_ranges)
+            self.active.append(self.Host(index, name, ports, self.timing))
+
+    # Returns (host, port), or None once every pair has been handed out
+    async def take(self):
+        while True:
+            self._refill()
+            blocked = 0
+            while blocked < len(self.active):
+                host = self.active[0]
+                self.active.rotate(-1)
+                if host.in_flight >= self.per_host:
+                    blocked += 1
+                    continue
+                port = next(host.ports, None)
+                if port is None:
+                    self.drop(host)
+                    self._refill()
+                    continue
+                host.in_flight += 1
+                return host, port
+            if not self.active:
+                return None
+            # Every active host is at its limit; wait for a probe to finish
+            self.released.clear()
+            await self.released.wait()
+
+    def release(self, host):
+        host.in_flight -= 1
+        self._check_done(host)
+        self.released.set()
+
+    # Stop handing out ports for `host`
+    def drop(self, host):
+        host.exhausted = True
+        if host in self.active:
+            self.active.remove(host)
+        self._check_done(host)
+
+    # A reported result has reached the consumer
+    def consumed(self, host, port):
+        host.pending -= 1
+        if self.state and port is not None:
+            self.state.mark_port(host.index, port)
+        self._check_done(host)
+
+    # A host is finished once nothing is in flight, the consumer has seen all of
+    # its reported results and no probe was given up on
+    def _check_done(self, host):
+        if (host.exhausted and host.in_flight == 0 and host.pending == 0 and not host.abandoned
+                and self.state):
+            self.state.mark_host(host.index)
+
+# Scan every (host, port) pair and yield ScanResults as they complete. Only open
+# ports are reported unless `report_all` is set. Results go through a bounded
+# queue, so a slow consumer throttles the scan instead of growing memory. With a
+# ScanState, finished work is checkpointed and skipped when the state is reused.
+async def async_scan_batch(targets, ports, timeout, max_in_flight=1000, per_host_in_flight=32,
+                           host_window=256, rate=None, report_all=False, timing=None,
+                           state=None):
+    port_ranges = parse_ports(ports) if isinstance(ports, str) else list(ports)
+    template = pick_timing(timing, timeout)
+    scheduler = FairScheduler(expand_targets(targets), port_ranges, template,
+                              host_window, per_host_in_flight, state)
+    limiter = HostRateLimiter(probe_rate(rate, template))
+    results = asyncio.Queue(maxsize=max_in_flight)
+    done = object()
+
+    async def worker():
+        while True:
+            job = await scheduler.take()
+            if job is None:
+                return
+            host, port = job
+            # Reported ports are only checkpointed once the consumer has taken
+            # their result, so an interrupted scan can repeat a probe but never
+            # lose one
+            try:
+                try:
+                    family, _, _, _, address = (await host.address)[0]
+                except OSError:
+                    # Unresolvable name: report it once and stop scheduling it.
+                    # Its ports may already have run out, so `exhausted` says
+                    # nothing about whether it was reported.
+                    if not host.reported:
+                        host.reported = True
+                        host.pending += 1
+                        scheduler.drop(host)
+                        await results.put((host, ScanResult(host.name, None, 'unresolved')))
+                    continue
+                await limiter.wait(address[0])
+                state = await async_probe_adaptive(family, address[0], port, host.timing)
+                if report_all or state == 'open':
+                    host.pending += 1
+                    await results.put((host, ScanResult(host.name, port, state)))
+                elif scheduler.state:
+                    scheduler.state.mark_port(host.index, port)
+            except BaseException:
+                # Cancelled with the probe unfinished: its port stays unrecorded
+                host.abandoned = True
+                raise
+            finally:
+                scheduler.release(host)
+
+    async def run():
+        try:
+            await asyncio.gather(*(worker() for _ in range(clamp_in_flight(max_in_flight))))
+        finally:
+            if not stopping:
+                await results.put(done)
+
+    stopping = False
+    runner = asyncio.ensure_future(run())
+    try:
+        while True:
+            item = await results.get()
+            if item is done:
+                break
+            host, result = item
+            yield result
+            scheduler.consumed(host, result.port)
+        await runner
+    finally:
+        # The consumer stopped early: cancel outstanding probes so their sockets close
+        if not runner.done():
+            stopping = True
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+        if state:
+            state.flush()
+
+# Synchronous generator over async_scan_batch for callers without an event loop.
+# The loop only runs while the caller is waiting for the next result. Ctrl+C
+# during that wait cancels the pending step rather than interrupting the loop in
+# the middle of a callback, so the scan can still cancel its probes and write
+# its last checkpoint.
+def scan_batch(targets, ports, timeout, **options):
+    loop = asyncio.new_event_loop()
+    results = async_scan_batch(targets, ports, timeout, **options)
+
+    async def next_result():
+        return await results.__anext__()
+
+    try:
+        while True:
+            step = loop.create_task(next_result())
+            interrupted = []
+
+            def on_sigint(signum, frame):
+                interrupted.append(signum)
+                loop.call_soon_threadsafe(step.cancel)
+
+            try:
+                previous = signal.signal(signal.SIGINT, on_sigint)
+            except ValueError:  # not the main thread
+                previous = None
+            try:
+                result = loop.run_until_complete(step)
+            except StopAsyncIteration:
+                break
+            except asyncio.CancelledError:
+                if not interrupted:
+                    raise
+            finally:
+                if previous is not None:
+                    signal.signal(signal.SIGINT, previous)
+            # The step may have finished before the cancel landed; its result was
+            # never acknowledged, so a resumed scan probes that port again
+            if interrupted:
+                raise KeyboardInterrupt
+            yield result
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+
+def write_ndjson(results, out):
+    for result in results:
+        out.write(json.dumps(result._asdict()) + "\n")
+        out.flush()
+
+def read_hosts_file(path):
+    with open(path, 'r') as file:
+        for line in file:
+            yield line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TCP connect port scanner')
+    parser.add_argument('targets', nargs='*', help='IP addresses, host names or CIDR ranges')
+    parser.add_argument('-iL', '--hosts-file', help='read targets from a file, one per line')
+    parser.add_argument('-p', '--ports', default=f'0-{MAX_PORT}', help='e.g. "1-1024,3306,8080-8090"')
+    parser.add_argument('--timeout', type=float, default=1.0, help='fixed connect timeout in seconds')
+    parser.add_argument('-T', '--timing', choices=TIMING_TEMPLATES,
+                        help='adaptive per-host timeouts and retries instead of --timeout')
+    parser.add_argument('--in-flight', type=int, default=1000, help='maximum concurrent probes')
+    parser.add_argument('--per-host', type=int, default=32, help='maximum concurrent probes per host')
+    parser.add_argument('--rate', type=float, help='maximum new connects per second per host')
+    parser.add_argument('--all', action='store_true', help='also report closed and filtered ports')
+    parser.add_argument('--ndjson', action='store_true', help='stream results as NDJSON')
+    parser.add_argument('--state', help='checkpoint progress to this file')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the scan recorded in --state, skipping finished work')
+    parser.add_argument('--checkpoint-interval', type=float, default=5.0,
+                        help='seconds between checkpoint flushes')
+    parser.add_argument('--syn', action='store_true',
+                        help='half-open SYN scan from one raw socket (IPv4, needs root); '
+                             '--timeout is how long to wait for late replies')
+    parser.add_argument('--pps', type=float, default=10000, help='SYN scan packets per second, 0 for no limit')
+    parser.add_argument('--retries', type=int, default=1, help='SYN scan resends to silent ports')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve probe counters and connect RTTs as Prometheus text on this port')
+    parser.add_argument('--stats-interval', type=float,
+                        help='print probe counters and RTT percentiles to stderr every N seconds')
+    parser.add_argument('--profile', help='sample the scanner while it runs and write collapsed stacks here')
+    args = parser.parse_args(argv)
+    if args.syn and (args.state or args.resume):
+        parser.error('--syn scans cannot be checkpointed')
+
+    state = None
+    if args.resume:
+        if not args.state:
+            parser.error('--resume requires --state')
+        state = ScanState.load(args.state, args.checkpoint_interval)
+        if args.targets and args.targets != state.targets:
+            parser.error(f"targets differ from the ones recorded in {args.state}")
+        args.targets, args.hosts_file, args.ports = state.targets, state.hosts_file, state.ports
+    elif args.state:
+        state = ScanState(args.state, args.targets, args.hosts_file, args.ports,
+                          args.checkpoint_interval)
+
+    instruments = metrics.Instruments(metrics.REGISTRY, args.metrics_port, args.stats_interval,
+                                      args.profile)
+    try:
+        instruments.start()
+    except OSError as e:
+        parser.error(f"Cannot serve metrics on port {args.metrics_port}: {e}")
+    try:
+        if not args.targets and not args.hosts_file:
+            targetIp = input("Enter IP address to test: ")
+            timeout = int(input("Timeout connection in seconds: "))
+            find_port_async(targetIp, timeout)
+            return
 
-def main():
-    targetIp = input("Enter IP address to test: ")
-    timeout = int(input("Timeout connection in seconds: "))
-    find_port(targetIp, timeout)
+        targets = args.targets
+        if args.hosts_file:
+            targets = itertools.chain(targets, read_hosts_file(args.hosts_file))
+        if args.syn:
+            # Imported here because syn_scan builds on this module
+            import syn_scan
+            try:
+                port_ranges = parse_ports(args.ports)
+            except ValueError as e:
+                parser.error(str(e))
+            # Opened up front so only a failure to get the raw socket is
+            # reported as missing privileges
+            try:
+                sock = syn_scan.open_syn_socket()
+            except PermissionError:
+                parser.error('--syn needs root or CAP_NET_RAW')
+            results = syn_scan.syn_scan(targets, port_ranges, args.pps, args.timeout, args.retries,
+                                        args.all, sock=sock)
+        else:
+            results = scan_batch(targets, args.ports, args.timeout, max_in_flight=args.in_flight,
+                                 per_host_in_flight=args.per_host, rate=args.rate, report_all=args.all,
+                                 timing=args.timing, state=state)
+        try:
+            if args.ndjson:
+                write_ndjson(results, sys.stdout)
+            else:
+                for result in results:
+                    print(f"{result.host} Port: {result.port} - {result.state}")
+        except KeyboardInterrupt:
+            # Closing the generator cancels the probes and writes a final checkpoint
+            results.close()
+            if state:
+                print(f"\nScan interrupted, resume with --state {state.path} --resume",
+                      file=sys.stderr)
+    finally:
+        instruments.stop()
 
 if __name__ == "__main__":
     main()
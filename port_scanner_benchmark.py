@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# Compare the thread-pool scanner against the asyncio engine on a local fixture.
+# Listening sockets are opened on 127.0.0.1 inside the scanned window so both
+# engines should report exactly the same open ports. It also checks that a
+# checkpointed scan interrupted mid-probe leaves the unprobed ports for --resume.
+import argparse
+import contextlib
+import io
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+import port_scanner
+
+# Bind up to `count` listeners on ports taken from `candidates`. Ports that are
+# already in use on this machine are skipped.
+def bind_listeners(candidates, count, backlog=128):
+    listeners = []
+    for port in candidates:
+        if len(listeners) == count:
+            break
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(('127.0.0.1', port))
+        except OSError:
+            sock.close()
+            continue
+        sock.listen(backlog)
+        listeners.append(sock)
+    return listeners
+
+# A listener whose accept queue is full silently drops new SYNs, which looks
+# exactly like a filtered port: the probe has to wait for its timeout.
+def stall(listener):
+    fillers = []
+    for _ in range(3):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            sock.connect(listener.getsockname())
+        except BlockingIOError:
+            pass
+        fillers.append(sock)
+    return fillers
+
+# Ctrl+C a checkpointed scan while probes to stalled ports are still in flight
+# and return the stalled ports the checkpoint wrongly records as done. A resumed
+# scan would never probe those. Must run on the main thread.
+def lost_on_interrupt(base, timeout=2.0):
+    window = range(base, base + 16)
+    stalled = bind_listeners(window[:4], 4, backlog=0)
+    fixture = list(stalled)
+    for sock in stalled:
+        fixture.extend(stall(sock))
+    spec = f"{window.start}-{window.stop - 1}"
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'scan.json')
+            state = port_scanner.ScanState(path, ['127.0.0.1'], None, spec)
+            results = port_scanner.scan_batch(['127.0.0.1'], spec, timeout, state=state)
+            # The closed ports answer at once; the stalled ones are still waiting
+            interrupt = threading.Timer(timeout / 4, os.kill, (os.getpid(), signal.SIGINT))
+            interrupt.start()
+            try:
+                list(results)
+            except KeyboardInterrupt:
+                results.close()
+            finally:
+                interrupt.cancel()
+            state = port_scanner.ScanState.load(path)
+            if state.host_done(0):
+                remaining = set()
+            else:
+                remaining = set(port for ports in state.remaining(0, port_scanner.parse_ports(spec))
+                                for port in ports)
+            return sorted(sock.getsockname()[1] for sock in stalled
+                          if sock.getsockname()[1] not in remaining)
+    finally:
+        for sock in fixture:
+            sock.close()
+
+def timed(label, scan, ports):
+    start = time.perf_counter()
+    # find_port prints every hit; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        found = scan()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {elapsed:8.3f} s  {len(ports) / elapsed:10.0f} probes/s  open={len(found)}")
+    return sorted(found), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark find_port against the asyncio engine')
+    parser.add_argument('--base', type=int, default=20000, help='first port of the scanned window')
+    parser.add_argument('--span', type=int, default=10000, help='number of ports to scan')
+    parser.add_argument('--listeners', type=int, default=50, help='open ports in the fixture')
+    parser.add_argument('--stalled', type=int, default=2000,
+                        help='ports that never answer, so probes run into the timeout')
+    parser.add_argument('--in-flight', type=int, default=2000, help='asyncio in-flight limit')
+    parser.add_argument('--timeout', type=float, default=1.0)
+    parser.add_argument('--timing', default='aggressive', choices=port_scanner.TIMING_TEMPLATES,
+                        help='template for the adaptive-timeout run')
+    args = parser.parse_args()
+
+    ports = range(args.base, args.base + args.span)
+    step = max(1, args.span // max(1, args.listeners + args.stalled))
+    candidates = iter(range(args.base, args.base + args.span, step))
+    listeners = bind_listeners(candidates, args.listeners)
+    expected = sorted(sock.getsockname()[1] for sock in listeners)
+    stalled = bind_listeners(candidates, args.stalled, backlog=0)
+    fixture = listeners + stalled
+    for sock in stalled:
+        fixture.extend(stall(sock))
+    print(f"fixture: {len(ports)} ports, {len(listeners)} open, {len(stalled)} filtered")
+    try:
+        threaded, t_threads = timed('threads', lambda: port_scanner.find_port(
+            '127.0.0.1', args.timeout, ports), ports)
+        async_found, t_async = timed('asyncio', lambda: port_scanner.find_port_async(
+            '127.0.0.1', args.timeout, ports, args.in_flight), ports)
+        adaptive, t_adaptive = timed('adaptive', lambda: port_scanner.find_port_async(
+            '127.0.0.1', args.timeout, ports, args.in_flight, timing=args.timing), ports)
+    finally:
+        for sock in fixture:
+            sock.close()
+
+    print(f"speedup      {t_threads / t_async:8.2f}x (asyncio), {t_threads / t_adaptive:.2f}x (adaptive)")
+    status = 0
+    if not (threaded == async_found == adaptive == expected):
+        print("MISMATCH: engines disagree with the fixture")
+        status = 1
+    lost = lost_on_interrupt(args.base + args.span)
+    if lost:
+        print(f"MISMATCH: an interrupted scan checkpointed unprobed ports {lost} as done")
+        status = 1
+    return status
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+# Half-open (SYN) scanning for port_scanner. One raw socket sends bare SYNs at
+# a paced rate and a receiver thread reads the replies from the same socket. The
+# sequence number of every SYN is a keyed hash of the target address and port,
+# so a SYN-ACK or RST is matched to its probe by its acknowledgement number
+# alone; only send times are kept, for the RTT metrics, and only for `wait`
+# seconds. The kernel answers each SYN-ACK with a RST of its own, which tears
+# the half-open connection down.
+# IPv4 only; needs root or CAP_NET_RAW.
+#   port_scanner.py --syn --pps 20000 -p 1-65535 10.0.0.0/24
+import collections
+import errno
+import hashlib
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+from port_scanner import CONNECT_RTT, PROBE_RESULTS, PROBES_SENT, ScanResult, expand_targets, parse_ports
+
+FIN, SYN, RST, ACK = 0x01, 0x02, 0x04, 0x10
+# Source port, destination port, sequence, acknowledgement, data offset and
+# flags, window, checksum, urgent pointer, then an MSS option as most stacks send
+SYN_HEADER = struct.Struct('!HHIIHHHHI')
+REPLY_HEADER = struct.Struct('!HHIIH')
+OFFSET_FLAGS = (SYN_HEADER.size // 4) << 12 | SYN
+WINDOW = 1024
+MSS_OPTION = 0x020405b4
+
+# The local address the kernel would use to reach `address`
+def source_address(address):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.connect((address, 9))
+        return probe.getsockname()[0]
+
+# The sequence number of the probe to `address` (packed) and `port`
+def cookie(key, address, port):
+    digest = hashlib.blake2s(address + port.to_bytes(2, 'big'), digest_size=4, key=key).digest()
+    return int.from_bytes(digest, 'big')
+
+def _fold(total):
+    total = (total & 0xffff) + (total >> 16)
+    total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+# Builds the SYNs. The kernel fills in the IP header, so the source address in
+# the TCP checksum is the one it routes each host from, unless `source` fixes
+# it. The parts of the checksum that do not change between probes to a host,
+# that source among them, are summed once per host.
+class SynBuilder:
+    def __init__(self, source, source_port, key):
+        self.source = source and socket.inet_aton(source)
+        self.source_port = source_port
+        self.key = key
+        self.constant = (socket.IPPROTO_TCP + SYN_HEADER.size + source_port + OFFSET_FLAGS + WINDOW
+                         + (MSS_OPTION >> 16) + (MSS_OPTION & 0xffff))
+        self.host_sums = {}
+
+    def packet(self, address, port):
+        base = self.host_sums.get(address)
+        if base is None:
+            source = self.source or socket.inet_aton(source_address(socket.inet_ntoa(address)))
+            base = self.host_sums[address] = (self.constant + sum(struct.unpack('!2H', source))
+                                              + sum(struct.unpack('!2H', address)))
+        seq = cookie(self.key, address, port)
+        checksum = _fold(base + port + (seq >> 16) + (seq & 0xffff))
+        return SYN_HEADER.pack(self.source_port, port, seq, 0, OFFSET_FLAGS, WINDOW, checksum, 0, MSS_OPTION)
+
+# (address, port, state) of a reply to one of our SYNs, or None for anything
+# else arriving on the raw socket. A reply acknowledges our cookie plus one.
+def parse_reply(packet, source_port, key):
+    if len(packet) < 20 or packet[9] != socket.IPPROTO_TCP:
+        return None
+    offset = (packet[0] & 0x0f) * 4
+    if len(packet) < offset + REPLY_HEADER.size:
+        return None
+    sport, dport, _, ack, offset_flags = REPLY_HEADER.unpack_from(packet, offset)
+    if dport != source_port:
+        return None
+    flags = offset_flags & 0x3f
+    if flags & (SYN | ACK) == SYN | ACK:
+        state = 'open'
+    elif flags & RST:
+        state = 'closed'
+    else:
+        return None
+    address = packet[12:16]
+    if ack != (cookie(key, address, sport) + 1) & 0xffffffff:
+        return None
+    return address, sport, state
+
+# Spaces sends out to `rate` packets per second, sleeping in small batches
+class Pacer:
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.sent = 0
+
+    def wait(self):
+        if not self.rate:
+            return
+        self.sent += 1
+        ahead = self.sent / self.rate - (time.monotonic() - self.start)
+        if ahead > 0.002:
+            time.sleep(ahead)
+
+# IPv4 addresses of the targets, packed, with the name each was given as
+def resolve_hosts(targets):
+    hosts = {}
+    unresolved = []
+    for name in expand_targets(targets):
+        try:
+            address = socket.getaddrinfo(name, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            unresolved.append(name)
+            continue
+        hosts.setdefault(socket.inet_aton(address), name)
+    return hosts, unresolved
+
+# The raw socket probes go out on and replies come in on. Raises
+# PermissionError without root or CAP_NET_RAW.
+def open_syn_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
+    # Replies come in as fast as probes go out; as root the buffer can be made
+    # larger than net.core.rmem_max allows
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_RCVBUFFORCE', 33), 1 << 24)
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+    sock.settimeout(0.1)
+    return sock
+
+# SYN-scan every port in `ports` on every target and yield ScanResults as the
+# replies arrive. Probes go out port by port across all hosts so no host sees
+# a burst. Ports still silent are probed again up to `retries` times and, with
+# `report_all`, reported as filtered at the end. `sock` is a socket from
+# open_syn_socket, opened here when not given; either way it is closed here.
+def syn_scan(targets, ports, pps=10000, wait=1.0, retries=1, report_all=False, source_port=None,
+             sock=None):
+    port_ranges = parse_ports(ports) if isinstance(ports, str) else list(ports)
+    hosts, unresolved = resolve_hosts(targets)
+    for name in unresolved:
+        yield ScanResult(name, None, 'unresolved')
+    if not hosts:
+        if sock is not None:
+            sock.close()
+        return
+    sock = sock or open_syn_socket()
+    source_port = source_port or 32768 + int.from_bytes(os.urandom(2), 'big') % 28000
+    key = os.urandom(16)
+    builder = SynBuilder(None, source_port, key)
+    destinations = {address: (socket.inet_ntoa(address), 0) for address in hosts}
+    answered = set()
+    failures = []
+    results = queue.Queue()
+    sending_done = threading.Event()
+    stop = threading.Event()
+    # Send times of the probes still waiting for a reply, for RTTs and for
+    # counting one timeout per unanswered send as the connect scan does. A probe
+    # times out once `wait` passes without a reply; expiring as new probes go out
+    # keeps at most `pps * wait` of them here.
+    sent_at = {}
+    sends = collections.deque()
+
+    def expire(before):
+        while sends and sends[0][0] < before:
+            at, target = sends.popleft()
+            if sent_at.get(target) == at and sent_at.pop(target, None) is not None:
+                PROBE_RESULTS['timeout'].inc()
+
+    def receive():
+        while not stop.is_set():
+            try:
+                packet = sock.recv(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            reply = parse_reply(packet, source_port, key)
+            if reply is None or reply[0] not in hosts:
+                continue
+            address, port, state = reply
+            at = sent_at.pop((address, port), None)
+            if at is not None:
+                CONNECT_RTT.record(time.monotonic() - at)
+            if (address, port) not in answered:
+                answered.add((address, port))
+                PROBE_RESULTS[state].inc()
+                results.put(ScanResult(hosts[address], port, state))
+
+    def send():
+        pacer = Pacer(pps)
+        try:
+            for attempt in range(retries + 1):
+                if attempt:
+                    time.sleep(wait)
+                for port_range in port_ranges:
+                    for port in port_range:
+                        for address in hosts:
+                            if (address, port) in answered:
+                                continue
+                            pacer.wait()
+                            # A resend means the last send went unanswered. The
+                            # time is taken first so a quick reply finds it.
+                            if sent_at.pop((address, port), None) is not None:
+                                PROBE_RESULTS['timeout'].inc()
+                            now = time.monotonic()
+                            sent_at[address, port] = now
+                            sends.append((now, (address, port)))
+                            _send(sock, builder.packet(address, port), destinations[address])
+                            PROBES_SENT.inc()
+                            expire(now - wait)
+                            if stop.is_set():
+                                return
+        except OSError as e:
+            failures.append(e)
+        finally:
+            sending_done.set()
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    sender = threading.Thread(target=send, daemon=True)
+    receiver.start()
+    sender.start()
+    try:
+        deadline = None
+        while True:
+            try:
+                yield results.get(timeout=0.05)
+                continue
+            except queue.Empty:
+                pass
+            if sending_done.is_set():
+                # Give the last probes `wait` seconds to be answered
+                deadline = deadline or time.monotonic() + wait
+                if time.monotonic() >= deadline and results.empty():
+                    break
+        if failures:
+            raise failures[0]
+        expire(float('inf'))
+        if report_all:
+            for port_range in port_ranges:
+                for port in port_range:
+                    for address, name in hosts.items():
+                        if (address, port) not in answered:
+                            yield ScanResult(name, port, 'filtered')
+    finally:
+        stop.set()
+        sender.join()
+        receiver.join()
+        sock.close()
+
+# sendto, backing off while the kernel's send queue is full
+def _send(sock, packet, destination):
+    while True:
+        try:
+            sock.sendto(packet, destination)
+            return
+        except socket.timeout:
+            continue
+        except OSError as e:
+            if e.errno != errno.ENOBUFS:
+                raise
+            time.sleep(0.001)
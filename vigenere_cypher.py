@@ -1,46 +1,36 @@
 #!/usr/bin/python3
 #  Vigenere Cipher
+from classic_cipher import vigenere
+
 # This function generates the key in a cyclic manner
 # with it's length isn't equal to the length of original text
 def generateKey(string, key):
-   key = list(key)
-   if len(string) == len(key):
-       return(key)
-   else:
-       for i in range(len(string) -
-                      len(key)):
-           key.append(key[i % len(key)])
-   return("" . join(key))
+   if not key:
+       return key
+   return (key * (len(string) // len(key) + 1))[:max(len(string), len(key))]
 
 # This function returns the encrypted text generated
+# Letters are shifted by the key letters in turn; other characters pass through
 def cipherText(string, key):
-   cipher_text = []
-   for i in range(len(string)):
-       x = (ord(string[i]) +
-            ord(key[i])) % 26
-       x += ord('A')
-       cipher_text.append(chr(x))
-   return("" . join(cipher_text))
+   return vigenere(string, key)
 
 # This function decrypts and returns the original text
 def originalText(cipher_text, key):
-   orig_text = []
-   for i in range(len(cipher_text)):
-       x = (ord(cipher_text[i]) -
-            ord(key[i]) + 26) % 26
-       x += ord('A')
-       orig_text.append(chr(x))
-   return("" . join(orig_text))
+   return vigenere(cipher_text, key, decrypt=True)
+
+def main():
+   # data input
+   string = input("Type the Text to encrypt: ")
+   keyword = input("Type the keyword to use it: ")
 
-# data input
-string = input("Type the Text to encrypt: ")
-keyword = input("Type the keyword to use it: ")
+   # the input must be uppercase, so we use the function upper() with the string
+   key = generateKey(string.upper(), keyword.upper())
+   cipher_text = cipherText(string.upper(),key.upper())
 
-# the input must be uppercase, so we use the function upper() with the string
-key = generateKey(string.upper(), keyword.upper())
-cipher_text = cipherText(string.upper(),key.upper())
+   # show the information.
+   print("Ciphertext :", cipher_text)
+   print("Original/Decrypted Text :",
+   originalText(cipher_text, key))
 
-# show the information.
-print("Ciphertext :", cipher_text)
-print("Original/Decrypted Text :",
-originalText(cipher_text, key))
+if __name__ == "__main__":
+   main()